@@ -100,6 +100,8 @@ class IPAMFixture(fixtures.Fixture):
         if do_cleanup:
             self.project_fixture_obj.vnc_lib_h.network_ipam_delete(
                 self.fq_name)
+            self.api_s_inspect.invalidate_object('ipam', list(self.fq_name),
+                                                 self.ipam_id)
         else:
             self.logger.info('Skipping the deletion of IPAM %s' % self.fq_name)
             self.verify_is_run = False
@@ -1,4 +1,6 @@
+import time
 import fixtures
+from multiprocessing.pool import ThreadPool
 from util import *
 from contrail_fixtures import *
 from fabric.context_managers import settings, hide
@@ -7,9 +9,11 @@ from fabric.context_managers import settings, hide
 class MockGeneratorFixture(fixtures.Fixture):
 
     '''
-    Fixture to handle creation, verification and deletion of mock generator. 
+    Fixture to handle creation, verification and deletion of mock generator.
     '''
 
+    MOCK_GENERATOR = '/opt/contrail/vrouter-venv/bin/run_mock_generator'
+
     def __init__(self, connections, inputs, num_generators,
                  num_instances_per_generator, num_networks,
                  num_flows_per_instance):
@@ -21,49 +25,258 @@ class MockGeneratorFixture(fixtures.Fixture):
         self.num_instances_per_generator = num_instances_per_generator
         self.num_networks = num_networks
         self.num_flows_per_instance = num_flows_per_instance
+        # [(host_ip, num_generators, pid)] of the running processes
+        self.shards = []
     # end __init__
 
     def setUp(self):
         super(MockGeneratorFixture, self).setUp()
-        ncomputes = len(self.inputs.compute_ips)
-        ngens_per_host = self.num_generators / ncomputes
-        nprocess_per_host = ngens_per_host / self.MAX_GENERATORS_PER_PROCESS
-        if ngens_per_host % self.MAX_GENERATORS_PER_PROCESS:
-            nprocess_per_host = nprocess_per_host + 1
-        for host_ip in self.inputs.compute_ips:
-            index = self.inputs.compute_ips.index(host_ip)
-            ncollectors = len(self.inputs.collector_ips)
-            collector_ip = self.inputs.collector_ips[index % ncollectors]
-            collector = collector_ip + ':8086'
-            cmd = "/opt/contrail/vrouter-venv/bin/run_mock_generator --collectors " + \
-                collector
-            username = self.inputs.host_data[host_ip]['username']
-            password = self.inputs.host_data[host_ip]['password']
-            for num in range(nprocess_per_host):
-                if num == nprocess_per_host - 1 and ngens_per_host % self.MAX_GENERATORS_PER_PROCESS:
-                    ngens = ngens_per_host % self.MAX_GENERATORS_PER_PROCESS
-                else:
-                    ngens = self.MAX_GENERATORS_PER_PROCESS
-                cmd_ngen = " --num_generators " + str(ngens)
-                cmd_instances = " --num_instances_per_generator " + \
-                    str(self.num_instances_per_generator)
-                cmd_networks = " --num_networks " + str(self.num_networks)
-                cmd_flows = " --num_flows_per_instance " + \
-                    str(self.num_flows_per_instance)
-                issue_cmd = cmd + cmd_ngen + \
-                    cmd_instances + cmd_networks + cmd_flows
-                self.logger.info('Starting %s in %s' %
-                                 (issue_cmd, self.get_node_name(host_ip)))
-                output = self.inputs.run_cmd_on_server(host_ip, issue_cmd,
-                                                       username, password, False)
+        self.add_generators(self.num_generators)
     # end setUp
 
+    def get_shards(self, num_generators):
+        '''Splits num_generators across the computes in processes of at
+        most MAX_GENERATORS_PER_PROCESS generators; returns the list of
+        (host_ip, num_generators) of the processes to start.
+        '''
+        ncomputes = len(self.inputs.compute_ips)
+        shards = []
+        for index, host_ip in enumerate(self.inputs.compute_ips):
+            ngens_per_host = num_generators / ncomputes
+            if index < num_generators % ncomputes:
+                ngens_per_host += 1
+            while ngens_per_host > 0:
+                ngens = min(ngens_per_host, self.MAX_GENERATORS_PER_PROCESS)
+                shards.append((host_ip, ngens))
+                ngens_per_host -= ngens
+        return shards
+    # end get_shards
+
+    def start_shard(self, host_ip, ngens):
+        index = self.inputs.compute_ips.index(host_ip)
+        ncollectors = len(self.inputs.collector_ips)
+        collector_ip = self.inputs.collector_ips[index % ncollectors]
+        issue_cmd = '%s --collectors %s:8086 --num_generators %s ' \
+            '--num_instances_per_generator %s --num_networks %s ' \
+            '--num_flows_per_instance %s' % (
+                self.MOCK_GENERATOR, collector_ip, ngens,
+                self.num_instances_per_generator, self.num_networks,
+                self.num_flows_per_instance)
+        self.logger.info('Starting %s in %s' %
+                         (issue_cmd, self.get_node_name(host_ip)))
+        username = self.inputs.host_data[host_ip]['username']
+        password = self.inputs.host_data[host_ip]['password']
+        output = self.inputs.run_cmd_on_server(
+            host_ip, 'nohup %s > /dev/null 2>&1 & echo $!' % issue_cmd,
+            username, password, False)
+        pid = output.strip().split()[-1] if output else None
+        if not pid or not pid.isdigit():
+            self.logger.error('Unable to start mock generator in %s: %s' %
+                              (self.get_node_name(host_ip), output))
+            return None
+        return (host_ip, ngens, pid)
+    # end start_shard
+
+    def add_generators(self, num_generators):
+        '''Starts num_generators more generators, all the shards in
+        parallel. Returns the number of generators started.
+        '''
+        shards = self.get_shards(num_generators)
+        if not shards:
+            return 0
+        pool = ThreadPool(len(shards))
+        try:
+            started = pool.map(lambda shard: self.start_shard(*shard), shards)
+        finally:
+            pool.close()
+        started = [shard for shard in started if shard]
+        self.shards.extend(started)
+        return sum(shard[1] for shard in started)
+    # end add_generators
+
+    def get_num_generators(self):
+        return sum(shard[1] for shard in self.shards)
+
+    def stop_generators(self):
+        for host_ip in set(shard[0] for shard in self.shards):
+            pids = [shard[2] for shard in self.shards if shard[0] == host_ip]
+            self.inputs.run_cmd_on_server(
+                host_ip, 'kill %s' % ' '.join(pids),
+                self.inputs.host_data[host_ip]['username'],
+                self.inputs.host_data[host_ip]['password'], False)
+        self.shards = []
+    # end stop_generators
+
     def get_node_name(self, ip):
         return self.inputs.host_data[ip]['name']
     # end get_node_name
 
     def cleanUp(self):
         super(MockGeneratorFixture, self).cleanUp()
+        self.stop_generators()
     # end cleanUp
 
 # end class MockGeneratorFixture
+
+
+class GeneratorScaleDriver(object):
+
+    '''
+    Ramps up the number of mock generators in steps and measures at every
+    step how the collectors keep up.
+
+    At each step, after the generators settled, the collectors UVEs are
+    sampled every interval secs: the received bytes and messages give the
+    ingestion rate, the generator UVEs of a sample of the new generators
+    give their connection state and the messages they failed to send.
+    The knee is the first step at which the ingestion rate per generator
+    falls more than tolerance below the one of the first step, generators
+    fail to connect, or messages get dropped.
+    '''
+
+    GEN_MODULE = 'VRouterAgent'
+    GEN_NODE_TYPE = 'Compute'
+    # ModuleClientState.session_stats counters of messages not sent
+    DROP_COUNTERS = ('num_send_msg_fail', 'num_send_buffer_fail')
+    NUM_SAMPLED_GENERATORS = 10
+
+    def __init__(self, fixture, connections, steps, settle_time=60,
+                 interval=10, samples=3, tolerance=0.2):
+        self.fixture = fixture
+        self.inputs = fixture.inputs
+        self.logger = fixture.logger
+        self.ops_inspect = connections.ops_inspects
+        self.steps = steps
+        self.settle_time = settle_time
+        self.interval = interval
+        self.samples = samples
+        self.tolerance = tolerance
+        self.results = []
+    # end __init__
+
+    def get_collector_counters(self):
+        '''Returns the total bytes and messages received by the collectors
+        and the number of generators connected to them.
+        '''
+        counters = {'bytes': 0, 'calls': 0, 'generators': 0}
+        for ip in self.inputs.collector_ips:
+            self.ops_inspect[ip].invalidate_cache()
+            uve = self.ops_inspect[ip].get_ops_collector(
+                collector=self.inputs.host_data[ip]['name'])
+            if not uve:
+                self.logger.warn('No collector uve from %s' % ip)
+                continue
+            rx_stats = uve.get_attr('Collector', 'rx_socket_stats') or {}
+            for counter in ('bytes', 'calls'):
+                counters[counter] += int(rx_stats.get(counter, 0))
+            counters['generators'] += len(
+                uve.get_attr('Collector', 'generator_infos') or [])
+        return counters
+    # end get_collector_counters
+
+    def get_generator_state(self, shards):
+        '''Returns the number of sampled generators of shards connected to
+        a collector and the messages they failed to send.
+        '''
+        state = {'sampled': 0, 'established': 0, 'dropped': 0}
+        ops = self.ops_inspect[self.inputs.collector_ips[0]]
+        ops.invalidate_cache()
+        per_shard = max(1, self.NUM_SAMPLED_GENERATORS / max(len(shards), 1))
+        for host_ip, ngens, pid in shards:
+            hostname = self.fixture.get_node_name(host_ip)
+            for num in range(min(ngens, per_shard)):
+                state['sampled'] += 1
+                # the mock generators of a process are <hostname>-<pid>-<n>
+                uve = ops.get_ops_generator(
+                    generator='%s-%s-%s' % (hostname, pid, num),
+                    moduleid=self.GEN_MODULE, node_type=self.GEN_NODE_TYPE)
+                if not uve:
+                    continue
+                client_info = uve.get_attr('Client', 'client_info') or {}
+                if client_info.get('status') == 'Established':
+                    state['established'] += 1
+                session_stats = uve.get_attr('Client', 'session_stats') or {}
+                state['dropped'] += sum(int(session_stats.get(counter, 0))
+                                        for counter in self.DROP_COUNTERS)
+        return state
+    # end get_generator_state
+
+    def measure(self, num_generators, shards):
+        first = last = self.get_collector_counters()
+        first_time = last_time = time.time()
+        rates = []
+        for num in range(self.samples):
+            time.sleep(self.interval)
+            counters = self.get_collector_counters()
+            now = time.time()
+            rates.append((counters['calls'] - last['calls']) /
+                         (now - last_time))
+            last, last_time = counters, now
+        elapsed = last_time - first_time
+        result = {'generators': num_generators,
+                  'connected': last['generators'],
+                  'bytes_per_sec': (last['bytes'] - first['bytes']) / elapsed,
+                  'msgs_per_sec': (last['calls'] - first['calls']) / elapsed,
+                  'min_msgs_per_sec': min(rates)}
+        result['msgs_per_sec_per_generator'] = \
+            result['msgs_per_sec'] / max(num_generators, 1)
+        result.update(self.get_generator_state(shards))
+        return result
+    # end measure
+
+    def run(self):
+        '''Runs all the steps and returns the result of each one.'''
+        self.results = []
+        for num_generators in self.steps:
+            count = num_generators - self.fixture.get_num_generators()
+            if count <= 0:
+                continue
+            num_shards = len(self.fixture.shards)
+            self.fixture.add_generators(count)
+            self.logger.info('Started %s generators, %s in all' % (
+                count, self.fixture.get_num_generators()))
+            time.sleep(self.settle_time)
+            result = self.measure(self.fixture.get_num_generators(),
+                                  self.fixture.shards[num_shards:])
+            self.logger.info('Scale step: %s' % result)
+            self.results.append(result)
+        return self.results
+    # end run
+
+    def find_knee(self, results=None):
+        '''Returns the first step result at which the collectors
+        saturated, None if they kept up with all the steps.
+        '''
+        results = results or self.results
+        if not results:
+            return None
+        base_rate = results[0]['msgs_per_sec_per_generator']
+        for result in results:
+            if result['msgs_per_sec_per_generator'] < \
+                    base_rate * (1 - self.tolerance):
+                return result
+            if result['established'] < result['sampled'] or \
+                    result['dropped']:
+                return result
+        return None
+    # end find_knee
+
+    def report(self):
+        lines = ['%10s %10s %12s %12s %10s %8s' % (
+            'generators', 'connected', 'msgs/sec', 'msgs/sec/gen',
+            'estab', 'dropped')]
+        for result in self.results:
+            lines.append('%10d %10d %12.1f %12.2f %6d/%-3d %8d' % (
+                result['generators'], result['connected'],
+                result['msgs_per_sec'], result['msgs_per_sec_per_generator'],
+                result['established'], result['sampled'], result['dropped']))
+        knee = self.find_knee()
+        if knee:
+            lines.append('Collector saturates at %s generators' %
+                         knee['generators'])
+        else:
+            lines.append('Collector kept up with all the steps')
+        return '\n'.join(lines)
+    # end report
+
+# end class GeneratorScaleDriver
@@ -171,12 +171,20 @@ class create_multiple_vn_and_multiple_vm_fixture(fixtures.Fixture):
     def wait_till_vms_are_up(self):
         try:
             result = True
+            # Wait for all the VMs to be ACTIVE with one nova list per poll
+            # before checking each of them
+            vm_objs = [vm_fix.vm_obj for vm_fix in self.vm_valuelist
+                       if getattr(vm_fix, 'vm_obj', None)]
+            outcome = self.nova_fixture.wait_till_vms_are_active(vm_objs)
             verify_threads = []
             for vm_fix in self.vm_valuelist:
+                vm_obj = getattr(vm_fix, 'vm_obj', None)
+                if not vm_obj or outcome.get(vm_obj.id) != 'ACTIVE':
+                    vm_fix.verify_vm_flag = False
+                    continue
                 t = threading.Thread(target=vm_fix.wait_till_vm_is_up, args=())
                 verify_threads.append(t)
             for thread in verify_threads:
-                time.sleep(0.5)
               #  thread.daemon = True
                 thread.start()
             for thread in verify_threads:
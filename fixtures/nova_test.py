@@ -34,6 +34,8 @@ class NovaFixture(fixtures.Fixture):
         self.cfgm_host_passwd = inputs.password
         self.key = key
         self.obj = None
+        # cleared when the user may not list the VMs of all tenants
+        self._list_all_tenants = True
         self.auth_url = 'http://' + self.openstack_ip + ':5000/v2.0'
         self.logger = inputs.logger
         self.images_info = parse_cfg_file('../configs/images.cfg')
@@ -432,6 +434,104 @@ class NovaFixture(fixtures.Fixture):
             return False
     # end wait_till_vm_is_active
 
+    def _get_server(self, vm_id):
+        '''Reads a server missing from the list; the list may not have it
+        yet right after the boot. Returns False if it is deleted, None if
+        it could not be read.'''
+        try:
+            return self.obj.servers.get(vm_id)
+        except novaException.NotFound:
+            return False
+        except novaException.ClientException:
+            self.logger.exception('Nova Exception while getting VM %s' %
+                                  vm_id)
+            return None
+    # end _get_server
+
+    def _list_servers(self, tenants):
+        '''Returns a dict of id to server of the VMs of tenants. Listing
+        all_tenants is admin only; for other users, once it is forbidden,
+        the servers of the user's project are listed instead.'''
+        servers = {}
+        if self._list_all_tenants:
+            try:
+                for tenant_id in tenants:
+                    for server in self.obj.servers.list(search_opts={
+                            'all_tenants': True, 'tenant_id': tenant_id}):
+                        servers[server.id] = server
+                return servers
+            except novaException.Forbidden:
+                self.logger.debug('Listing the VMs of all tenants is not '
+                                  'allowed, listing the project VMs')
+                self._list_all_tenants = False
+        for server in self.obj.servers.list():
+            servers[server.id] = server
+        return servers
+    # end _list_servers
+
+    def wait_till_vms_are_active(self, vm_objs, timeout=300, delay=1,
+                                 max_delay=10, on_active=None):
+        '''Waits till all the VMs in vm_objs are ACTIVE.
+
+        Instead of polling each VM, the servers of the VMs' projects are
+        listed once per polling tick. The interval between ticks grows by 1.5x
+        up to max_delay while no VM changes state and drops back to delay
+        when one does. vm_objs are refreshed with the listed details; a VM
+        missing from the list is read on its own before it is taken as
+        deleted. on_active, if given, is called with each VM as soon as it
+        is seen ACTIVE, e.g. to start working on it while others boot.
+        Returns a dict of VM id to its last seen status, one of 'ACTIVE',
+        'ERROR', 'DELETED' or the transient status it was in at timeout.
+        '''
+        timeout = timeout * float(get_os_env('TEST_RETRY_FACTOR') or 1.0)
+        pending = dict((vm_obj.id, vm_obj) for vm_obj in vm_objs)
+        outcome = dict((vm_obj.id, vm_obj.status) for vm_obj in vm_objs)
+        tenants = set(vm_obj.tenant_id for vm_obj in vm_objs)
+        end_time = time.time() + timeout
+        interval = delay
+        while pending:
+            try:
+                servers = self._list_servers(tenants)
+            except novaException.ClientException:
+                self.logger.exception('Nova Exception while listing VMs')
+            else:
+                changed = False
+                for vm_id, vm_obj in pending.items():
+                    server = servers.get(vm_id)
+                    if server is None:
+                        server = self._get_server(vm_id)
+                        if server is None:
+                            # unknown, left to the next poll
+                            continue
+                    deleted = server is False
+                    status = 'DELETED' if deleted else server.status
+                    if status != outcome[vm_id]:
+                        changed = True
+                    outcome[vm_id] = status
+                    if not deleted:
+                        vm_obj._add_details(server._info)
+                    if status in ('ACTIVE', 'ERROR', 'DELETED'):
+                        del pending[vm_id]
+                        if status == 'ACTIVE':
+                            self.logger.info('VM %s is ACTIVE now' % vm_obj)
+                            if on_active:
+                                on_active(vm_obj)
+                        else:
+                            self.logger.error('VM %s went to %s state' % (
+                                vm_obj, status))
+                interval = delay if changed else min(interval * 1.5,
+                                                     max_delay)
+            if not pending:
+                break
+            if time.time() + interval > end_time:
+                for vm_obj in pending.values():
+                    self.logger.error('VM %s is still in %s state' % (
+                        vm_obj, outcome[vm_obj.id]))
+                break
+            time.sleep(interval)
+        return outcome
+    # end wait_till_vms_are_active
+
     @retry(tries=20, delay=5)
     def wait_till_vm_is_up(self, vm_obj):
         try:
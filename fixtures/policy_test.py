@@ -205,6 +205,8 @@ class PolicyFixture(fixtures.Fixture):
                 self.webui.delete_policy_in_webui(self)
             else:
                 self._delete_policy(self.policy_name)
+            self.api_s_inspect.invalidate_object('policy',
+                                                 list(self.policy_fq_name))
             self.logger.info("Deleted policy %s" % (self.policy_name))
         else:
             self.logger.info('Skipping deletion of policy %s' %
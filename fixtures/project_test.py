@@ -79,6 +79,13 @@ class ProjectFixture(fixtures.Fixture):
         self.kc.tenants.delete(self.tenant_dict[self.project_name])
     # end _delete_project
 
+    def _invalidate_api_s_cache(self):
+        api_s_inspect = self.connections.api_server_inspect
+        api_s_inspect.invalidate_object('project', self.project_fq_name,
+                                        self.project_id)
+        api_s_inspect.invalidate_object('domain', [self.domain_name])
+    # end _invalidate_api_s_cache
+
     def _reauthenticate_keystone(self):
         self.kc = ksclient.Client(
             username=self.inputs.stack_user,
@@ -101,6 +108,7 @@ class ProjectFixture(fixtures.Fixture):
             self.logger.info('Project %s not found, creating it' % (
                 self.project_name))
             self._create_project_keystone()
+            self._invalidate_api_s_cache()
             time.sleep(2)
         self.project_obj = self.vnc_lib_h.project_read(id=self.project_id)
         self.uuid = self.project_id
@@ -118,6 +126,7 @@ class ProjectFixture(fixtures.Fixture):
         if do_cleanup:
             self._reauthenticate_keystone()
             self._delete_project_keystone()
+            self._invalidate_api_s_cache()
             if self.verify_is_run:
                 assert self.verify_on_cleanup()
         else:
@@ -161,7 +170,7 @@ class ProjectFixture(fixtures.Fixture):
         for api_s_inspect in self.api_server_inspects.values():
             cs_project_obj = api_s_inspect.get_cs_project(
                 self.domain_name,
-                self.project_name)
+                self.project_name, refresh=True)
             if not cs_project_obj:
                 self.logger.warn('Project %s not found in API Server %s'
                                  ' ' % (self.project_name, api_s_inspect._ip))
@@ -184,7 +193,7 @@ class ProjectFixture(fixtures.Fixture):
         for api_s_inspect in self.api_server_inspects.values():
             cs_project_obj = api_s_inspect.get_cs_project(
                 self.domain_name,
-                self.project_name)
+                self.project_name, refresh=True)
             if cs_project_obj:
                 self.logger.warn('Project %s is still found in API Server %s'
                                  'with ID %s ' % (self.project_name, api_s_inspect._ip,
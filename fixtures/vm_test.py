@@ -20,6 +20,7 @@ from tcutils.pkgs.install import PkgHost, build_and_install
 
 env.disable_known_hosts = True
 from webui_test import *
+from verification_util import IntrospectGather, GatherResult
 #output.debug= True
 
 #@contrail_fix_ext ()
@@ -240,8 +241,12 @@ class VMFixture(fixtures.Fixture):
             self.verify_vm_flag = False
             result = result and False
             return result
-        self.verify_vm_flag = result and self.nova_fixture.wait_till_vm_is_active(
-            self.vm_obj)
+        # one nova list per poll for all the VMs of the fixture, with the
+        # 20 x 5 secs budget of wait_till_vm_is_active
+        outcome = self.nova_fixture.wait_till_vms_are_active(self.vm_objs,
+                                                             timeout=100)
+        self.verify_vm_flag = result and all(
+            status == 'ACTIVE' for status in outcome.values())
         if self.inputs.webui_verification_flag:
             self.webui.verify_vm_in_webui(self)
         t_api = threading.Thread(target=self.verify_vm_in_api_server, args=())
@@ -705,9 +710,33 @@ class VMFixture(fixtures.Fixture):
             Also verifies that a route is present in all compute nodes for the VM IP
         '''
         (domain, project, vn_name) = vn_fq_name.split(':')
-        for compute_ip in self.inputs.compute_ips:
-            inspect_h = self.agent_inspect[compute_ip]
+        fw_mode = self.vnc_lib_fixture.get_forwarding_mode(vn_fq_name)
+
+        def get_agent_data(compute_ip, inspect_h):
             vn = inspect_h.get_vna_vn(domain, project, vn_name)
+            if vn is None:
+                return {'vn': None}
+            data = {'vn': vn}
+            data['vrf_objs'] = inspect_h.get_vna_vrf_objs(
+                domain, project, vn_name)
+            if fw_mode != unicode('l2'):
+                data['path'] = inspect_h.get_vna_active_route(
+                    vrf_id=self.agent_vrf_id[vn_fq_name],
+                    ip=self.vm_ip_dict[vn_fq_name], prefix='32')
+            data['l2_path'] = inspect_h.get_vna_layer2_route(
+                vrf_id=self.agent_vrf_id[vn_fq_name],
+                mac=self.mac_addr[vn_fq_name])
+            return data
+        # Fetch from all the agents at once, then verify per node
+        agents_data = IntrospectGather(
+            dict((ip, self.agent_inspect[ip])
+                 for ip in self.inputs.compute_ips),
+            logger=self.logger).gather(get_agent_data)
+        if not agents_data.ok():
+            agents_data.log_errors(self.logger)
+            return False
+        for compute_ip in self.inputs.compute_ips:
+            vn = agents_data[compute_ip]['vn']
 # The VN for the VM under test may or may not be present on other agent
 # nodes. Proceed to check only if VN is present
             if vn is None:
@@ -730,8 +759,7 @@ class VMFixture(fixtures.Fixture):
 #            if vn['vrf_name'] != self.agent_vrf_name :
 #                self.logger.warn('VN VRF of %s in agent is not the same as expected VRF of %s' %( vn['vrf_name'], self.agent_vrf_name ))
 #                return False
-            agent_vrf_objs = inspect_h.get_vna_vrf_objs(
-                domain, project, vn_name)
+            agent_vrf_objs = agents_data[compute_ip]['vrf_objs']
             agent_vrf_obj = self.get_matching_vrf(
                 self.agent_vrf_objs['vrf_list'],
                 self.agent_vrf_name[vn_fq_name])
@@ -742,11 +770,8 @@ class VMFixture(fixtures.Fixture):
                     'Expected : %s, Seen : %s' % (vn['name'],
                                                   self.agent_vrf_id[vn_fq_name], agent_vrf_id))
                 return False
-            fw_mode = self.vnc_lib_fixture.get_forwarding_mode(vn_fq_name)
             if fw_mode != unicode('l2'):
-                agent_path = inspect_h.get_vna_active_route(
-                    vrf_id=self.agent_vrf_id[vn_fq_name],
-                    ip=self.vm_ip_dict[vn_fq_name], prefix='32')
+                agent_path = agents_data[compute_ip]['path']
                 agent_label = self.agent_path[
                     vn_fq_name]['path_list'][0]['label']
                 if agent_label != self.agent_label[vn_fq_name]:
@@ -769,9 +794,7 @@ class VMFixture(fixtures.Fixture):
 
             self.logger.info(
                 'Starting all layer 2 verification in agent %s' % (compute_ip))
-            agent_l2_path = inspect_h.get_vna_layer2_route(
-                vrf_id=self.agent_vrf_id[vn_fq_name],
-                mac=self.mac_addr[vn_fq_name])
+            agent_l2_path = agents_data[compute_ip]['l2_path']
             agent_l2_label = self.agent_l2_path[vn_fq_name][
                 'routes'][0]['path_list'][0]['label']
             if agent_l2_label != self.agent_l2_label[vn_fq_name]:
@@ -948,21 +971,36 @@ class VMFixture(fixtures.Fixture):
             self.bgp_ips = self.inputs.bgp_ips[:]
         else: 
             self.bgp_ips = self.get_control_nodes()
+        cn_gather = IntrospectGather(
+            dict((cn, self.cn_inspect[cn]) for cn in self.bgp_ips),
+            logger=self.logger)
         for vn_fq_name in self.vn_fq_names:
             fw_mode= self.vnc_lib_fixture.get_forwarding_mode(vn_fq_name)
+            vn_name= vn_fq_name.split(':')[-1]
+            ri_name= vn_fq_name + ':' + vn_name
+            self.ri_names[vn_fq_name]= ri_name
+            # Query all the control-nodes at once, then verify per node
+            if fw_mode != unicode('l2'):
+                all_cn_routes = cn_gather.gather(
+                    'get_cn_route_table_entry', ri_name=ri_name,
+                    prefix=self.vm_ip_dict[vn_fq_name] + '/32')
+            else:
+                all_cn_routes = GatherResult()
+            all_cn_l2_routes = cn_gather.gather(
+                'get_cn_route_table_entry', ri_name=ri_name,
+                prefix=self.mac_addr[vn_fq_name] + ',' +
+                self.vm_ip_dict[vn_fq_name] + '/32', table='enet.0')
+            if not (all_cn_routes.ok() and all_cn_l2_routes.ok()):
+                with self.printlock:
+                    all_cn_routes.log_errors(self.logger)
+                    all_cn_l2_routes.log_errors(self.logger)
+                self.vm_in_cn_flag = self.vm_in_cn_flag and False
+                return False
 #            for cn in self.inputs.bgp_ips:
             for cn in self.bgp_ips:
-                vn_name= vn_fq_name.split(':')[-1]
-                ri_name= vn_fq_name + ':' + vn_name
-                self.ri_names[vn_fq_name]= ri_name
                 if fw_mode != unicode('l2'):
                     # Check for VM route in each control-node
-                    #vn_name= vn_fq_name.split(':')[-1]
-                    #ri_name= vn_fq_name + ':' + vn_name
-                    #self.ri_names[vn_fq_name]= ri_name
-                    cn_routes = self.cn_inspect[cn].get_cn_route_table_entry(
-                        ri_name=ri_name,
-                        prefix=self.vm_ip_dict[vn_fq_name] + '/32')
+                    cn_routes = all_cn_routes[cn]
                     if not cn_routes:
                         with self.printlock:
                             self.logger.warn(
@@ -994,11 +1032,7 @@ class VMFixture(fixtures.Fixture):
                 self.logger.info(
                     'Starting all layer2 verification in %s Control Node' % (cn))
                 # L2 verification
-
-                prefix = self.mac_addr[vn_fq_name] + \
-                    ',' + self.vm_ip_dict[vn_fq_name] + '/32'
-                cn_l2_routes = self.cn_inspect[cn].get_cn_route_table_entry(
-                    ri_name=ri_name, prefix=prefix, table='enet.0')
+                cn_l2_routes = all_cn_l2_routes[cn]
                 if not cn_l2_routes:
                     self.logger.warn(
                         'No layer2 route found for VM MAC %s in Control-node %s'
@@ -1275,6 +1309,9 @@ class VMFixture(fixtures.Fixture):
                         self.remove_security_group(sec_grp)
                     self.logger.info("Deleting the VM %s" % (vm_obj.name))
                     self.nova_fixture.delete_vm(vm_obj)
+                    for otype in ['vm', 'vr', 'vmi', 'iip', 'fip']:
+                        self.api_s_inspect.invalidate_object(
+                            otype, vm_obj.id)
                 time.sleep(5)
             # Not expected to do verification when self.count is > 1, right now
             if self.verify_is_run:
@@ -1838,6 +1875,20 @@ class MultipleVMFixture(fixtures.Fixture):
         if created_vms != expected_vms:
             return False
 
+        # Wait for all the VMs with one nova list per poll instead of per VM
+        outcome = self.nova_fixture.wait_till_vms_are_active(
+            [vm_fixture.vm_obj for vm_name, vm_fixture in self._vm_fixtures])
+        if not all(status == 'ACTIVE' for status in outcome.values()):
+            self.logger.error('Not all VMs are ACTIVE: %s' % outcome)
+            return False
+
+        # Read the API server objects of all the VMs in bulk, the per VM
+        # verifications then find them in the cache
+        vm_ids = [vm_fixture.vm_obj.id for vm_name, vm_fixture in
+                  self._vm_fixtures]
+        for api_s_inspect in self.connections.api_server_inspects.values():
+            api_s_inspect.prefetch_vms(vm_ids)
+
         result = True
         for vm_name, vm_fixture in self._vm_fixtures:
             result &= vm_fixture.verify_on_setup()
@@ -231,8 +231,16 @@ class VNFixture(fixtures.Fixture):
         if self.vxlan_id is not None:
             self.add_vxlan_id(self.project_obj.project_fq_name,
                               self.vn_name, self.vxlan_id)
+        self._invalidate_api_s_cache()
     # end setUp
 
+    def _invalidate_api_s_cache(self):
+        self.api_s_inspect.invalidate_object(
+            'vn', self.vn_fq_name.split(':'), self.vn_id)
+        for otype in ['ri', 'rt']:
+            self.api_s_inspect.invalidate_object(otype, uuid=self.vn_id)
+    # end _invalidate_api_s_cache
+
     def create_subnet(self, vn_subnet, ipam_fq_name):
         self.quantum_fixture.create_subnet(
             vn_subnet, self.vn_id, ipam_fq_name)
@@ -965,6 +973,7 @@ class VNFixture(fixtures.Fixture):
                         sleep(10)
                     else:
                         break
+            self._invalidate_api_s_cache()
             if self.verify_is_run:
                 t_api = threading.Thread(
                     target=self.verify_vn_not_in_api_server, args=())
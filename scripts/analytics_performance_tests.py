@@ -22,7 +22,9 @@ from servicechain.verify import VerifySvcChain
 import threading
 from subprocess import Popen, PIPE
 import shlex
+import json
 from netaddr import *
+from analytics_query_bench import QueryBench, compare, render_html
 
 
 class AnalyticsTestPerformance(testtools.TestCase, ConfigSvcChain, VerifySvcChain):
@@ -397,6 +399,38 @@ class AnalyticsTestPerformance(testtools.TestCase, ConfigSvcChain, VerifySvcChai
         for th in traffic_threads:
             th.join()
         return True
+
+    @preposttest_wrapper
+    def test_analytics_query_load(self):
+        ''' Test to measure the opserver query latency and throughput
+            under a mix of queries replayed at BENCH_QPS queries per sec
+
+        '''
+        ip = self.inputs.collector_ips[0]
+        ops = self.analytics_obj.ops_inspect[ip]
+        bench = QueryBench(ip, ops._port,
+                           qps=float(os.environ.get('BENCH_QPS', 2)),
+                           concurrency=int(os.environ.get(
+                               'BENCH_CONCURRENCY', 4)),
+                           duration=int(os.environ.get('BENCH_DURATION', 60)),
+                           logger=self.logger)
+        report = bench.run()
+        baseline = os.environ.get('BENCH_BASELINE')
+        if baseline and os.path.exists(baseline):
+            with open(baseline) as fd:
+                compare(report, json.load(fd))
+        with open('analytics_query_bench.json', 'w') as fd:
+            json.dump(report, fd, indent=4)
+        with open('analytics_query_bench.html', 'w') as fd:
+            fd.write(render_html(report))
+        self.logger.info("Query benchmark: %s queries, %s errors, %.1f qps, "
+                         "%.1f rows/sec" % (
+                             report['total']['queries'],
+                             report['total']['errors'],
+                             report['achieved_qps'],
+                             report['total']['rows_per_sec']))
+        assert report['total']['errors'] == 0, "Some of the queries failed"
+        return True
 # end AnalyticsTestPerformance
 
 
@@ -0,0 +1,459 @@
+#
+# Analytics query benchmark
+#
+# Replays a weighted mix of FlowSeriesTable, ObjectTable, MessageTable and
+# StatTable queries against the opserver at a target rate and reports how
+# the query latency and throughput hold up under load.
+#
+# Ex : python analytics_query_bench.py --opserver 10.204.216.14:8081 \
+#          --qps 5 --concurrency 8 --duration 120 --json bench.json \
+#          --html bench.html --baseline last_bench.json
+#
+# Without --opserver the queries are run against a local stub opserver,
+# which is enough to check the harness itself in CI.
+#
+
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import logging as LOG
+import BaseHTTPServer
+import SocketServer
+from multiprocessing.pool import ThreadPool
+
+from opserver_util import OpServerUtils
+from tcutils.wait import backoff_delays
+from tcutils.stats import percentile
+
+# Query mix replayed by default; every query is picked with a probability
+# proportional to its weight. Times are relative to when it is sent.
+DEFAULT_MIX = [
+    {'name': 'flow_series', 'weight': 4, 'table': 'FlowSeriesTable',
+     'start_time': 'now-10m', 'end_time': 'now',
+     'select_fields': ['sourcevn', 'sourceip', 'destvn', 'destip',
+                       'sum(packets)', 'sport', 'dport', 'T=1'],
+     'where_clause': '', 'sort_fields': ['sum(packets)'], 'sort': 2,
+     'limit': 100},
+    {'name': 'object_vn', 'weight': 2, 'table': 'ObjectVNTable',
+     'start_time': 'now-10m', 'end_time': 'now',
+     'select_fields': ['ObjectId', 'Source', 'ModuleId', 'MessageTS'],
+     'where_clause': ''},
+    {'name': 'messages', 'weight': 3, 'table': 'MessageTable',
+     'start_time': 'now-10m', 'end_time': 'now',
+     'select_fields': ['MessageTS', 'Source', 'ModuleId', 'Messagetype',
+                       'Xmlmessage'],
+     'where_clause': '', 'sort_fields': ['MessageTS'], 'sort': 1,
+     'limit': 1000},
+    {'name': 'vn_stats', 'weight': 1,
+     'table': 'StatTable.UveVirtualNetworkAgent.vn_stats',
+     'start_time': 'now-10m', 'end_time': 'now',
+     'select_fields': ['name', 'T=60', 'SUM(vn_stats.in_bytes)',
+                       'SUM(vn_stats.out_bytes)'],
+     'where_clause': ''},
+]
+
+QUERY_ARGS = ('start_time', 'end_time', 'select_fields', 'where_clause',
+              'sort_fields', 'sort', 'limit', 'filter', 'dir')
+METRICS = ('client_wait', 'queue_time', 'first_row', 'total_time')
+PERCENTILES = (50, 90, 99)
+
+
+def load_mix(filename):
+    '''Reads a query mix, a json list of query specs like DEFAULT_MIX.'''
+    with open(filename) as fd:
+        mix = json.load(fd)
+    for spec in mix:
+        if 'name' not in spec or 'table' not in spec:
+            raise ValueError("Query spec %s needs a name and a table" % spec)
+        spec.setdefault('weight', 1)
+    return mix
+# end load_mix
+
+
+def percentiles(values):
+    '''Nearest rank percentiles, mean and max of values.'''
+    if not values:
+        return {}
+    stats = {'mean': sum(values) / len(values), 'max': max(values)}
+    for pct in PERCENTILES:
+        stats['p%d' % pct] = percentile(values, pct)
+    return stats
+# end percentiles
+
+
+class QueryBench(object):
+
+    '''Runs a query mix on an opserver at a target rate.
+
+    Queries are started open loop every 1/qps seconds, independent of how
+    fast the opserver answers, on at most concurrency threads. A query
+    which finds all the threads busy waits for one; that wait is reported
+    as client_wait. For every query the following are recorded, in secs
+    from when it was sent:
+        queue_time: until the opserver reports it complete
+        first_row: until the first result row is decoded
+        total_time: until the last result row is decoded
+    and the number of rows, downloaded at rows / (total_time - queue_time)
+    rows per sec.
+    '''
+
+    def __init__(self, opserver_ip, opserver_port, mix=None, qps=1,
+                 concurrency=4, duration=60, seed=0, logger=LOG):
+        self.opserver_ip = opserver_ip
+        self.opserver_port = str(opserver_port)
+        self.mix = mix or DEFAULT_MIX
+        self.qps = float(qps)
+        self.concurrency = concurrency
+        self.duration = duration
+        self.seed = seed
+        self.logger = logger
+        self.samples = []
+        self.elapsed = 0
+        self._lock = threading.Lock()
+
+    def _pick(self, rand, total_weight):
+        point = rand.uniform(0, total_weight)
+        for spec in self.mix:
+            point -= spec['weight']
+            if point <= 0:
+                return spec
+        return self.mix[-1]
+
+    def schedule(self):
+        '''Returns the (start offset, spec) of every query of the run.
+
+        The same seed always gives the same sequence, so that runs are
+        comparable.
+        '''
+        rand = random.Random(self.seed)
+        total_weight = sum(spec['weight'] for spec in self.mix)
+        count = int(self.duration * self.qps)
+        return [(i / self.qps, self._pick(rand, total_weight))
+                for i in range(count)]
+    # end schedule
+
+    def _wait_for_query(self, qid):
+        url = OpServerUtils.opserver_query_url(
+            self.opserver_ip, self.opserver_port) + '/' + qid
+        delays = backoff_delays(0.02, max_delay=1, jitter=0)
+        deadline = time.time() + OpServerUtils.QUERY_TIMEOUT
+        while True:
+            resp = OpServerUtils.get_url_http(url)
+            if getattr(resp, 'status_code', None) != 200:
+                return False
+            if json.loads(resp.text)['progress'] == 100:
+                return True
+            if time.time() > deadline:
+                self.logger.warn("Query %s did not complete in %s secs" % (
+                    qid, OpServerUtils.QUERY_TIMEOUT))
+                return False
+            time.sleep(delays.next())
+    # end _wait_for_query
+
+    def run_query(self, spec, scheduled=None):
+        '''Runs one query of the mix and returns its sample.'''
+        sent = time.time()
+        sample = {'name': spec['name'], 'table': spec['table'],
+                  'client_wait': sent - (scheduled or sent), 'rows': 0,
+                  'error': None}
+        try:
+            query_dict = OpServerUtils.get_query_dict(
+                spec['table'], *[spec.get(arg) for arg in QUERY_ARGS])
+            if query_dict is None:
+                raise ValueError("Invalid query %s" % spec['name'])
+            resp = OpServerUtils.post_url_http(
+                OpServerUtils.opserver_query_url(
+                    self.opserver_ip, self.opserver_port),
+                json.dumps(query_dict))
+            if resp is None:
+                raise IOError("Query %s was not accepted" % spec['name'])
+            qid = json.loads(resp)['href'].rsplit('/', 1)[1]
+            if not self._wait_for_query(qid):
+                raise IOError("Query %s(%s) failed" % (spec['name'], qid))
+            sample['queue_time'] = time.time() - sent
+            for row in OpServerUtils.iter_query_result(
+                    self.opserver_ip, self.opserver_port, qid):
+                if not sample['rows']:
+                    if not row:
+                        raise IOError("Unable to read results of query "
+                                      "%s(%s)" % (spec['name'], qid))
+                    sample['first_row'] = time.time() - sent
+                sample['rows'] += 1
+            sample['total_time'] = time.time() - sent
+            sample.setdefault('first_row', sample['total_time'])
+        except Exception as e:
+            sample['error'] = str(e)
+            self.logger.warn("Query %s failed: %s" % (spec['name'], e))
+        with self._lock:
+            self.samples.append(sample)
+        return sample
+    # end run_query
+
+    def run(self):
+        '''Replays the mix for duration secs and returns the report.'''
+        self.samples = []
+        pool = ThreadPool(self.concurrency)
+        start = time.time()
+        try:
+            for offset, spec in self.schedule():
+                delay = start + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.apply_async(self.run_query, (spec, start + offset))
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+        self.elapsed = time.time() - start
+        self.logger.info("Ran %d queries in %.1f secs" % (
+            len(self.samples), self.elapsed))
+        return self.report()
+    # end run
+
+    def _summarize(self, samples):
+        ok = [s for s in samples if not s['error']]
+        rows = sum(s['rows'] for s in ok)
+        download_time = sum(s['total_time'] - s['queue_time'] for s in ok)
+        summary = {'queries': len(samples), 'errors': len(samples) - len(ok),
+                   'rows': rows,
+                   'rows_per_sec': download_time and rows / download_time}
+        for metric in METRICS:
+            summary[metric] = percentiles([s[metric] for s in ok])
+        return summary
+
+    def report(self):
+        '''Returns the run configuration and the per query stats.'''
+        names = sorted(set(s['name'] for s in self.samples))
+        report = {
+            'config': {'opserver': '%s:%s' % (self.opserver_ip,
+                                              self.opserver_port),
+                       'qps': self.qps, 'concurrency': self.concurrency,
+                       'duration': self.duration, 'seed': self.seed,
+                       'mix': self.mix},
+            'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'elapsed': self.elapsed,
+            'achieved_qps': self.elapsed and len(self.samples) / self.elapsed,
+            'total': self._summarize(self.samples),
+            'queries': dict((name, self._summarize(
+                [s for s in self.samples if s['name'] == name]))
+                for name in names)}
+        return report
+    # end report
+# end QueryBench
+
+
+def compare(report, baseline):
+    '''Adds to report the change(%) of the p50/p90 timings and of the
+    rows/sec of every query against the same query in baseline.
+    '''
+    def change(new, old):
+        if not old or new is None:
+            return None
+        return round((new - old) * 100.0 / old, 1)
+
+    delta = {}
+    for name, summary in dict(report['queries'], total=report['total']).items():
+        if name == 'total':
+            old = baseline.get('total')
+        else:
+            old = baseline.get('queries', {}).get(name)
+        if not old:
+            continue
+        delta[name] = {'rows_per_sec': change(summary['rows_per_sec'],
+                                              old['rows_per_sec'])}
+        for metric in METRICS:
+            for stat in ('p50', 'p90'):
+                delta[name]['%s.%s' % (metric, stat)] = change(
+                    summary[metric].get(stat), old[metric].get(stat))
+    report['baseline'] = {'time': baseline.get('time'), 'change': delta}
+    return report
+# end compare
+
+
+def render_html(report):
+    '''Returns the report as a html page.'''
+    def fmt(value):
+        if value is None:
+            return '-'
+        if isinstance(value, float):
+            return '%.3f' % value
+        return str(value)
+
+    columns = ['%s %s' % (metric, stat) for metric in METRICS
+               for stat in ('p50', 'p90', 'p99', 'max')]
+    lines = ['<html><head><title>Analytics query benchmark</title>',
+             '<style>table{border-collapse:collapse}td,th{border:1px solid '
+             '#999;padding:2px 6px;text-align:right}</style></head><body>',
+             '<h3>Analytics query benchmark %s</h3>' % report['time'],
+             '<p>opserver %(opserver)s, qps %(qps)s, concurrency '
+             '%(concurrency)s, duration %(duration)ss</p>' % report['config'],
+             '<p>achieved qps %s</p>' % fmt(report['achieved_qps']),
+             '<table><tr><th>query</th><th>count</th><th>errors</th>'
+             '<th>rows</th><th>rows/sec</th>%s</tr>' % ''.join(
+                 '<th>%s</th>' % col for col in columns)]
+    change = report.get('baseline', {}).get('change', {})
+    rows = sorted(report['queries'].items()) + [('total', report['total'])]
+    for name, summary in rows:
+        cells = [summary['queries'], summary['errors'], summary['rows'],
+                 summary['rows_per_sec']]
+        cells += [summary[metric].get(stat) for metric in METRICS
+                  for stat in ('p50', 'p90', 'p99', 'max')]
+        lines.append('<tr><th>%s</th>%s</tr>' % (name, ''.join(
+            '<td>%s</td>' % fmt(cell) for cell in cells)))
+        if name in change:
+            lines.append('<tr><td>change(%%)</td><td colspan="3"></td>'
+                         '<td>%s</td>%s</tr>' % (
+                             fmt(change[name]['rows_per_sec']), ''.join(
+                                 '<td>%s</td>' % fmt(change[name].get(
+                                     col.replace(' ', '.')))
+                                 for col in columns)))
+    lines.append('</table></body></html>')
+    return '\n'.join(lines)
+# end render_html
+
+
+class StubOpServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    '''Minimal opserver answering queries with synthetic rows.
+
+    Every query is reported in progress for query_time secs and then
+    returns rows rows, split in chunks chunks, with a value for each of
+    its select fields.
+    '''
+
+    daemon_threads = True
+
+    def __init__(self, ip='127.0.0.1', port=0, rows=1000, chunks=2,
+                 query_time=0.05):
+        BaseHTTPServer.HTTPServer.__init__(self, (ip, port), _StubHandler)
+        self.rows = rows
+        self.chunks = chunks
+        self.query_time = query_time
+        self.queries = {}
+        self._lock = threading.Lock()
+
+    @property
+    def ip(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return str(self.server_address[1])
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+# end StubOpServer
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, code, body):
+        self.send_response(code)
+        self.send_header('Content-type', 'application/json')
+        self.send_header('Content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/analytics/query':
+            return self._reply(404, '{}')
+        query = json.loads(self.rfile.read(
+            int(self.headers.getheader('content-length', 0))))
+        qid = str(uuid.uuid1())
+        with self.server._lock:
+            self.server.queries[qid] = (time.time(), query)
+        self._reply(202, json.dumps({'href': '/analytics/query/' + qid}))
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts[:2] != ['analytics', 'query'] or len(parts) < 3 or \
+                parts[2] not in self.server.queries:
+            return self._reply(404, '{}')
+        posted, query = self.server.queries[parts[2]]
+        chunk_rows = self.server.rows / self.server.chunks
+        if len(parts) == 3:
+            done = time.time() - posted >= self.server.query_time
+            status = {'progress': 100 if done else 50, 'chunks': [
+                {'href': '/analytics/query/%s/chunk-final/%d' % (
+                    parts[2], i), 'count': chunk_rows}
+                for i in range(self.server.chunks)] if done else []}
+            return self._reply(200, json.dumps(status))
+        fields = query.get('select_fields') or ['value']
+        chunk = int(parts[-1])
+        rows = [dict((field, chunk * chunk_rows + i) for field in fields)
+                for i in range(chunk_rows)]
+        self._reply(200, json.dumps({'value': rows}))
+# end _StubHandler
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description='Analytics query benchmark')
+    parser.add_argument('--opserver', help='ip:port of the opserver to '
+                        'query, a local stub opserver is run if not set')
+    parser.add_argument('--qps', type=float, default=2,
+                        help='Queries started per sec')
+    parser.add_argument('--concurrency', type=int, default=4,
+                        help='Max queries running at a time')
+    parser.add_argument('--duration', type=int, default=30,
+                        help='Run time in secs')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--mix', help='json file with the query mix')
+    parser.add_argument('--json', help='Write the report to this file')
+    parser.add_argument('--html', help='Write the html report to this file')
+    parser.add_argument('--baseline', help='Report of an earlier run to '
+                        'compare with')
+    parser.add_argument('--stub-rows', type=int, default=1000,
+                        help='Rows returned per query by the stub opserver')
+    return parser.parse_args(args)
+
+
+def main(args=sys.argv[1:]):
+    args = parse_args(args)
+    LOG.basicConfig(level=LOG.INFO, format='%(asctime)s %(message)s')
+    mix = load_mix(args.mix) if args.mix else None
+    stub = None
+    if args.opserver:
+        ip, port = args.opserver.split(':')
+    else:
+        stub = StubOpServer(rows=args.stub_rows).start()
+        ip, port = stub.ip, stub.port
+    try:
+        report = QueryBench(ip, port, mix, args.qps, args.concurrency,
+                            args.duration, args.seed).run()
+    finally:
+        if stub:
+            stub.stop()
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as fd:
+            compare(report, json.load(fd))
+    if args.json:
+        with open(args.json, 'w') as fd:
+            json.dump(report, fd, indent=4)
+    if args.html:
+        with open(args.html, 'w') as fd:
+            fd.write(render_html(report))
+    print json.dumps(dict((name, {
+        'queries': s['queries'], 'errors': s['errors'],
+        'rows_per_sec': s['rows_per_sec'],
+        'first_row_p90': s['first_row'].get('p90')})
+        for name, s in dict(report['queries'], total=report['total']).items()),
+        indent=4)
+    return report['total']['errors'] == 0
+
+if __name__ == '__main__':
+    sys.exit(0 if main() else 1)
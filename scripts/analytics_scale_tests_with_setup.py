@@ -14,7 +14,7 @@ from contrail_test_init import *
 from connections import ContrailConnections
 from contrail_fixtures import *
 from tcutils.wrappers import preposttest_wrapper
-from mock_generator import MockGeneratorFixture
+from mock_generator import MockGeneratorFixture, GeneratorScaleDriver
 
 
 class AnalyticsScaleTest(testtools.TestCase, fixtures.TestWithFixtures):
@@ -45,13 +45,34 @@ class AnalyticsScaleTest(testtools.TestCase, fixtures.TestWithFixtures):
                              num_instances_per_generator=10, num_networks=50,
                              num_flows_per_instance=10):
         '''Test to validate collector scaling viz number of generators
+
+        Ramps up the mock generators in GENERATOR_SCALE_STEPS steps (comma
+        separated generator counts) up to num_generators and reports the
+        ingestion rate of the collectors at every step and the step at
+        which they saturate.
         '''
+        steps = os.environ.get('GENERATOR_SCALE_STEPS')
+        if steps:
+            steps = [int(step) for step in steps.split(',')]
+        else:
+            steps = sorted(set(max(1, num_generators * (i + 1) / 4)
+                               for i in range(4)))
         mock_gen_fixture = self.useFixture(
             MockGeneratorFixture(connections=self.connections,
-                                 inputs=self.inputs, num_generators=num_generators,
+                                 inputs=self.inputs, num_generators=0,
                                  num_instances_per_generator=num_instances_per_generator,
                                  num_networks=num_networks,
                                  num_flows_per_instance=num_flows_per_instance))
+        driver = GeneratorScaleDriver(
+            mock_gen_fixture, self.connections, steps,
+            settle_time=int(os.environ.get('GENERATOR_SCALE_SETTLE_TIME', 60)),
+            interval=int(os.environ.get('GENERATOR_SCALE_INTERVAL', 10)))
+        results = driver.run()
+        self.logger.info('Generator scale results:\n%s' % driver.report())
+        assert results, "No generators could be started"
+        knee = driver.find_knee()
+        assert not knee or knee['generators'] > steps[0], \
+            "Collector saturated at the first step, %s generators" % steps[0]
         return True
     # end test_generator_scale
 
@@ -19,10 +19,12 @@ import time
 import datetime
 import threading
 import Queue
+from multiprocessing.pool import ThreadPool
 from subprocess import Popen, PIPE
 import shlex
 from netaddr import *
 import random
+from tcutils.stats import percentile
 
 months = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun':
           6, 'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
@@ -47,6 +49,286 @@ uve_dict = {
 uve_list = ['xmpp-peer/', 'config-node/', 'control-node/',
             'analytics-node/', 'generator/', 'bgp-peer/', 'dns-node/', 'vrouter/']
 
+_MISSING = object()
+
+
+class UveExpectation(object):
+
+    '''An expected value in a UVE.
+
+    uve_type : UVE type as in analytics/uves/<uve_type>, e.g. 'virtual-network'
+    key      : UVE key, e.g. the VN fq_name
+    path     : list of keys (or list indexes) to the attribute in the flat
+               UVE, e.g. ['UveVirtualNetworkAgent', 'virtualmachine_list'];
+               empty for the whole UVE
+    expected : expected value, for match 'eq' and 'contains'
+    match    : 'eq', 'contains' (expected is in the attribute), 'exists',
+               'absent' or a callable returning True if the attribute,
+               given as argument, is as expected
+    '''
+
+    def __init__(self, uve_type, key, path=None, expected=None, match='eq'):
+        self.uve_type = uve_type
+        self.key = key
+        self.path = path or []
+        self.expected = expected
+        self.match = match
+
+    def lookup(self, uve):
+        value = uve
+        for p in self.path:
+            try:
+                value = value[p]
+            except (KeyError, IndexError, TypeError):
+                return _MISSING
+        return value
+
+    def check(self, uve):
+        '''Returns (passed, actual value) for the UVE, None if not found.'''
+        actual = _MISSING if uve is None else self.lookup(uve)
+        if self.match == 'absent':
+            return (actual is _MISSING, actual)
+        if actual is _MISSING:
+            return (False, actual)
+        if self.match == 'exists':
+            return (True, actual)
+        if self.match == 'contains':
+            return (self.expected in actual, actual)
+        if callable(self.match):
+            return (bool(self.match(actual)), actual)
+        return (actual == self.expected, actual)
+
+    def __str__(self):
+        return '%s/%s%s' % (self.uve_type, self.key,
+                            ''.join('[%s]' % p for p in self.path))
+# end UveExpectation
+
+
+class UveReport(object):
+
+    '''Pass/fail report of UveVerifier.verify.
+
+    results has one dictionary per expectation and collector, with
+    collector, expectation, passed, actual and error keys.
+    '''
+
+    def __init__(self):
+        self.results = []
+
+    def add(self, collector, expectation, passed, actual=None, error=None):
+        self.results.append({'collector': collector,
+                             'expectation': expectation,
+                             'passed': passed,
+                             'actual': None if actual is _MISSING else actual,
+                             'error': error})
+
+    def passed(self):
+        return all(r['passed'] for r in self.results)
+
+    def failures(self):
+        return [r for r in self.results if not r['passed']]
+
+    def summary(self):
+        lines = ['%d of %d UVE checks passed' % (
+            len(self.results) - len(self.failures()), len(self.results))]
+        for r in self.failures():
+            exp = r['expectation']
+            if r['error']:
+                detail = r['error']
+            elif exp.match == 'exists':
+                detail = 'not found'
+            elif exp.match == 'absent':
+                detail = 'still present as %s' % r['actual']
+            else:
+                detail = 'expected %s %s, seen %s' % (
+                    getattr(exp.match, '__name__', exp.match),
+                    exp.expected, r['actual'])
+            lines.append('  %s in collector %s: %s' % (
+                exp, r['collector'], detail))
+        return '\n'.join(lines)
+
+    def log(self, logger):
+        if self.passed():
+            logger.info(self.summary())
+        else:
+            logger.error(self.summary())
+# end UveReport
+
+
+class UveVerifier(object):
+
+    '''Verifies a batch of UveExpectation in all the collectors at once.
+
+    The UVEs needed by the expectations are fetched once per collector
+    with the multi key UVE query, up to KFILT_BATCH keys per request, and
+    the requests to all the collectors are run concurrently.
+    '''
+    KFILT_BATCH = 50
+    POOL_SIZE = 16
+
+    def __init__(self, ops_inspects, collectors, logger=LOG):
+        self.ops_inspects = ops_inspects
+        self.collectors = collectors
+        self.logger = logger
+
+    def _fetch(self, task):
+        collector, uve_type, keys = task
+        try:
+            return (task, self.ops_inspects[collector].get_ops_uves(
+                uve_type, keys), None)
+        except Exception as e:
+            return (task, {}, '%s: %s' % (type(e).__name__, e))
+
+    def verify(self, expectations):
+        keys = {}
+        for exp in expectations:
+            keys.setdefault(exp.uve_type, set()).add(exp.key)
+        tasks = []
+        for collector in self.collectors:
+            for uve_type, type_keys in keys.items():
+                type_keys = sorted(type_keys)
+                for i in range(0, len(type_keys), self.KFILT_BATCH):
+                    tasks.append((collector, uve_type,
+                                  type_keys[i:i + self.KFILT_BATCH]))
+        uves = {}
+        errors = {}
+        if tasks:
+            pool = ThreadPool(min(self.POOL_SIZE, len(tasks)))
+            try:
+                fetched = pool.map(self._fetch, tasks)
+            finally:
+                pool.close()
+            for (collector, uve_type, task_keys), values, error in fetched:
+                for key in task_keys:
+                    if error:
+                        errors[(collector, uve_type, key)] = error
+                    else:
+                        uves[(collector, uve_type, key)] = values.get(key)
+        report = UveReport()
+        for collector in self.collectors:
+            for exp in expectations:
+                error = errors.get((collector, exp.uve_type, exp.key))
+                if error:
+                    report.add(collector, exp, False, error=error)
+                    continue
+                passed, actual = exp.check(
+                    uves.get((collector, exp.uve_type, exp.key)))
+                report.add(collector, exp, passed, actual)
+        return report
+    # end verify
+# end UveVerifier
+
+
+class QueryScheduler(object):
+
+    '''Runs analytics queries on a bounded pool of worker threads.
+
+    Queries are assigned to the collectors round robin in submission
+    order, at most per_collector of them run at a time on a collector and
+    at most rate of them are started per second on a collector (no limit
+    if rate is None). Results are streamed by results() as they complete
+    and per table latency percentiles are reported by get_latency_stats().
+    '''
+    WORKERS = 8
+    PER_COLLECTOR = 2
+
+    def __init__(self, ops_inspects, collectors, workers=None,
+                 per_collector=None, rate=None, logger=LOG):
+        self.ops_inspects = ops_inspects
+        self.collectors = collectors
+        self.workers = workers or self.WORKERS
+        self.rate = rate
+        self.logger = logger
+        per_collector = per_collector or self.PER_COLLECTOR
+        self._slots = dict((collector, threading.Semaphore(per_collector))
+                           for collector in collectors)
+        self._next_start = dict((collector, 0) for collector in collectors)
+        self._rate_lock = threading.Lock()
+        self._jobs = Queue.Queue()
+        self._results = Queue.Queue()
+        self._threads = []
+        self._submitted = 0
+        self._returned = 0
+        self._latencies = {}
+        self._lock = threading.Lock()
+
+    def submit(self, table, **query):
+        '''Queues a post_query of table with the query arguments.'''
+        collector = self.collectors[self._submitted % len(self.collectors)]
+        self._submitted += 1
+        self._jobs.put((collector, table, query))
+
+    def _wait_rate(self, collector):
+        if not self.rate:
+            return
+        with self._rate_lock:
+            now = time.time()
+            start = max(now, self._next_start[collector])
+            self._next_start[collector] = start + 1.0 / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+    def _worker(self):
+        while True:
+            try:
+                job = self._jobs.get_nowait()
+            except Queue.Empty:
+                return
+            collector, table, query = job
+            with self._slots[collector]:
+                self._wait_rate(collector)
+                start = time.time()
+                try:
+                    result = self.ops_inspects[collector].post_query(
+                        table, **query)
+                except Exception as e:
+                    self.logger.warn('Query to %s on %s failed: %s' % (
+                        table, collector, e))
+                    result = None
+                latency = time.time() - start
+            with self._lock:
+                self._latencies.setdefault(table, []).append(latency)
+            self._results.put((collector, table, query, result))
+
+    def start(self):
+        for i in range(min(self.workers, self._jobs.qsize())):
+            thread = threading.Thread(target=self._worker)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self, timeout=None):
+        '''Waits for all the queries, up to timeout seconds in total.'''
+        deadline = timeout and time.time() + timeout
+        for thread in self._threads:
+            thread.join(deadline and max(deadline - time.time(), 0))
+
+    def results(self, timeout=300):
+        '''Yields (collector, table, query, result) of the queries as they
+        complete; stops if no query completes for timeout seconds.'''
+        while self._returned < self._submitted:
+            try:
+                item = self._results.get(timeout=timeout)
+            except Queue.Empty:
+                self.logger.warn('%d queries did not complete' % (
+                    self._submitted - self._returned))
+                return
+            self._returned += 1
+            yield item
+
+    def get_latency_stats(self):
+        '''Returns per table count and p50/p90/p99/max latency in secs.'''
+        with self._lock:
+            latencies = dict((table, sorted(values))
+                             for table, values in self._latencies.items())
+        return dict((table, {'count': len(values),
+                             'p50': percentile(values, 50),
+                             'p90': percentile(values, 90),
+                             'p99': percentile(values, 99),
+                             'max': values[-1]})
+                    for table, values in latencies.items())
+# end QueryScheduler
+
 
 class AnalyticsVerification(fixtures.Fixture):
 
@@ -58,6 +340,7 @@ class AnalyticsVerification(fixtures.Fixture):
         self.agent_inspect = agent_inspect
         self.cn_inspect = cn_inspect
         self.logger = logger
+        self.query_scheduler = None
         self.get_all_generators()
 
     def get_all_generators(self):
@@ -730,31 +1013,23 @@ class AnalyticsVerification(fixtures.Fixture):
                 return self.opsobj.get_ops_vn(vn_fq_name=vn_fq_name)
         return None
 
+    def verify_uves(self, expectations, collectors=None):
+        '''Verifies a batch of UveExpectation in all the collectors
+        concurrently, see UveVerifier; returns a UveReport.'''
+        report = UveVerifier(self.ops_inspect,
+                             collectors or self.inputs.collector_ips,
+                             logger=self.logger).verify(expectations)
+        report.log(self.logger)
+        return report
+
     def verify_vn_uve_tiers(self, vn_fq_name='default-domain:admin:default-virtual-network'):
         '''Verify that when vn is created , vn uve should show info from UveVirtualNetworkConfig and UveVirtualNetworkAgent'''
-        result = False
-        for ip in self.inputs.collector_ips:
-            self.logger.info("Verifying through opserver in  %s" % (ip))
-            self.opsobj = self.ops_inspect[ip]
-            self.ops_vnoutput = self.opsobj.get_ops_vn(vn_fq_name=vn_fq_name)
-            if not self.ops_vnoutput:
-                self.logger.error("%s uve did not return any output " %
-                                  vn_fq_name)
-                return False
-            expected_tiers = ['UveVirtualNetworkAgent',
-                              'UveVirtualNetworkConfig']
-            tiers = self.ops_vnoutput.keys()
-            missing_tier = set(expected_tiers) - set(tiers)
-            if not missing_tier:
-                self.logger.info(
-                    "Tiers correctly shown in vn vue for %s in collector %s" % (vn_fq_name, ip))
-                result = True
-            else:
-                self.logger.error(
-                    "uve message did not come from %s for %s in collector %s" %
-                    (missing_tier, vn_fq_name, ip))
-                return False
-        return result
+        expected_tiers = ['UveVirtualNetworkAgent',
+                          'UveVirtualNetworkConfig']
+        report = self.verify_uves(
+            [UveExpectation('virtual-network', vn_fq_name, [tier],
+                            match='exists') for tier in expected_tiers])
+        return report.passed()
 
     @retry(delay=5, tries=6)
     def verify_vn_uve_ri(self, vn_fq_name='default-domain:admin:default-virtual-network', ri_name=None):
@@ -2427,15 +2702,38 @@ class AnalyticsVerification(fixtures.Fixture):
         return result
 
     def start_query_threads(self, thread_objects=[]):
+        if isinstance(thread_objects, QueryScheduler):
+            thread_objects.start()
+            return
         for thread in thread_objects:
             thread.start()
             time.sleep(0.5)
 
     def join_threads(self, thread_objects=[]):
+        if isinstance(thread_objects, QueryScheduler):
+            thread_objects.join(300)
+            return
         for thread in thread_objects:
             thread.join(300)
 
     def get_value_from_query_threads(self):
+        if self.query_scheduler:
+            # verify the results as the queries complete
+            for collector, table, query, result in \
+                    self.query_scheduler.results():
+                self.logger.info("******** Verifying resutlts *************")
+                if not result:
+                    self.logger.warn("Query %s to table %s on %s returned "
+                                     "no result" % (query['where_clause'],
+                                                    table, collector))
+            for table, stats in sorted(
+                    self.query_scheduler.get_latency_stats().items()):
+                self.logger.info(
+                    "Query latency of %s: count %d, p50 %.2fs, p90 %.2fs, "
+                    "p99 %.2fs, max %.2fs" % (table, stats['count'],
+                                              stats['p50'], stats['p90'],
+                                              stats['p99'], stats['max']))
+            return
         while not self.que.empty():
             self.logger.info("******** Verifying resutlts *************")
             try:
@@ -2443,10 +2741,14 @@ class AnalyticsVerification(fixtures.Fixture):
             except Exception as e:
                 print e
 
-    def build_parallel_query_to_object_tables(self, table_name=None, start_time=None, end_time='now', skip_tables=[]):
-
-        threads = []
-        self.que = Queue.Queue()
+    def build_parallel_query_to_object_tables(self, table_name=None, start_time=None, end_time='now', skip_tables=[],
+                                              workers=None, per_collector=None, rate=None):
+        '''Queues a query per table and ObjectId on a QueryScheduler;
+        start_query_threads runs them, get_value_from_query_threads
+        verifies the results as they complete.'''
+        self.query_scheduler = QueryScheduler(
+            self.ops_inspect, self.inputs.collector_ips, workers=workers,
+            per_collector=per_collector, rate=rate, logger=self.logger)
         if not start_time:
             self.logger.warn("start_time must be passed...")
             return
@@ -2474,7 +2776,6 @@ class AnalyticsVerification(fixtures.Fixture):
                     if not objects:
                         self.logger.warn(
                             "%s table object id could not be retrieved" % (table_name))
-                        result = result and False
                     else:
                         schema = self.get_schema_from_table(v)
 
@@ -2482,24 +2783,16 @@ class AnalyticsVerification(fixtures.Fixture):
                             query = '(' + 'ObjectId=' + obj['ObjectId'] + ')'
                             self.logger.info(
                                 "Querying  table %s with objectid as %s\n" % (table_name, obj))
-                            foo = [0, 1]
-                            num = random.choice(foo)
-
-                            t = threading.Thread(
-                                target=lambda q, table, start_time, end_time, select_fields, where_clause,
-                                sort_fields, sort, limit:
-                                q.put(self.ops_inspect[self.inputs.collector_ips[num]].post_query(
-                                    table, start_time, end_time, select_fields,
-                                    where_clause, sort_fields, sort, limit)),
-                                args=(
-                                    self.que, table_name, start_time,
-                                    end_time, schema, query, ["MessageTS"], 2, 5))
-                            threads.append(t)
+                            self.query_scheduler.submit(
+                                table_name, start_time=start_time,
+                                end_time=end_time, select_fields=schema,
+                                where_clause=query, sort_fields=["MessageTS"],
+                                sort=2, limit=5)
 
         except Exception as e:
             print e
         finally:
-            return threads
+            return self.query_scheduler
 
     def get_table_schema(self, d):
 
@@ -1,79 +1,170 @@
+import os
+import time
+import urllib
 import logging as LOG
 from lxml import etree
 
 from verification_util import *
+from route_snapshot import RouteSnapshot
 
 LOG.basicConfig(format='%(levelname)s: %(message)s', level=LOG.DEBUG)
 
 
 class ControlNodeInspect (VerificationUtilBase):
 
+    # IFMap nodes fetched are indexed by name for IFMAP_INDEX_TTL secs
+    IFMAP_INDEX_TTL = float(os.environ.get('IFMAP_INDEX_TTL', 30))
+
     def __init__(self, ip, logger=LOG):
         super(ControlNodeInspect, self).__init__(ip, 8083, XmlDrv,
                                                  logger=logger)
+        self._ifmap_index = {}
+        # table name, None for all, to when it was loaded as a whole
+        self._ifmap_tables = {}
+
+    def invalidate_cache(self, path=None):
+        super(ControlNodeInspect, self).invalidate_cache(path)
+        self._ifmap_index.clear()
+        self._ifmap_tables.clear()
 
     def _join(self, *args):
         """Joins the args with ':'"""
         return ':'.join(args)
 
-    def _get_if_map_table_entry(self, match):
-        d = None
-        p = self.dict_get('Snh_IFMapTableShowReq')
+    def _ifmap_node_to_dict(self, node):
+        """Converts an IFMapNodeShowInfo element to a dictionary."""
+        d = {}
+        for e in node:
+            if e.tag != 'obj_info':
+                d[e.tag] = e.text
+            else:
+                od = e.xpath('./list/IFMapObjectShowInfo')
+                if od:
+                    d[e.tag] = {}
+                    for eod in od[0]:
+                        if eod.tag != 'data':
+                            d[e.tag][eod.tag] = eod.text
+                        else:
+                            d[e.tag][eod.tag] = {}
+                            # Remove CDATA; if present
+                            text = eod.text.replace(
+                                "<![CDATA[<", "<").strip("]]>")
+                            nxml = etree.fromstring(text)
+                            for iqc in nxml:
+                                if iqc.tag == 'virtual-DNS-data':
+                                    d[e.tag][eod.tag][iqc.tag] = {}
+                                    for dns in iqc:
+                                        d[e.tag][eod.tag][iqc.tag][
+                                            dns.tag] = dns.text
+                                if iqc.tag == 'virtual-DNS-record-data':
+                                    d[e.tag][eod.tag][iqc.tag] = {}
+                                    for dns in iqc:
+                                        d[e.tag][eod.tag][iqc.tag][
+                                            dns.tag] = dns.text
+                                if iqc.tag == 'id-perms':
+                                    d[e.tag][eod.tag][iqc.tag] = {}
+                                    for idpc in iqc:
+                                        if idpc.tag == 'permissions':
+                                            d[e.tag][eod.tag][iqc.tag][
+                                                idpc.tag] = {}
+                                            for prm in idpc:
+                                                d[e.tag][eod.tag][iqc.tag][
+                                                    idpc.tag][prm.tag] = prm.text
+                                        elif idpc.tag == 'uuid':
+                                            d[e.tag][eod.tag][iqc.tag][
+                                                idpc.tag] = {}
+                                            for prm in idpc:
+                                                d[e.tag][eod.tag][iqc.tag][
+                                                    idpc.tag][prm.tag] = prm.text
+                                        else:
+                                            d[e.tag][eod.tag][iqc.tag][
+                                                idpc.tag] = idpc.text
+
+        return d
+
+    def _ifmap_nodes(self, p):
         xp = p.xpath('./IFMapTableShowResp/ifmap_db/list/IFMapNodeShowInfo')
         if not xp:
             # sometime ./xpath dosen't work; work around
             # should debug to find the root cause.
             xp = p.xpath('/IFMapTableShowResp/ifmap_db/list/IFMapNodeShowInfo')
-        f = filter(lambda x: x.xpath('./node_name')[0].text == match, xp)
-        if 1 == len(f):
-            d = {}
-            for e in f[0]:
-                if e.tag != 'obj_info':
-                    d[e.tag] = e.text
-                else:
-                    od = e.xpath('./list/IFMapObjectShowInfo')
-                    if od:
-                        d[e.tag] = {}
-                        for eod in od[0]:
-                            if eod.tag != 'data':
-                                d[e.tag][eod.tag] = eod.text
-                            else:
-                                d[e.tag][eod.tag] = {}
-                                # Remove CDATA; if present
-                                text = eod.text.replace(
-                                    "<![CDATA[<", "<").strip("]]>")
-                                nxml = etree.fromstring(text)
-                                for iqc in nxml:
-                                    if iqc.tag == 'virtual-DNS-data':
-                                        d[e.tag][eod.tag][iqc.tag] = {}
-                                        for dns in iqc:
-                                            d[e.tag][eod.tag][iqc.tag][
-                                                dns.tag] = dns.text
-                                    if iqc.tag == 'virtual-DNS-record-data':
-                                        d[e.tag][eod.tag][iqc.tag] = {}
-                                        for dns in iqc:
-                                            d[e.tag][eod.tag][iqc.tag][
-                                                dns.tag] = dns.text
-                                    if iqc.tag == 'id-perms':
-                                        d[e.tag][eod.tag][iqc.tag] = {}
-                                        for idpc in iqc:
-                                            if idpc.tag == 'permissions':
-                                                d[e.tag][eod.tag][iqc.tag][
-                                                    idpc.tag] = {}
-                                                for prm in idpc:
-                                                    d[e.tag][eod.tag][iqc.tag][
-                                                        idpc.tag][prm.tag] = prm.text
-                                            elif idpc.tag == 'uuid':
-                                                d[e.tag][eod.tag][iqc.tag][
-                                                    idpc.tag] = {}
-                                                for prm in idpc:
-                                                    d[e.tag][eod.tag][iqc.tag][
-                                                        idpc.tag][prm.tag] = prm.text
-                                            else:
-                                                d[e.tag][eod.tag][iqc.tag][
-                                                    idpc.tag] = idpc.text
+        return xp
 
-        return d
+    def _index_ifmap_nodes(self, nodes):
+        expires = time.time() + self.IFMAP_INDEX_TTL
+        for node in nodes:
+            self._ifmap_index[node.findtext('node_name')] = [
+                node, expires, ResponseCache._generation]
+
+    def _lookup_ifmap_index(self, match):
+        """Returns (True, entry) if match is in a fresh index, the node is
+        converted only on the first lookup."""
+        entry = self._ifmap_index.get(match)
+        if entry is None:
+            return (False, None)
+        node, expires, generation = entry
+        if generation != ResponseCache._generation or \
+                expires <= time.time():
+            del self._ifmap_index[match]
+            return (False, None)
+        if not isinstance(node, dict):
+            node = entry[0] = self._ifmap_node_to_dict(node)
+        return (True, node)
+
+    def _ifmap_table_loaded(self, table_name):
+        """True if table_name was loaded as a whole in the last
+        IFMAP_INDEX_TTL secs, i.e. nodes not in the index are absent."""
+        for name in (table_name, None):
+            entry = self._ifmap_tables.get(name)
+            if entry and entry[1] == ResponseCache._generation and \
+                    entry[0] > time.time():
+                return True
+        return False
+
+    def load_if_map_table(self, table_name=None):
+        """Downloads the IFMap table table_name, or all the tables, once and
+        indexes its nodes, so that the next IFMAP_INDEX_TTL secs of lookups
+        do not query the control node. Returns the number of nodes."""
+        path = 'Snh_IFMapTableShowReq'
+        if table_name:
+            path += '?table_name=%s' % table_name
+        p = self.dict_get(path)
+        if p is None:
+            return 0
+        nodes = self._ifmap_nodes(p)
+        self._index_ifmap_nodes(nodes)
+        self._ifmap_tables[table_name] = (time.time() + self.IFMAP_INDEX_TTL,
+                                          ResponseCache._generation)
+        return len(nodes)
+
+    def _get_if_map_table_entry(self, match, refresh=False):
+        """Returns the IFMap node named match, e.g.
+        virtual-network:default-domain:admin:vn1, as a dictionary.
+
+        Nodes are looked up in the index first; otherwise only the node's
+        table is searched for match by the control node. Only if the search
+        returns no node at all, e.g. the control node does not support it,
+        the whole table is loaded, at most once per IFMAP_INDEX_TTL secs.
+        """
+        if not refresh:
+            hit, d = self._lookup_ifmap_index(match)
+            if hit:
+                return d
+        table_name = match.split(':', 1)[0]
+        p = self.dict_get('Snh_IFMapTableShowReq?table_name=%s'
+                          '&search_string=%s' % (table_name,
+                                                 urllib.quote(match)))
+        if p is not None:
+            nodes = self._ifmap_nodes(p)
+            self._index_ifmap_nodes(nodes)
+            hit, d = self._lookup_ifmap_index(match)
+            # nodes of the table were returned, the search was honoured
+            if hit or nodes:
+                return d
+        if self._ifmap_table_loaded(table_name):
+            return None
+        self.load_if_map_table(table_name)
+        return self._lookup_ifmap_index(match)[1]
 
     def get_if_map_peer_server_info(self, match=None):
         d = None
@@ -107,13 +198,22 @@ class ControlNodeInspect (VerificationUtilBase):
 
     def get_cn_config_policy(self, domain='default-domain', project='admin', policy='default-network-policy'):
         policy_name = 'network-policy:' + domain + ':' + project + ':' + policy
-        path = 'Snh_IFMapTableShowReq'
+        path = 'Snh_IFMapTableShowReq?table_name=network-policy'
         xpath = './IFMapTableShowResp/ifmap_db/list/IFMapNodeShowInfo'
-        p = self.dict_get(path)
-        ifmaps = EtreeToDict(xpath).get_all_entry(p)
-        for ifmap in ifmaps:
-            if ifmap['node_name'] == policy_name:
-                return ifmap
+        # the whole table if the search returns no policy at all, at most
+        # once per IFMAP_INDEX_TTL secs
+        for query in ('&search_string=%s' % urllib.quote(policy_name), ''):
+            if not query:
+                if self._ifmap_table_loaded('network-policy'):
+                    return None
+                self.load_if_map_table('network-policy')
+            p = self.dict_get(path + query)
+            ifmaps = EtreeToDict(xpath).get_all_entry(p)
+            for ifmap in ifmaps:
+                if ifmap['node_name'] == policy_name:
+                    return ifmap
+            if ifmaps:
+                return None
 
     def get_cn_config_vn(self, domain='default-domain', project='admin', vn_name='default-virtual-network'):
         m = 'virtual-network:' + domain + ':' + project + ':' + vn_name
@@ -149,6 +249,13 @@ class ControlNodeInspect (VerificationUtilBase):
         p = self.dict_get(path)
         return EtreeToDict(xpath).get_all_entry(p)
 
+    def get_cn_route_snapshot(self, ri_name, table='inet.0'):
+        '''Returns a RouteSnapshot of the whole table, to look many
+        prefixes up with one request.
+        '''
+        return RouteSnapshot.from_control_node(self, ri_name, table,
+                                               logger=self.log)
+
     def get_cn_route_table_entry(self, prefix, ri_name, table='inet.0'):
         '''Returns the route dictionary for requested prefix and routing instance.
         '''
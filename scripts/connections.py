@@ -119,6 +119,16 @@ class ContrailConnections():
             self.inputs, self.api_server_inspect, self.cn_inspect, self.agent_inspect, self.ops_inspects, self.ds_inspect, logger=self.inputs.logger)
     # end __init__
 
+    def gather(self, inspects, func, *args, **kwargs):
+        ''' Calls func on all the inspect objects in inspects
+            (e.g. self.agent_inspect) concurrently.
+            See IntrospectGather.gather for the arguments; returns a
+            GatherResult of node to result, with failed nodes in its errors.
+        '''
+        return IntrospectGather(inspects, logger=self.inputs.logger).gather(
+            func, *args, **kwargs)
+    # end gather
+
     def setUp(self):
         super(ContrailConnections, self).setUp()
         pass
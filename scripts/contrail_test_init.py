@@ -19,6 +19,7 @@ from fabric.operations import get, put
 from fabric.context_managers import settings, hide
 
 from util import *
+from tcutils.sshpool import ssh_run
 from custom_filehandler import *
 
 import subprocess
@@ -759,13 +760,10 @@ class ContrailTestInit(fixtures.Fixture):
     def run_cmd_on_server(self, server_ip, issue_cmd, username='root',
                           password='contrail123', pty=True):
         self.logger.debug("COMMAND: (%s)" % issue_cmd)
-        with hide('everything'):
-            with settings(
-                host_string='%s@%s' % (username, server_ip), password=password,
-                    warn_only=True, abort_on_prompts=False):
-                output = run('%s' % (issue_cmd), pty=pty)
-                self.logger.debug(output)
-                return output
+        output = ssh_run('%s@%s' % (username, server_ip), password,
+                         issue_cmd, pty=pty)
+        self.logger.debug(output)
+        return output
     # end run_cmd_on_server
 
     def cleanUp(self):
@@ -1,2 +1,12 @@
+import os
+import json
 
 my_rel_flow_setup_rate_mapping = {'1.04': 6000, '1.05': 9000, '1.10main': 9000}
+# flows/sec expected of the releases not mapped
+default_setup_rate = 7000
+
+# Rates measured by performance.flow_setup_bench for other builds; a JSON
+# dictionary of release to flows/sec, which overrides the ones above.
+if os.environ.get('FLOW_SETUP_RATE_FILE'):
+    with open(os.environ['FLOW_SETUP_RATE_FILE']) as fd:
+        my_rel_flow_setup_rate_mapping.update(json.load(fd))
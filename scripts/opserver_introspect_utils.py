@@ -173,6 +173,18 @@ class VerificationOpsSrv (VerificationUtilBase):
         finally:
             return res
 
+    def get_ops_uves(self, uve_type, keys, flat=True):
+        '''Gets the UVEs of many keys of a uve type in one request.
+
+        analytics/uves/virtual-network/*?kfilt=<key1>,<key2>&flat
+        Returns a dictionary of key to UVE; keys without a UVE are left out.
+        '''
+        path = 'analytics/uves/%s/*?kfilt=%s' % (uve_type, ','.join(keys))
+        if flat:
+            path += '&flat'
+        uves = self.dict_get(path) or []
+        return dict((uve['name'], uve['value']) for uve in uves)
+
     def get_hrefs_to_all_UVEs_of_a_given_UVE_type(self, uveType=None):
         '''Get all hrefs for a uve type'''
         dct = self.dict_get('analytics/uves/' + uveType)
@@ -250,35 +262,42 @@ class VerificationOpsSrv (VerificationUtilBase):
         finally:
             return res
 
+    def iter_query(self, table, start_time=None, end_time=None,
+                   select_fields=None,
+                   where_clause='',
+                   sort_fields=None, sort=None, limit=None, filter=None,
+                   dir=None, columns=None):
+        '''Posts the query and yields the result rows as they are
+        downloaded, optionally projected to columns. Use it instead of
+        post_query to aggregate large results without loading them all.
+        '''
+        query_dict = OpServerUtils.get_query_dict(
+            table, start_time, end_time,
+            select_fields,
+            where_clause,
+            sort_fields, sort, limit, filter, dir)
+        self.log.debug('Query %s:%s: %s' % (self._ip, self._port,
+                                             json.dumps(query_dict)))
+        qid = OpServerUtils.post_query(self._ip, str(self._port), query_dict)
+        if qid is not None:
+            for item in OpServerUtils.iter_query_result(
+                    self._ip, str(self._port), qid, columns=columns):
+                yield item
+    # end iter_query
+
 #    @timeout(600, os.strerror(errno.ETIMEDOUT))
     def post_query(self, table, start_time=None, end_time=None,
                    select_fields=None,
                    where_clause='',
                    sort_fields=None, sort=None, limit=None, filter=None, dir=None):
-        res = None
+        res = []
         try:
-            flows_url = OpServerUtils.opserver_query_url(
-                self._ip, str(self._port))
-            print flows_url
-            query_dict = OpServerUtils.get_query_dict(
-                table, start_time, end_time,
-                select_fields,
-                where_clause,
-                sort_fields, sort, limit, filter, dir)
-
-            print json.dumps(query_dict)
-            res = []
-            resp = OpServerUtils.post_url_http(
-                flows_url, json.dumps(query_dict))
-            if resp is not None:
-                resp = json.loads(resp)
-                qid = resp['href'].rsplit('/', 1)[1]
-                result = OpServerUtils.get_query_result(
-                    self._ip, str(self._port), qid)
-                for item in result:
-                    res.append(item)
+            for item in self.iter_query(table, start_time, end_time,
+                                        select_fields, where_clause,
+                                        sort_fields, sort, limit, filter, dir):
+                res.append(item)
         except Exception as e:
-            print str(e)
+            self.log.error('Query of %s failed: %s' % (table, e))
         finally:
             return res
 
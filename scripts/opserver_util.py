@@ -14,7 +14,11 @@ import requests
 import pkg_resources
 import xmltodict
 import json
+import Queue
+import threading
 import gevent
+from multiprocessing.pool import ThreadPool
+from tcutils.wait import backoff_delays
 try:
     from pysandesh.gen_py.sandesh.ttypes import SandeshType
 except:
@@ -34,6 +38,16 @@ class OpServerUtils(object):
     DEFAULT_TIME_DELTA = 10 * 60 * 1000000  # 10 minutes in microseconds
     USECS_IN_SEC = 1000 * 1000
     OBJECT_ID = 'ObjectId'
+    # Query results are downloaded by QUERY_WORKERS threads, read in
+    # READ_SIZE bytes and queued in batches of BATCH_SIZE rows.
+    QUERY_WORKERS = 4
+    READ_SIZE = 64 * 1024
+    BATCH_SIZE = 1000
+    MAX_BATCHES = 8
+    # secs to wait on the opserver per HTTP request, and for a query to
+    # complete
+    HTTP_TIMEOUT = 60
+    QUERY_TIMEOUT = 300
 
     POST_HEADERS = {'Content-type':
                     'application/json; charset="UTF-8"', 'Expect': '202-accepted'}
@@ -61,17 +75,22 @@ class OpServerUtils(object):
     @staticmethod
     def post_url_http(url, params):
         try:
-            if int(pkg_resources.get_distribution("requests").version[0]) == 1:
+            if int(pkg_resources.get_distribution("requests").version.split(".")[0]) >= 1:
                 response = requests.post(url, stream=True,
                                          data=params,
-                                         headers=OpServerUtils.POST_HEADERS)
+                                         headers=OpServerUtils.POST_HEADERS,
+                                         timeout=OpServerUtils.HTTP_TIMEOUT)
             else:
                 response = requests.post(url, prefetch=False,
                                          data=params,
-                                         headers=OpServerUtils.POST_HEADERS)
+                                         headers=OpServerUtils.POST_HEADERS,
+                                         timeout=OpServerUtils.HTTP_TIMEOUT)
         except requests.exceptions.ConnectionError, e:
             print "Connection to %s failed" % url
             return None
+        except requests.exceptions.Timeout, e:
+            print "Request to %s timed out" % url
+            return None
         if response.status_code == 202:
             return response.text
         else:
@@ -83,66 +102,163 @@ class OpServerUtils(object):
     def get_url_http(url):
         data = {}
         try:
-            if int(pkg_resources.get_distribution("requests").version[0]) == 1:
-                data = requests.get(url, stream=True)
+            if int(pkg_resources.get_distribution("requests").version.split(".")[0]) >= 1:
+                data = requests.get(url, stream=True,
+                                    timeout=OpServerUtils.HTTP_TIMEOUT)
             else:
-                data = requests.get(url, prefetch=False)
+                data = requests.get(url, prefetch=False,
+                                    timeout=OpServerUtils.HTTP_TIMEOUT)
         except requests.exceptions.ConnectionError, e:
             print "Connection to %s failed" % url
+        except requests.exceptions.Timeout, e:
+            print "Request to %s timed out" % url
 
         return data
     # end get_url_http
 
     @staticmethod
-    def parse_query_result(result):
-        done = False
-        resit = result.iter_lines()
-        while not done:
-            try:
-                ln = resit.next()
-                if ln == '{"value": [':
-                    continue
-                if ln == ']}':
-                    done = True
+    def iter_json_rows(chunks):
+        """Incrementally decodes the rows of a '{"value": [row, ...]}'
+        document.
+
+        chunks is an iterable of pieces of the document, e.g. a response's
+        iter_content(); rows are yielded as soon as they are complete, so
+        the whole document is never held in memory.
+        """
+        decoder = json.JSONDecoder()
+        buf = ''
+        pos = 0
+        in_list = False
+        for data in chunks:
+            buf = buf[pos:] + data
+            pos = 0
+            if not in_list:
+                start = buf.find('[')
+                if start < 0:
                     continue
-                if ln[0] == ',':
-                    out_line = '[ {} ' + ln + ' ]'
-                else:
-                    out_line = '[ {} , ' + ln + ' ]'
-
-                out_list = json.loads(out_line)
-                out_list.pop(0)
-                for i in out_list:
-                    yield i
-            except Exception as e:
-                print "Error parsing %s results: %s" % (ln, str(e))
+                pos = start + 1
+                in_list = True
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos >= len(buf):
+                    break
+                if buf[pos] == ']':
+                    return
+                try:
+                    row, pos = decoder.raw_decode(buf, pos)
+                except ValueError:
+                    # incomplete row, wait for more data
+                    break
+                yield row
+    # end iter_json_rows
+
+    @staticmethod
+    def parse_query_result(result):
+        try:
+            for row in OpServerUtils.iter_json_rows(
+                    result.iter_content(OpServerUtils.READ_SIZE)):
+                yield row
+        except Exception as e:
+            print "Error parsing %s results: %s" % (result.url, str(e))
         return
     # end parse_query_result
 
     @staticmethod
-    def get_query_result(opserver_ip, opserver_port, qid):
+    def _put(rows, item, stop):
+        # gives up when the reader went away
+        while not stop.is_set():
+            try:
+                rows.put(item, timeout=1)
+                return True
+            except Queue.Full:
+                continue
+        return False
+    # end _put
+
+    @staticmethod
+    def _fetch_chunk(url, rows, stop):
+        try:
+            resp = OpServerUtils.get_url_http(url)
+            if getattr(resp, 'status_code', None) != 200:
+                OpServerUtils._put(rows, [{}], stop)
+                return
+            batch = []
+            for row in OpServerUtils.parse_query_result(resp):
+                batch.append(row)
+                if len(batch) >= OpServerUtils.BATCH_SIZE:
+                    if not OpServerUtils._put(rows, batch, stop):
+                        return
+                    batch = []
+            if batch:
+                OpServerUtils._put(rows, batch, stop)
+        except Exception as e:
+            print "Error fetching %s results: %s" % (url, str(e))
+        finally:
+            OpServerUtils._put(rows, None, stop)
+    # end _fetch_chunk
+
+    @staticmethod
+    def iter_query_result(opserver_ip, opserver_port, qid, columns=None,
+                          workers=None):
+        """Yields the rows of query qid as they are downloaded.
+
+        The result chunks are fetched and decoded by up to workers threads
+        concurrently while rows are yielded in chunk order; each chunk
+        buffers at most MAX_BATCHES batches of rows ahead of the reader.
+        columns optionally projects every row to the given fields.
+        """
+        delays = backoff_delays(0.1, max_delay=2)
+        deadline = time.time() + OpServerUtils.QUERY_TIMEOUT
         while True:
             url = OpServerUtils.opserver_query_url(
                 opserver_ip, opserver_port) + '/' + qid
             resp = OpServerUtils.get_url_http(url)
-            if resp.status_code != 200:
+            if getattr(resp, 'status_code', None) != 200:
                 yield {}
                 return
             status = json.loads(resp.text)
             if status['progress'] != 100:
-                gevent.sleep(0.5)
+                if time.time() > deadline:
+                    print "Query %s did not complete in %s secs" % (
+                        qid, OpServerUtils.QUERY_TIMEOUT)
+                    yield {}
+                    return
+                gevent.sleep(delays.next())
                 continue
-            else:
-                for chunk in status['chunks']:
-                    url = OpServerUtils.opserver_url(
-                        opserver_ip, opserver_port) + chunk['href']
-                    resp = OpServerUtils.get_url_http(url)
-                    if resp.status_code != 200:
-                        yield {}
-                    else:
-                        for result in OpServerUtils.parse_query_result(resp):
-                            yield result
-                return
+            break
+        chunks = status['chunks']
+        if not chunks:
+            return
+        stop = threading.Event()
+        queues = [Queue.Queue(OpServerUtils.MAX_BATCHES) for chunk in chunks]
+        pool = ThreadPool(min(workers or OpServerUtils.QUERY_WORKERS,
+                              len(chunks)))
+        try:
+            for chunk, rows in zip(chunks, queues):
+                url = OpServerUtils.opserver_url(
+                    opserver_ip, opserver_port) + chunk['href']
+                pool.apply_async(OpServerUtils._fetch_chunk,
+                                 (url, rows, stop))
+            for rows in queues:
+                while True:
+                    batch = rows.get()
+                    if batch is None:
+                        break
+                    for row in batch:
+                        if columns:
+                            row = dict((col, row[col]) for col in columns
+                                       if col in row)
+                        yield row
+        finally:
+            stop.set()
+            pool.close()
+    # end iter_query_result
+
+    @staticmethod
+    def get_query_result(opserver_ip, opserver_port, qid):
+        return OpServerUtils.iter_query_result(opserver_ip, opserver_port,
+                                               qid)
     # end get_query_result
 
     @staticmethod
@@ -193,6 +309,18 @@ class OpServerUtils(object):
         return "http://" + opserver_ip + ":" + opserver_port + "/analytics/query"
     # end opserver_query_url
 
+    @staticmethod
+    def post_query(opserver_ip, opserver_port, query_dict):
+        """Posts the query query_dict to the opserver and returns its qid,
+        None if it was not accepted."""
+        resp = OpServerUtils.post_url_http(
+            OpServerUtils.opserver_query_url(opserver_ip, opserver_port),
+            json.dumps(query_dict))
+        if resp is None:
+            return None
+        return json.loads(resp)['href'].rsplit('/', 1)[1]
+    # end post_query
+
     @staticmethod
     def messages_xml_data_to_dict(messages_dict, msg_type):
         if msg_type in messages_dict:
@@ -0,0 +1,205 @@
+import time
+import json
+import string
+import logging as LOG
+from multiprocessing.pool import ThreadPool
+
+from tcutils.sshpool import ssh_run
+from tcutils.stats import percentile
+from tcutils.parsers.flow_rate_parse import FlowRateParser, steady_state
+
+PKTGEN_TEMPLATE = 'tcutils/templates/pktgen_template.py'
+PERCENTILES = (50, 90, 99)
+
+
+def rate_stats(rates, tolerance=0.1):
+    '''Percentiles, max and steady state rate of the samples rates.'''
+    stats = {'samples': len(rates), 'max': max(rates or [None]),
+             'steady_state': steady_state(rates, tolerance)}
+    for pct in PERCENTILES:
+        stats['p%d' % pct] = percentile(rates, pct)
+    return stats
+
+
+class FlowSetupBench(object):
+
+    '''Measures the flow setup rate of the vRouters.
+
+    pairs is a dictionary of compute ip to the (src VM, dst VM) fixtures of
+    a VM on that compute and its peer. For every compute, one at a time,
+    flows are offered by pktgen in the src VM at each of rates(flows/sec)
+    for duration secs; the flows also reach the peer's vRouter, so the
+    computes are not ramped together, each one is measured with its peer
+    passive. During every step the 'flow -r' output of the
+    compute and the flow counters of the agent's FlowStatsResp are sampled
+    at the same time; their percentiles and steady state rate are
+    reported per compute, with the highest steady state rate seen and the
+    offered rate at which the vRouter could not keep up.
+    '''
+
+    # secs between the FlowStatsResp samples
+    SAMPLE_INTERVAL = 1
+    # achieved rate under this fraction of the offered rate is saturation
+    SATURATION = 0.9
+    PKT_SIZE = 64
+    DST_PORT_MIN = 1000
+    SRC_PORT_MIN = 10000
+
+    def __init__(self, inputs, agent_inspect, pairs, rates, duration=30,
+                 build=None, logger=LOG):
+        self.inputs = inputs
+        self.agent_inspect = agent_inspect
+        self.pairs = pairs
+        self.rates = sorted(rates)
+        self.duration = duration
+        self.build = build
+        self.logger = logger
+        self.template = string.Template(open(PKTGEN_TEMPLATE).read())
+
+    def _compute_host(self, compute_ip):
+        return '%s@%s' % (self.inputs.username, compute_ip)
+
+    def _pktgen(self, compute_ip, step, rate):
+        '''Offers rate new flows/sec for duration secs from the src VM on
+        compute_ip; every packet is a flow, the steps use distinct source
+        ports so that their flows are new.'''
+        src_vm, dst_vm = self.pairs[compute_ip]
+        count = rate * self.duration
+        dst_ports = min(count, 65535 - self.DST_PORT_MIN)
+        src_ports = count / dst_ports + 1
+        src_port_min = self.SRC_PORT_MIN + step * src_ports
+        script = self.template.safe_substitute({
+            '__pkt_size__': self.PKT_SIZE, '__count__': count,
+            '__delay__': int(1e9 / rate),
+            '__dst_ip__': dst_vm.vm_ip, '__src_ip__': src_vm.vm_ip,
+            '__dst_port_mim__': self.DST_PORT_MIN,
+            '__dst_port_max__': self.DST_PORT_MIN + dst_ports - 1,
+            '__src_port_min__': src_port_min,
+            '__src_port_max__': src_port_min + src_ports - 1})
+        return ssh_run('%s@%s' % (src_vm.vm_username, src_vm.local_ip),
+                       src_vm.vm_password, script,
+                       gateway=(self._compute_host(compute_ip),
+                                self.inputs.password),
+                       as_sudo=True, shell='/bin/bash -c')
+
+    def _flow_r(self, compute_ip):
+        '''Returns the 'flow -r' rates(flows/sec) of compute_ip, for
+        duration secs.'''
+        output = ssh_run(self._compute_host(compute_ip),
+                         self.inputs.password,
+                         'timeout %s flow -r' % self.duration)
+        return FlowRateParser(lines=output.splitlines()).rates()
+
+    def _flows_created(self, compute_ip):
+        inspect = self.agent_inspect[compute_ip]
+        # every sample has to be a fresh read, not a cached response
+        inspect.invalidate_cache('Snh_AgentStatsReq?')
+        stats = inspect.get_vna_pkt_agentstatsreq()
+        flow_stats = stats.get('FlowStatsResp', {})
+        return int(flow_stats.get('flow_allowed') or 0) + \
+            int(flow_stats.get('flow_denied') or 0)
+
+    def _agent_rates(self, compute_ip):
+        '''Returns the flow setup rates(flows/sec) of the agent of
+        compute_ip every SAMPLE_INTERVAL, from its FlowStatsResp counters,
+        and the flows created, for duration secs.'''
+        samples = []
+        end = time.time() + self.duration
+        while True:
+            now = time.time()
+            try:
+                samples.append((now, self._flows_created(compute_ip)))
+            except Exception, e:
+                self.logger.warn('Unable to get the flow stats of %s: %s' %
+                                 (compute_ip, e))
+            if now >= end:
+                break
+            time.sleep(min(self.SAMPLE_INTERVAL, max(end - now, 0)))
+        rates = [(count - last_count) / (t - last_t) for
+                 (last_t, last_count), (t, count) in zip(samples, samples[1:])
+                 if t > last_t]
+        created = samples and samples[-1][1] - samples[0][1] or 0
+        return [int(rate) for rate in rates], created
+
+    def run_step(self, compute_ip, step, rate):
+        self.logger.info('Offering %s flows/sec on %s' % (rate, compute_ip))
+        pool = ThreadPool(2)
+        try:
+            flow_r = pool.apply_async(self._flow_r, (compute_ip,))
+            agent = pool.apply_async(self._agent_rates, (compute_ip,))
+            self._pktgen(compute_ip, step, rate)
+            flow_r_rates = flow_r.get(self.duration * 2 + 30)
+            agent_rates, created = agent.get(self.duration * 2 + 30)
+        finally:
+            pool.close()
+        result = {'offered': rate, 'flows_created': created,
+                  'flow_r': rate_stats(flow_r_rates),
+                  'agent': rate_stats(agent_rates)}
+        self.logger.info('%s at %s flows/sec: flow -r %s, agent %s' % (
+            compute_ip, rate, result['flow_r'], result['agent']))
+        return result
+
+    def run_compute(self, compute_ip):
+        steps = []
+        saturated_at = None
+        for step, rate in enumerate(self.rates):
+            result = self.run_step(compute_ip, step, rate)
+            steps.append(result)
+            achieved = result['flow_r']['steady_state'] or \
+                result['agent']['steady_state'] or 0
+            if achieved < self.SATURATION * rate:
+                saturated_at = rate
+                break
+        rates = [step['flow_r']['steady_state'] or
+                 step['agent']['steady_state'] or 0 for step in steps]
+        return {'steps': steps, 'steady_state_rate': max(rates or [0]),
+                'saturated_at': saturated_at}
+
+    def run(self):
+        '''Runs the ramp on the computes one after the other and returns
+        the results; computes that failed have an error instead.'''
+        results = {'build': self.build, 'time': time.time(),
+                   'rates': self.rates, 'duration': self.duration,
+                   'computes': {}}
+        for ip in sorted(self.pairs):
+            try:
+                results['computes'][ip] = self.run_compute(ip)
+            except Exception, e:
+                self.logger.error('Flow setup benchmark on %s failed: %s'
+                                  % (ip, e))
+                results['computes'][ip] = {'error': str(e)}
+        return results
+    # end run
+# end FlowSetupBench
+
+
+def save(results, path):
+    with open(path, 'w') as fd:
+        json.dump(results, fd, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as fd:
+        return json.load(fd)
+
+
+def compare(results, baseline, tolerance=0.1):
+    '''Adds to results the change(%) of the steady state rate of every
+    compute against the same compute in baseline, a previous build's
+    results. Returns the computes whose rate dropped by more than
+    tolerance.'''
+    regressions = []
+    change = {}
+    for ip, result in results['computes'].items():
+        old = baseline.get('computes', {}).get(ip, {}).get(
+            'steady_state_rate')
+        new = result.get('steady_state_rate')
+        if not old or new is None:
+            continue
+        change[ip] = round((new - old) * 100.0 / old, 1)
+        if new < (1 - tolerance) * old:
+            regressions.append(ip)
+    results['baseline'] = {'build': baseline.get('build'),
+                           'time': baseline.get('time'), 'change': change}
+    return regressions
+# end compare
@@ -85,5 +85,10 @@ class PerformanceSanity(testtools.TestCase, PerformanceTest):
         """Check the flow setup rate between the VM's within the same VN"""
         return self.test_check_flow_setup_within_vn(no_of_flows=20000, dst_port_min=1000, dst_port_max=21000,
                                                     src_port_min=10000, src_port_max=10000)
+
+    @preposttest_wrapper
+    def test_flow_setup_rate_benchmark(self):
+        """Ramp the offered flow rate and record the flow setup rate per vRouter"""
+        return self.test_flow_setup_rate_bench()
 if __name__ == '__main__':
     unittest.main()
@@ -9,6 +9,7 @@ from connections import ContrailConnections
 from testresources import ResourcedTestCase
 from config import ConfigPerformance
 from tcutils.parsers.flow_rate_parse import FlowRateParser
+from performance.flow_setup_bench import FlowSetupBench, save, load, compare
 from config import ConfigPerformance
 from fabric.context_managers import settings, hide
 from fabric.operations import put, get, local
@@ -360,7 +361,7 @@ class PerformanceTest(ConfigPerformance,ConfigSvcChain):
         fr = open('/tmp/pktgen', 'w+')
         content = fd.read()
         template = string.Template(content)
-        fr.write((template.safe_substitute({'__pkt_size__':pkt_size, '__count__':no_of_flows, '__dst_ip__':vm2_ip, '__src_ip__':vm1_ip,
+        fr.write((template.safe_substitute({'__pkt_size__':pkt_size, '__count__':no_of_flows, '__delay__':0, '__dst_ip__':vm2_ip, '__src_ip__':vm1_ip,
                                             '__dst_port_mim__':dst_port_min, '__dst_port_max__':dst_port_max,
                                             '__src_port_min__':src_port_min,'__src_port_max__':src_port_max})))
         fr.flush()
@@ -420,7 +421,9 @@ class PerformanceTest(ConfigPerformance,ConfigSvcChain):
                 run('rm -rf /tmp/flow_rate')
         FlowRateParserObj = FlowRateParser('/tmp/flow_rate')
         flow_setup_rate = FlowRateParserObj.flowrate()
-        self.logger.info("flow setup rate: '%s'", flow_setup_rate)
+        self.logger.info("flow setup rate: '%s', p90: '%s', steady state: '%s'",
+                         flow_setup_rate, FlowRateParserObj.percentile(90),
+                         FlowRateParserObj.steady_state())
         local('rm -rf /tmp/flow_rate')
 
         results = []
@@ -436,5 +439,65 @@ class PerformanceTest(ConfigPerformance,ConfigSvcChain):
 
         return True
 
+    def test_flow_setup_rate_bench(self, rates=None, duration=None):
+        ''' Ramp the offered flow rate on the computes of two VMs within a VN
+        and record the flow setup rate of each vRouter.
+        Env FLOW_SETUP_RATES(comma separated flows/sec), FLOW_SETUP_DURATION
+        (secs per rate), FLOW_SETUP_RESULTS(JSON file to save the results to)
+        and FLOW_SETUP_BASELINE(results of a previous build to compare with).
+        '''
+        rates = rates or [int(rate) for rate in os.environ.get(
+            'FLOW_SETUP_RATES', '1000,2000,5000,10000,20000').split(',')]
+        duration = duration or int(os.environ.get('FLOW_SETUP_DURATION', 30))
+        if getattr(self, 'res', None):
+            self.vn1_fixture = self.res.vn1_fixture
+            self.vm1_fixture = self.res.vn1_vm5_fixture
+            self.vm2_fixture = self.res.vn1_vm6_fixture
+        else:
+            host_list = [self.inputs.host_data[host]['name'] for host in
+                         self.inputs.compute_ips]
+            self.vn1_fixture = self.config_vn('vn1', ['31.1.1.0/24'])
+            self.vm1_fixture = self.config_vm(
+                self.vn1_fixture, 'vm1', node_name=host_list[0])
+            self.vm2_fixture = self.config_vm(
+                self.vn1_fixture, 'vm2', node_name=host_list[-1])
+        for vm in (self.vm1_fixture, self.vm2_fixture):
+            assert vm.verify_on_setup()
+            self.nova_fixture.wait_till_vm_is_up(vm.vm_obj)
+        # flows offered from the VM on each compute to its peer; the
+        # computes are ramped one at a time
+        pairs = {self.vm1_fixture.vm_node_ip: (self.vm1_fixture,
+                                               self.vm2_fixture),
+                 self.vm2_fixture.vm_node_ip: (self.vm2_fixture,
+                                               self.vm1_fixture)}
+        build = self.inputs.run_cmd_on_server(
+            self.inputs.compute_ips[0],
+            "contrail-version | grep contrail-vrouter- | awk '{print $3}'")
+        bench = FlowSetupBench(self.inputs, self.agent_inspect, pairs, rates,
+                               duration, build=build, logger=self.logger)
+        results = bench.run()
+        errmsg = ''
+        for ip, result in sorted(results['computes'].items()):
+            if 'error' in result:
+                errmsg += 'Flow setup benchmark on %s failed: %s\n' % (
+                    ip, result['error'])
+                continue
+            self.logger.info("vRouter %s: steady state flow setup rate %s, "
+                             "saturated at offered %s", ip,
+                             result['steady_state_rate'],
+                             result['saturated_at'])
+        if os.environ.get('FLOW_SETUP_BASELINE'):
+            regressions = compare(results,
+                                  load(os.environ['FLOW_SETUP_BASELINE']))
+            self.logger.info("Change from the baseline: %s",
+                             results['baseline'])
+            for ip in regressions:
+                errmsg += 'Flow setup rate of %s dropped from the baseline' \
+                    ' by %s%%\n' % (ip, results['baseline']['change'][ip])
+        if os.environ.get('FLOW_SETUP_RESULTS'):
+            save(results, os.environ['FLOW_SETUP_RESULTS'])
+        assert not errmsg, errmsg
+        return True
+
     def cleanUp(self):
         super(PerformanceTest, self).cleanUp()
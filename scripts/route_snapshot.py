@@ -0,0 +1,228 @@
+import socket
+import urllib
+import binascii
+import logging as LOG
+
+from verification_util import EtreeToDict, IntrospectGather
+
+
+def _as_list(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return value
+    return [value]
+
+
+def _ip_to_int(ip):
+    '''Returns the (address bits, integer value) of an IPv4/IPv6 address.'''
+    family = socket.AF_INET6 if ':' in ip else socket.AF_INET
+    value = int(binascii.hexlify(socket.inet_pton(family, ip)), 16)
+    return (128 if family == socket.AF_INET6 else 32), value
+
+
+class RouteDiff(object):
+
+    '''Differences of the routes of two snapshots.
+
+    added and removed are the prefixes only in the other or only in this
+    snapshot, changed is a dictionary of the prefixes in both whose next
+    hops differ, to the (this, other) next hops.
+    '''
+
+    def __init__(self, added, removed, changed):
+        self.added = added
+        self.removed = removed
+        self.changed = changed
+
+    def __nonzero__(self):
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        return 'added: %s, removed: %s, changed: %s' % (
+            sorted(self.added), sorted(self.removed), self.changed)
+# end RouteDiff
+
+
+class RouteSnapshot(object):
+
+    '''Routes of one table of a node, fetched at once.
+
+    routes is a dictionary of prefix to the route dictionary, as returned
+    by get_cn_route_table_entry/get_vna_route; the paths of a route are
+    in its paths_key. Prefixes are also indexed by length for longest
+    prefix match.
+    '''
+
+    def __init__(self, node, table, routes, paths_key='paths'):
+        self.node = node
+        self.table = table
+        self.routes = routes
+        self.paths_key = paths_key
+        self._index = {}
+        for prefix in routes:
+            try:
+                ip, plen = prefix.split('/')
+                bits, value = _ip_to_int(ip)
+            except (ValueError, socket.error):
+                # not an ip prefix, e.g. an evpn route
+                continue
+            plen = int(plen)
+            self._index.setdefault((bits, plen), {})[
+                value >> (bits - plen)] = prefix
+        self._lengths = sorted(self._index, key=lambda key: -key[1])
+    # end __init__
+
+    @classmethod
+    def from_control_node(cls, cn_inspect, ri_name, table='inet.0',
+                          node=None, logger=LOG, max_pages=1000):
+        '''Fetches the table ri_name.table of a control node, following
+        the next_batch pages.'''
+        routes = {}
+        seen_pages = set()
+        path = 'Snh_ShowRouteReq?x=%s.%s' % (ri_name, table)
+        xpath = '/ShowRouteResp/tables/list/ShowRouteTable'
+        for page in range(max_pages):
+            p = cn_inspect.dict_get(path)
+            if p is None:
+                logger.warn('Unable to get %s.%s from %s' % (
+                    ri_name, table, node or cn_inspect._ip))
+                break
+            for rt in _as_list(EtreeToDict(xpath).get_all_entry(p)):
+                for route in _as_list(rt.get('routes')):
+                    routes[route['prefix']] = route
+            next_batch = p.findtext('.//next_batch')
+            if not next_batch or next_batch in seen_pages:
+                break
+            seen_pages.add(next_batch)
+            path = 'Snh_ShowRouteReqIterate?x=%s' % urllib.quote(next_batch)
+        return cls(node or cn_inspect._ip, '%s.%s' % (ri_name, table),
+                   routes)
+    # end from_control_node
+
+    @classmethod
+    def from_agent(cls, agent_inspect, vrf_id, node=None, max_pages=1000):
+        '''Fetches the unicast routes of vrf vrf_id of an agent, following
+        the next_page links of the Pagination; every page is streamed, so
+        that large tables are not loaded at once.'''
+        routes = {}
+        seen_pages = set()
+        path = 'Snh_Inet4UcRouteReq?x=%s' % vrf_id
+        for page in range(max_pages):
+            next_page = None
+            for entry in agent_inspect.dict_iter(
+                    path, ('RouteUcSandeshData', 'next_page')):
+                if 'next_page' in entry:
+                    next_page = entry['next_page']
+                else:
+                    routes['%s/%s' % (entry['src_ip'],
+                                      entry['src_plen'])] = entry
+            if not next_page or next_page in seen_pages:
+                break
+            seen_pages.add(next_page)
+            path = 'Snh_PageReq?x=%s' % urllib.quote(next_page)
+        return cls(node or agent_inspect._ip, str(vrf_id), routes,
+                   paths_key='path_list')
+    # end from_agent
+
+    def __len__(self):
+        return len(self.routes)
+
+    def __contains__(self, prefix):
+        return prefix in self.routes
+
+    def get_route(self, prefix):
+        return self.routes.get(prefix)
+
+    def get_paths(self, prefix):
+        '''Returns the list of paths of prefix, None if not present.'''
+        route = self.routes.get(prefix)
+        if route is None:
+            return None
+        return _as_list(route.get(self.paths_key))
+
+    @staticmethod
+    def path_next_hops(path):
+        '''Returns the next hops of a control node or agent path; an agent
+        composite(ECMP) next hop gives one per component.'''
+        if 'next_hop' in path:
+            return [path['next_hop']]
+        nhs = []
+        nh = path.get('nh') or {}
+        for component in _as_list(nh.get('mc_list')) or [nh]:
+            hop = component.get('dip') or component.get('itf') or \
+                component.get('type')
+            if hop:
+                nhs.append(hop)
+        return nhs
+
+    def next_hops(self, prefix):
+        '''Returns the sorted next hops of all the paths of prefix.'''
+        nhs = []
+        for path in self.get_paths(prefix) or []:
+            nhs.extend(self.path_next_hops(path))
+        return sorted(nhs)
+
+    def lpm(self, ip):
+        '''Returns the longest prefix matching ip, None if none does.'''
+        bits, value = _ip_to_int(ip)
+        for key in self._lengths:
+            if key[0] != bits:
+                continue
+            prefix = self._index[key].get(value >> (bits - key[1]))
+            if prefix:
+                return prefix
+        return None
+
+    def diff(self, other, compare=None):
+        '''Returns the RouteDiff from this snapshot to other. Routes in
+        both are compared by compare(snapshot, prefix), their next hops
+        by default.'''
+        compare = compare or (lambda snapshot, prefix:
+                              snapshot.next_hops(prefix))
+        added = set(other.routes) - set(self.routes)
+        removed = set(self.routes) - set(other.routes)
+        changed = {}
+        for prefix in set(self.routes) & set(other.routes):
+            this, that = compare(self, prefix), compare(other, prefix)
+            if this != that:
+                changed[prefix] = (this, that)
+        return RouteDiff(added, removed, changed)
+    # end diff
+# end RouteSnapshot
+
+
+def cn_route_snapshots(cn_inspects, ri_name, table='inet.0', logger=LOG):
+    '''Snapshots ri_name.table on all the control nodes of cn_inspects
+    concurrently; returns the GatherResult of node to snapshot.'''
+    return IntrospectGather(cn_inspects, logger=logger).gather(
+        lambda node, inspect: RouteSnapshot.from_control_node(
+            inspect, ri_name, table, node=node, logger=logger))
+
+
+def agent_route_snapshots(agent_inspects, vrf_ids, logger=LOG):
+    '''Snapshots the unicast routes of the agents concurrently; vrf_ids
+    is a dictionary of node to the vrf id on that node. Returns the
+    GatherResult of node to snapshot.'''
+    inspects = dict((node, agent_inspects[node]) for node in vrf_ids)
+    return IntrospectGather(inspects, logger=logger).gather(
+        lambda node, inspect: RouteSnapshot.from_agent(
+            inspect, vrf_ids[node], node=node))
+
+
+def diff_snapshots(snapshots, reference=None, compare=None):
+    '''Compares a dictionary of node to snapshot against the snapshot of
+    node reference(the first node by default). Returns a dictionary of
+    the nodes which differ to their RouteDiff, empty once all the nodes
+    converged.'''
+    if not snapshots:
+        return {}
+    reference = reference or sorted(snapshots)[0]
+    diffs = {}
+    for node, snapshot in snapshots.items():
+        if node == reference:
+            continue
+        diff = snapshots[reference].diff(snapshot, compare)
+        if diff:
+            diffs[node] = diff
+    return diffs
@@ -48,7 +48,7 @@ class sdnTopoSetupFixture(fixtures.Fixture):
         super(sdnTopoSetupFixture, self).setUp()
     # end setUp
 
-    def topo_setup(self, config_option='openstack', skip_verify='no', flavor='contrail_flavor_small', vms_on_single_compute=False, VmToNodeMapping=None):
+    def topo_setup(self, config_option='openstack', skip_verify='no', flavor='contrail_flavor_small', vms_on_single_compute=False, VmToNodeMapping=None, max_in_flight=None):
         '''Take topology to be configured as input and return received & configured topology -collection 
         of dictionaries. we return received topology as some data is updated and is required for 
         reference.
@@ -66,6 +66,8 @@ class sdnTopoSetupFixture(fixtures.Fixture):
            c. IPAM:    Contrail API
            d. VN:      Contrail API 
            e. VM:      Nova
+        max_in_flight: boot up to this many VMs concurrently and bring them up
+        in a pipeline, see topo_steps.createVMNova
         '''
         self.result = True
         self.err_msg = []
@@ -95,9 +97,11 @@ class sdnTopoSetupFixture(fixtures.Fixture):
         # If vm to node pinning is defined then pass it on to create VM method.
         if VmToNodeMapping is not None:
             topo_steps.createVMNova(
-                self, config_option, vms_on_single_compute, VmToNodeMapping)
+                self, config_option, vms_on_single_compute, VmToNodeMapping,
+                max_in_flight=max_in_flight)
         else:
-            topo_steps.createVMNova(self, config_option, vms_on_single_compute)
+            topo_steps.createVMNova(self, config_option, vms_on_single_compute,
+                                    max_in_flight=max_in_flight)
         topo_steps.createPublicVN(self)
         topo_steps.verifySystemPolicy(self)
         topo_steps.createStaticRouteBehindVM(self)
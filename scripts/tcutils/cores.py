@@ -5,10 +5,17 @@ import traceback
 import unittest
 from functools import wraps
 
-from fabric.api import run, cd
-from fabric.context_managers import settings, hide
+from multiprocessing.pool import ThreadPool
+
+from sshpool import ssh_run
 
 CORE_DIR = '/var/crashes'
+# Max number of nodes swept concurrently and per node command timeout(secs)
+POOL_SIZE = 20
+NODE_TIMEOUT = 60
+# Separates the core listing from contrail-status output in the combined
+# per node command.
+_STATUS_MARKER = '==== contrail-status ===='
 
 
 class TestFailed(Exception):
@@ -29,18 +36,62 @@ def get_node_ips(inputs):
     return node_ips
 
 
+def _run_on_nodes(cmd, nodes, user, password, pool_size=POOL_SIZE,
+                  timeout=NODE_TIMEOUT):
+    """Run cmd on all the nodes concurrently.
+
+    Returns a dictionary of node to command output; nodes which could not be
+    reached or timed out are left out.
+    """
+    if not nodes:
+        return {}
+
+    def _run_cmd(node):
+        try:
+            return (node, ssh_run('%s@%s' % (user, node), password, cmd,
+                                  timeout=timeout))
+        except Exception:
+            return (node, None)
+
+    pool = ThreadPool(min(pool_size, len(nodes)))
+    try:
+        results = pool.map(_run_cmd, nodes)
+    finally:
+        pool.close()
+    return dict((node, result) for node, result in results
+                if result is not None)
+
+
+def _parse_cores(output):
+    return output.split()
+
+
+def _parse_service_crashes(crash):
+    services = []
+    for line in crash.split("\n"):
+        if "Failed service list" in line:
+            # dont iterate beyond this to look for service: status
+            break
+        status = None
+        service_status = line.split(":")
+        service = service_status[0]
+        if len(service_status) == 2:
+            status = service_status[1].strip()
+        if (status == "inactive" or
+                status == "failed"):
+            services.append(service)
+    return services
+
+
 def get_cores(nodes, user, password):
     """Get the list of cores in all of the nodes in the test setup.
     """
     cores = {}
-    for node in nodes:
-        with hide('everything'):
-            with settings(host_string='%s@%s' % (user, node), password=password,
-                          warn_only=True, abort_on_prompts= False ):
-                with cd(CORE_DIR):
-                    core = run("ls core.* 2>/dev/null")
-                    if core:
-                        cores.update({node : core.split()})
+    outputs = _run_on_nodes("cd %s && ls core.* 2>/dev/null" % CORE_DIR,
+                            nodes, user, password)
+    for node, core in outputs.items():
+        if core:
+            cores.update({node: _parse_cores(core)})
     return cores
 
 
@@ -65,26 +116,32 @@ def get_service_crashes(nodes, user, password):
     """Get the list of services crashed in all of the nodes in the test setup.
     """
     crashes = {}
-    for node in nodes:
-        with hide('everything'):
-            with settings(
-                host_string='%s@%s' % (user, node), password=password,
-                    warn_only=True, abort_on_prompts=False):
-                crash = run("contrail-status")
-        services = []
+    outputs = _run_on_nodes("contrail-status", nodes, user, password)
+    for node, crash in outputs.items():
         if "Failed service list" in crash:
-            for line in crash.split("\n"):
-                if "Failed service list" in line:
-                    # dont iterate beyond this to look for service: status
-                    break
-                status = None
-                service_status = line.split(":")
-                service = service_status[0]
-                if len(service_status) == 2:
-                    status = service_status[1].strip()
-                if (status == "inactive" or
-                        status == "failed"):
-                    services.append(service)
-            crashes.update({node: services})
-
+            crashes.update({node: _parse_service_crashes(crash)})
     return crashes
+
+
+def get_cores_and_crashes(nodes, user, password, pool_size=POOL_SIZE,
+                          timeout=NODE_TIMEOUT):
+    """Get the cores and crashed services in all of the nodes in one sweep.
+
+    A single combined command is run per node and the nodes are visited
+    concurrently. Returns a (cores, crashes) tuple of dictionaries in the
+    same format as get_cores and get_service_crashes.
+    """
+    cores = {}
+    crashes = {}
+    cmd = "(cd %s && ls core.* 2>/dev/null); echo '%s'; contrail-status" % (
+        CORE_DIR, _STATUS_MARKER)
+    outputs = _run_on_nodes(cmd, nodes, user, password,
+                            pool_size=pool_size, timeout=timeout)
+    for node, output in outputs.items():
+        core, _, crash = output.partition(_STATUS_MARKER)
+        core = core.strip()
+        if core:
+            cores.update({node: _parse_cores(core)})
+        if "Failed service list" in crash:
+            crashes.update({node: _parse_service_crashes(crash)})
+    return (cores, crashes)
@@ -0,0 +1,459 @@
+"""Module to record introspect/REST responses and replay them locally.
+
+ResponseStore saves the responses the inspect classes get from a live
+setup; it is enabled by setting INTROSPECT_RECORD_DIR, see
+verification_util.IntrospectSession. StubIntrospectServer serves recorded
+or synthetic responses on a local port, so the inspect classes and the
+verifiers can be run and profiled without a setup:
+
+    server = StubIntrospectServer().start()
+    server.add_response('Snh_ShowRouteReq?x=vn1.inet.0',
+                        synth_routes('vn1', 50000))
+    cn = server.attach(ControlNodeInspect('127.0.0.1'))
+    cn.get_cn_route_table_entry('10.0.0.1/32', 'vn1')
+
+Run it to serve a store or synthetic responses from the command line:
+
+    python introspect_stub.py --store /tmp/rec --host 10.204.216.14:8083
+    python introspect_stub.py --port 8083 --routes vn1=50000
+"""
+
+import os
+import sys
+import json
+import atexit
+import urllib
+import hashlib
+import argparse
+import threading
+import urlparse
+import BaseHTTPServer
+import SocketServer
+from xml.sax.saxutils import escape
+
+XML = 'text/xml'
+JSON = 'application/json'
+
+
+class ResponseStore(object):
+
+    """Directory of recorded responses, one sub directory per host:port.
+
+    Every sub directory has an index.json mapping the request path(with
+    the query) to the file holding the response body.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._index = {}
+        self._lock = threading.Lock()
+
+    def _host_dir(self, host):
+        return os.path.join(self.directory, host.replace(':', '_'))
+
+    def _load_index(self, host):
+        if host not in self._index:
+            index_file = os.path.join(self._host_dir(host), 'index.json')
+            if os.path.exists(index_file):
+                with open(index_file) as fd:
+                    self._index[host] = json.load(fd)
+            else:
+                self._index[host] = {}
+        return self._index[host]
+
+    def hosts(self):
+        '''Returns the host:port of the recorded servers.'''
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(name.replace('_', ':') for name in
+                      os.listdir(self.directory) if os.path.exists(
+                          os.path.join(self.directory, name, 'index.json')))
+
+    def record(self, ip, port, url, status, content_type, body):
+        host = '%s:%s' % (ip, port)
+        parsed = urlparse.urlsplit(url)
+        path = parsed.path.lstrip('/') + (parsed.query and
+                                          '?' + parsed.query)
+        filename = hashlib.md5(path).hexdigest()
+        with self._lock:
+            index = self._load_index(host)
+            host_dir = self._host_dir(host)
+            if not os.path.isdir(host_dir):
+                os.makedirs(host_dir)
+            with open(os.path.join(host_dir, filename), 'wb') as fd:
+                fd.write(body)
+            index[path] = {'file': filename, 'status': status,
+                           'content_type': content_type}
+
+    def save(self):
+        with self._lock:
+            for host, index in self._index.items():
+                if not index:
+                    continue
+                with open(os.path.join(self._host_dir(host), 'index.json'),
+                          'w') as fd:
+                    json.dump(index, fd, indent=4)
+
+    def responses(self, host):
+        '''Yields the (path, status, content_type, body) recorded for
+        host.'''
+        with self._lock:
+            index = dict(self._load_index(host))
+        for path, entry in index.items():
+            with open(os.path.join(self._host_dir(host),
+                                   entry['file']), 'rb') as fd:
+                yield (path, entry['status'], entry['content_type'],
+                       fd.read())
+# end ResponseStore
+
+
+def get_recorder():
+    '''Returns the store responses are recorded to, None if
+    INTROSPECT_RECORD_DIR is not set.'''
+    directory = os.environ.get('INTROSPECT_RECORD_DIR')
+    if not directory:
+        return None
+    store = ResponseStore(directory)
+    atexit.register(store.save)
+    return store
+
+
+class StubIntrospectServer(SocketServer.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+
+    """Local HTTP server replaying canned responses.
+
+    A request is answered with the response added for its path and
+    query, else by the handler added for the longest matching path
+    prefix, else with the response added for its path without the query.
+    Handlers are called with the path and the query dictionary and return
+    (status, content_type, body).
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, ip='127.0.0.1', port=0):
+        BaseHTTPServer.HTTPServer.__init__(self, (ip, port), _StubHandler)
+        self.responses = {}
+        self.handlers = {}
+        self.requests = 0
+        self._sessions = []
+        self._ifmap_nodes = []
+
+    @property
+    def ip(self):
+        return self.server_address[0]
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        # lets the handler threads of keep-alive connections exit
+        for session in self._sessions:
+            session.close()
+
+    def handle_error(self, request, client_address):
+        # clients closing their keep-alive connections, handler errors
+        # are returned as 500 responses
+        pass
+
+    def add_response(self, path, response, status=200):
+        '''response is a (content_type, body) tuple, e.g. from the synth_*
+        functions.'''
+        self.responses[path.lstrip('/')] = (status,) + tuple(response)
+
+    def add_handler(self, prefix, handler):
+        self.handlers[prefix.lstrip('/')] = handler
+
+    def load(self, store, host):
+        '''Adds all the responses recorded in store for host.'''
+        for path, status, content_type, body in store.responses(host):
+            self.add_response(path, (content_type, body), status)
+        return self
+
+    def get_response(self, path):
+        path = path.lstrip('/')
+        if path in self.responses:
+            return self.responses[path]
+        base, sep, query = path.partition('?')
+        prefixes = [prefix for prefix in self.handlers
+                    if base.startswith(prefix)]
+        if prefixes:
+            query = dict((key, value[-1]) for key, value in
+                         urlparse.parse_qs(query, True).items())
+            return self.handlers[max(prefixes, key=len)](base, query)
+        if base in self.responses:
+            return self.responses[base]
+        return (404, JSON, '{}')
+
+    def attach(self, inspect):
+        '''Points an inspect object(a VerificationUtilBase) to this server
+        and returns it.'''
+        from verification_util import IntrospectSession
+        inspect._ip = self.ip
+        inspect._port = self.port
+        inspect.session = IntrospectSession.get_session(self.ip, self.port)
+        self._sessions.append(inspect.session)
+        inspect.invalidate_cache()
+        return inspect
+
+    def add_uves(self, uve_type, uves):
+        '''Serves uves, a dictionary of name to UVE, both one at a time
+        (analytics/uves/<uve_type>/<name>) and in bulk
+        (analytics/uves/<uve_type>/*?kfilt=...).'''
+        def handler(path, query):
+            name = urllib.unquote(path.rsplit('/', 1)[1])
+            if name == '*':
+                names = query.get('kfilt')
+                names = names.split(',') if names else sorted(uves)
+                return (200, JSON, json.dumps([
+                    {'name': key, 'value': uves[key]} for key in names
+                    if key in uves]))
+            if name in uves:
+                return (200, JSON, json.dumps(uves[name]))
+            return (200, JSON, '{}')
+        self.add_handler('analytics/uves/%s/' % uve_type, handler)
+
+    def add_ifmap_nodes(self, nodes):
+        '''Serves nodes, IFMapNodeShowInfo structs e.g. from
+        synth_ifmap_nodes, in Snh_IFMapTableShowReq responses filtered by
+        their table_name and search_string like the control node does.'''
+        self._ifmap_nodes.extend(nodes)
+
+        def handler(path, query):
+            table = query.get('table_name')
+            search = query.get('search_string')
+            return (200,) + ifmap_table_xml([
+                node for node in self._ifmap_nodes
+                if (not table or node['node_name'].startswith(table + ':'))
+                and (not search or search in node['node_name'])])
+        self.add_handler('Snh_IFMapTableShowReq', handler)
+# end StubIntrospectServer
+
+
+class _StubHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        try:
+            status, content_type, body = self.server.get_response(self.path)
+        except Exception as e:
+            status, content_type, body = (500, 'text/plain', str(e))
+        self.send_response(status)
+        self.send_header('Content-type', content_type)
+        self.send_header('Content-length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+# end _StubHandler
+
+
+class SandeshList(object):
+
+    """List of structs of type struct in a synthetic sandesh response."""
+
+    def __init__(self, struct, items):
+        self.struct = struct
+        self.items = items
+
+
+def _to_sandesh(tag, value, out):
+    if isinstance(value, SandeshList):
+        out.append('<%s type="list"><list type="struct" size="%d">' % (
+            tag, len(value.items)))
+        for item in value.items:
+            _to_sandesh(value.struct, item, out)
+        out.append('</list></%s>' % tag)
+    elif isinstance(value, dict):
+        out.append('<%s type="struct">' % tag)
+        for key, item in value.items():
+            _to_sandesh(key, item, out)
+        out.append('</%s>' % tag)
+    else:
+        out.append('<%s type="string">%s</%s>' % (
+            tag, escape(str(value)), tag))
+
+
+def sandesh_xml(response, fields, next_page=None):
+    '''Returns a (content_type, body) sandesh response named response with
+    fields, a dictionary whose values are strings, dictionaries(structs)
+    or SandeshLists. With next_page the response is a page of an agent
+    table, followed by its Pagination linking to next_page.'''
+    out = ['<?xml-stylesheet type="text/xsl" href="/universal_parse.xsl"?>']
+    if next_page is not None:
+        out.append('<__%s_list type="slist">' % response)
+    out.append('<%s type="sandesh">' % response)
+    for key, value in fields.items():
+        _to_sandesh(key, value, out)
+    out.append('<more type="bool">false</more></%s>' % response)
+    if next_page is not None:
+        out.append('<Pagination type="sandesh">')
+        _to_sandesh('req', {'PageReqData': {'next_page': next_page}}, out)
+        out.append('<more type="bool">false</more></Pagination>')
+        out.append('</__%s_list>' % response)
+    return (XML, ''.join(out))
+
+
+def _ip(index, base=10):
+    return '%d.%d.%d.%d' % (base, (index >> 16) & 0xff, (index >> 8) & 0xff,
+                            index & 0xff)
+
+
+def synth_routes(ri_name, count, table='inet.0', paths=1, start=0,
+                 next_batch=None):
+    '''Snh_ShowRouteReq response with count /32 routes in ri_name, from
+    the start'th one; next_batch continues it in more responses.'''
+    routes = []
+    for i in range(start, start + count):
+        routes.append({'prefix': '%s/32' % _ip(i), 'paths': SandeshList(
+            'ShowRoutePath', [{'protocol': 'XMPP',
+                               'next_hop': _ip(p, 192),
+                               'label': str(16 + i % 1000000),
+                               'source': _ip(p, 192),
+                               'local_preference': '100'}
+                              for p in range(paths)])})
+    fields = {'tables': SandeshList(
+        'ShowRouteTable', [{'routing_instance': ri_name,
+                            'routing_table_name': '%s.%s' % (ri_name, table),
+                            'prefixes': str(count),
+                            'routes': SandeshList('ShowRoute', routes)}])}
+    if next_batch:
+        fields['next_batch'] = next_batch
+    return sandesh_xml('ShowRouteResp', fields)
+
+
+def synth_vna_routes(vrf_name, count, dip='192.0.0.1', dest_vn=None,
+                     start=0, next_page=None):
+    '''Snh_Inet4UcRouteReq response with count /32 tunnel routes, from the
+    start'th one; next_page continues it in more pages.'''
+    routes = []
+    for i in range(start, start + count):
+        routes.append({'src_ip': _ip(i), 'src_plen': '32', 'vrf': vrf_name,
+                       'path_list': SandeshList('PathSandeshData', [
+                           {'peer': 'BGP', 'label': str(16 + i % 1000000),
+                            'dest_vn': dest_vn or vrf_name.rsplit(':', 1)[0],
+                            'nh': {'NhSandeshData': {
+                                'type': 'tunnel', 'dip': dip,
+                                'sip': '192.0.0.254'}}}])})
+    return sandesh_xml('Inet4UcRouteResp', {'route_list': SandeshList(
+        'RouteUcSandeshData', routes)}, next_page)
+
+
+def synth_vns(vns):
+    '''Snh_VnListReq response with vns, a list of (name, uuid, acl_uuid).'''
+    return sandesh_xml('VnListResp', {'vn_list': SandeshList(
+        'VnSandeshData', [{'name': name, 'uuid': uuid, 'acl_uuid': acl,
+                           'vrf_name': '%s:%s' % (name, name.split(':')[-1])}
+                          for name, uuid, acl in vns])})
+
+
+def synth_acl_flows(source_vn, dest_vn, count):
+    '''Snh_AclFlowReq response with count flows from source_vn to
+    dest_vn.'''
+    flows = []
+    for i in range(count):
+        flows.append({'src': _ip(i), 'dst': _ip(i, 11),
+                      'source_vn': source_vn, 'dest_vn': dest_vn,
+                      'protocol': '17', 'src_port': str(1024 + i % 60000),
+                      'dst_port': '80', 'flow_uuid': '%032x' % i,
+                      'ace_l': SandeshList('AceId', [{'id': '1'}]),
+                      'action_l': SandeshList('ActionStr',
+                                              [{'action': 'pass'}])})
+    return sandesh_xml('AclFlowResp', {'flow_entries': SandeshList(
+        'FlowSandeshData', flows), 'aceid_cnt_list': SandeshList(
+        'AceIdFlowCnt', [{'ace_id': '1', 'flow_cnt': str(count)}])})
+
+
+def synth_ifmap_nodes(count, obj_type='virtual-network',
+                      name='default-domain:admin:vn%d'):
+    '''IFMapNodeShowInfo structs of count nodes of obj_type.'''
+    nodes = []
+    for i in range(count):
+        data = '<![CDATA[<%s><id-perms><uuid><uuid-mslong>%d</uuid-mslong>' \
+            '<uuid-lslong>%d</uuid-lslong></uuid><enable>true</enable>' \
+            '</id-perms></%s>\n]]>' % (obj_type, i, i, obj_type)
+        nodes.append({'node_name': '%s:%s' % (obj_type, name % i),
+                      'interests': '', 'advertised': '',
+                      'obj_info': SandeshList('IFMapObjectShowInfo', [
+                          {'timestamp': '0', 'origin': 'MAP',
+                           'data': data}])})
+    return nodes
+
+
+def ifmap_table_xml(nodes):
+    '''Snh_IFMapTableShowReq response with nodes.'''
+    return sandesh_xml('IFMapTableShowResp', {'ifmap_db': SandeshList(
+        'IFMapNodeShowInfo', nodes)})
+
+
+def synth_ifmap_table(count, obj_type='virtual-network',
+                      name='default-domain:admin:vn%d'):
+    '''Snh_IFMapTableShowReq response with count nodes of obj_type.'''
+    return ifmap_table_xml(synth_ifmap_nodes(count, obj_type, name))
+
+
+def synth_vn_uves(count, name='default-domain:admin:vn%d'):
+    '''Returns a dictionary of count virtual-network UVEs, see
+    StubIntrospectServer.add_uves.'''
+    uves = {}
+    for i in range(count):
+        uves[name % i] = {
+            'UveVirtualNetworkConfig': {
+                'total_acl_rules': 2, 'connected_networks': [],
+                'routing_instance_list': [name % i]},
+            'UveVirtualNetworkAgent': {
+                'in_tpkts': 100 * i, 'out_tpkts': 100 * i,
+                'virtualmachine_list': [], 'acl': 'acl-%d' % i}}
+    return uves
+
+
+def main(args=sys.argv[1:]):
+    parser = argparse.ArgumentParser(description='Stub introspect server')
+    parser.add_argument('--store', help='Directory of recorded responses')
+    parser.add_argument('--host', help='Recorded ip:port to serve')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--routes', action='append', default=[],
+                        help='<routing instance>=<count> synthetic routes')
+    parser.add_argument('--flows', help='<acl uuid>=<count> synthetic flows')
+    parser.add_argument('--uves', type=int,
+                        help='Number of synthetic virtual-network UVEs')
+    args = parser.parse_args(args)
+    server = StubIntrospectServer(port=args.port)
+    if args.store:
+        store = ResponseStore(args.store)
+        for host in store.hosts():
+            if not args.host or host == args.host:
+                server.load(store, host)
+    for routes in args.routes:
+        ri_name, count = routes.split('=')
+        server.add_response('Snh_ShowRouteReq?x=%s.inet.0' % ri_name,
+                            synth_routes(ri_name, int(count)))
+    if args.flows:
+        acl, count = args.flows.split('=')
+        server.add_response('Snh_AclFlowReq?uuid=%s' % acl, synth_acl_flows(
+            'default-domain:admin:vn1', 'default-domain:admin:vn2',
+            int(count)))
+    if args.uves:
+        server.add_uves('virtual-network', synth_vn_uves(args.uves))
+    print 'Serving on %s:%s' % (server.ip, server.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -1,31 +1,68 @@
 "parser to parse the 'flow -r' output."""
 
 import re
+
+from tcutils.stats import percentile
+
+PATTERN = "Flow setup rate =\s+(-?\d+)\s+flows/sec"
+
+
+def steady_state(values, tolerance=0.1):
+    """Mean of the longest run of consecutive values within tolerance of
+    the run's median; skips the ramp up/down at either end of a sample.
+    None if there are no values."""
+    best = []
+    for start in range(len(values)):
+        for end in range(len(values), start + len(best), -1):
+            run = values[start:end]
+            median = percentile(run, 50)
+            if all(abs(value - median) <= tolerance * abs(median)
+                   for value in run):
+                best = run
+                break
+    if not best:
+        return None
+    return sum(best) / len(best)
+
+
 class FlowRateParser:
     "Parser to parse flow -r output"
-    def __init__(self, filename):
-        file=open(filename,'r')
-        self.lines = file.readlines()
+    def __init__(self, filename=None, lines=None, min_rate=100):
+        if filename:
+            file=open(filename,'r')
+            lines = file.readlines()
+            file.close()
+        self.lines = lines or []
+        #Removing negative and flows ceated by copy/ping metadata actions.
+        self.min_rate = min_rate
         self.flow_rate =[]
         self.parse()
 
     def parse(self):
-        pattern = "Flow setup rate =\s+(-?\d+)\s+flows/sec"
         for line in self.lines:
-            match = re.search(pattern, line)
-            self.flow_rate.append(int(match.group(1)))
+            match = re.search(PATTERN, line)
+            if match:
+                self.flow_rate.append(int(match.group(1)))
+
+    def rates(self):
+        "Samples above min_rate, in order."
+        return [item for item in self.flow_rate if item > self.min_rate]
 
     def flowrate(self):
-        flow_rate_filtered = []
-        for item in self.flow_rate:
-            #Removing negative and flows ceated by copy/ping metadata actions.
-            if item > 100:
-                flow_rate_filtered.append(item)
-        flow_rate_filtered.sort()
+        "Median of the samples; None if there are none."
+        flow_rate_filtered = sorted(self.rates())
         length = len(flow_rate_filtered)
+        if not length:
+            return None
         if length % 2 == 0:
             mid = length/2
             flow_rate = (flow_rate_filtered[mid] + flow_rate_filtered[mid-1])/2
         else:
             flow_rate = flow_rate_filtered[((length +1)/2)-1]
         return flow_rate
+
+    def percentile(self, pct):
+        return percentile(self.rates(), pct)
+
+    def steady_state(self, tolerance=0.1):
+        return steady_state(self.rates(), tolerance)
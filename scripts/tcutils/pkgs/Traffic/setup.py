@@ -10,5 +10,6 @@ setup(name="traffic",
       packages=['traffic',
                 'traffic.core',
                 'traffic.utils', ],
-      scripts=['traffic/scripts/sendpkts', 'traffic/scripts/recvpkts']
+      scripts=['traffic/scripts/sendpkts', 'traffic/scripts/recvpkts',
+               'traffic/scripts/trafficagent']
       )
@@ -0,0 +1,239 @@
+"""Module for the traffic agent; control channel to the sendpkts/recvpkts
+daemons of a host.
+
+The agent listens at the loopback CONTROL_PORT of the VM/host and serves
+the counters of all the traffic streams of that host, and starts, stops and
+reconfigures them, over one persistent connection. Each request and
+response is a JSON object on a line:
+
+    {"cmd": "stats", "names": ["stream1", "stream2"]}
+    {"cmd": "watch", "names": ["stream1"], "interval": 1}
+    {"cmd": "start", "role": "send", "name": "stream1", "profile": "..."}
+    {"cmd": "stop", "role": "send", "name": "stream1"}
+    {"cmd": "reconfigure", "role": "send", "name": "stream1", "profile": ".."}
+"""
+import re
+import json
+import time
+import errno
+import socket
+import threading
+import traceback
+import subprocess
+import SocketServer
+from optparse import OptionParser
+
+try:
+    # Running from the source repo "test".
+    from tcutils.pkgs.Traffic.traffic.utils.logger import LOGGER, get_logger
+    from tcutils.pkgs.Traffic.traffic.utils.globalvars import LOG_LEVEL
+except ImportError:
+    # Distributed and installed as package
+    from traffic.utils.logger import LOGGER, get_logger
+    from traffic.utils.globalvars import LOG_LEVEL
+
+LOGGER = "%s.core.agent" % LOGGER
+log = get_logger(name=LOGGER, level=LOG_LEVEL)
+
+CONTROL_PORT = 7788
+SCRIPTS = {'send': 'sendpkts', 'recv': 'recvpkts'}
+RESULTS_FILE = "/tmp/%s.results"
+
+
+class AgentError(Exception):
+    pass
+
+
+def parse_results(results):
+    """Converts the "Sent=10\\nReceived=9" results of a stream to a
+    dictionary of counter name to value.
+    """
+    return dict((name, int(value)) for name, value in
+                re.findall("([A-Za-z]+)=([0-9]+)", results))
+
+
+def read_results(name):
+    """Returns the counters of the stream name from its results file, None
+    if the stream has not written it yet.
+    """
+    try:
+        fd = open(RESULTS_FILE % name, "r")
+    except IOError:
+        return None
+    try:
+        return parse_results(fd.read())
+    finally:
+        fd.close()
+
+
+class AgentHandler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+                cmd = getattr(self, 'do_%s' % request.get('cmd'), None)
+                if not cmd:
+                    raise AgentError("Unknown command: %s" %
+                                     request.get('cmd'))
+                response = cmd(request)
+            except AgentError, err:
+                response = {'status': 'error', 'error': str(err)}
+            except Exception, err:
+                log.warn(traceback.format_exc())
+                response = {'status': 'error', 'error': str(err)}
+            if response is None:
+                # watch ends when the client closes the connection
+                break
+            self.send(response)
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            # client closed the connection, e.g. during watch
+            pass
+
+    def send(self, response):
+        response.setdefault('status', 'ok')
+        self.wfile.write(json.dumps(response) + "\n")
+        self.wfile.flush()
+
+    def _stats(self, names):
+        return dict((name, read_results(name)) for name in names)
+
+    def _run(self, role, name, *args):
+        if role not in SCRIPTS:
+            raise AgentError("Unknown role: %s" % role)
+        # close_fds; the daemonized scripts should not inherit the agent's
+        # listening socket.
+        proc = subprocess.Popen([SCRIPTS[role], "--name", name] + list(args),
+                                stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT, close_fds=True)
+        return proc.communicate()[0]
+
+    def do_stats(self, request):
+        return {'stats': self._stats(request['names'])}
+
+    def do_watch(self, request):
+        names = request['names']
+        interval = request.get('interval', 1)
+        try:
+            while True:
+                self.send({'stats': self._stats(names)})
+                time.sleep(interval)
+        except socket.error as (code, msg):
+            if code not in (errno.EPIPE, errno.ECONNRESET):
+                raise
+        return None
+
+    def do_start(self, request):
+        return {'output': self._run(request['role'], request['name'], "-p",
+                                    request['profile'])}
+
+    def do_stop(self, request):
+        output = self._run(request['role'], request['name'], "--stop")
+        return {'output': output, 'stats': parse_results(output)}
+
+    def do_reconfigure(self, request):
+        response = self.do_stop(request)
+        response['output'] += self.do_start(request)['output']
+        return response
+
+
+class TrafficAgent(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    """Serves the control channel of the traffic streams of this host."""
+
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, ip='127.0.0.1', port=CONTROL_PORT):
+        SocketServer.TCPServer.__init__(self, (ip, port), AgentHandler)
+        self.port = self.server_address[1]
+
+
+class AgentClient(object):
+
+    """Client of the traffic agent, over sock; any socket like object, e.g.
+    a socket connected to the agent or a SSH channel tunneled to it.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.rfile = sock.makefile('rb', -1)
+        # requests from many threads share the connection
+        self.lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, ip='127.0.0.1', port=CONTROL_PORT, timeout=10):
+        return cls(socket.create_connection((ip, port), timeout))
+
+    def _request(self, **request):
+        with self.lock:
+            self.sock.sendall(json.dumps(request) + "\n")
+            return self._response()
+
+    def _response(self):
+        line = self.rfile.readline()
+        if not line:
+            raise EOFError("Traffic agent closed the connection")
+        response = json.loads(line)
+        if response['status'] != 'ok':
+            raise AgentError(response['error'])
+        return response
+
+    def stats(self, names):
+        """Returns a dictionary of stream name to its counters, None for
+        the streams without results yet.
+        """
+        return self._request(cmd='stats', names=names)['stats']
+
+    def watch(self, names, interval=1):
+        """Yields the counters of the streams names every interval secs,
+        till the generator is closed; the connection is not usable after.
+        """
+        self.sock.sendall(json.dumps({'cmd': 'watch', 'names': names,
+                                      'interval': interval}) + "\n")
+        try:
+            while True:
+                yield self._response()['stats']
+        finally:
+            self.close()
+
+    def start(self, role, name, profile):
+        return self._request(cmd='start', role=role, name=name,
+                             profile=profile)['output']
+
+    def stop(self, role, name):
+        return self._request(cmd='stop', role=role, name=name)['stats']
+
+    def reconfigure(self, role, name, profile):
+        return self._request(cmd='reconfigure', role=role, name=name,
+                             profile=profile)['stats']
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+class AgentArgParser(object):
+
+    def parse(self):
+        parser = OptionParser()
+        parser.add_option("-P", "--port",
+                          dest="port",
+                          type="int",
+                          default=CONTROL_PORT,
+                          help="Loopback port to listen at.")
+        parser.add_option("-S", "--stop",
+                          dest="stop",
+                          action="store_true",
+                          default=False,
+                          help="Stop the traffic agent.")
+
+        opts, args = parser.parse_args()
+        return opts
@@ -1,14 +1,18 @@
 """Module to send packets.
 """
 import os
+import errno
 import socket
 import signal
+import struct
+import threading
 import traceback
 from time import sleep
+import time as _time
 from optparse import OptionParser
 from multiprocessing import Process, Event
 
-from scapy.all import send, sr1, sendpfast
+from scapy.all import sr1
 from scapy.packet import Raw
 from scapy.layers.inet import Ether, IP, UDP, TCP, ICMP
 
@@ -28,6 +32,12 @@ except ImportError:
 LOGGER = "%s.core.generator" % LOGGER
 log = get_logger(name=LOGGER, level=LOG_LEVEL)
 SRC_PORT = 8000
+# Max packets sent back to back by the PacketEngine and interval(secs) at
+# which the sent/received counters are written to the results file.
+BATCH_SIZE = 64
+FLUSH_INTERVAL = 1
+# Rate(pps) of the profiles which do not set one
+DEFAULT_PPS = 1000
 
 
 class CreatePkt(object):
@@ -41,8 +51,6 @@ class CreatePkt(object):
         log.debug("Stream L4: %s", self.stream.l4.__dict__)
         self.pkt = None
         self._create()
-        if isinstance(self.profile, ContinuousSportRange):
-            self.pkts = self._create_pkts()
 
     def _str_port_to_int(self):
         try:
@@ -57,9 +65,6 @@ class CreatePkt(object):
 
     def _create(self):
         l2_hdr = None
-        # To incease rate, we need to send pkt at L2 usinf sendpfast
-        if isinstance(self.profile, ContinuousSportRange):
-            l2_hdr = self._l2_hdr()
         l3_hdr = self._l3_hdr()
         l4_hdr = self._l4_hdr()
         self.payload = self._payload()
@@ -79,16 +84,6 @@ class CreatePkt(object):
             log.debug("Payload: %s", self.payload)
             self.pkt = self.pkt / self.payload
 
-    def _create_pkts(self):
-        pkts = [self.pkt]
-        for sport in range(self.profile.startport, self.profile.endport + 1):
-            self.pkt = None
-            self.stream.l4.__dict__.update({'sport': sport})
-            self._create()
-            pkts.append(self.pkt)
-
-        return pkts
-
     def _l4_hdr(self):
         l4_header = self.stream.l4.__dict__
 
@@ -125,6 +120,121 @@ class CreatePkt(object):
             return None
 
 
+def _csum_update(csum, old, new):
+    """Returns the ones complement checksum csum updated for a 16 bit word
+    of the checksummed data changed from old to new(RFC 1624).
+    """
+    csum = (~csum & 0xffff) + (~old & 0xffff) + new
+    csum = (csum & 0xffff) + (csum >> 16)
+    csum = (csum & 0xffff) + (csum >> 16)
+    return ~csum & 0xffff
+
+
+class TokenBucket(object):
+
+    """Paces packets to rate per second, in bursts of at most burst."""
+
+    def __init__(self, rate, burst=BATCH_SIZE):
+        self.rate = float(rate)
+        self.burst = max(1, min(burst, int(self.rate)))
+        self.tokens = self.burst
+        self.last = _time.time()
+
+    def take(self, count):
+        """Waits for tokens and returns how many of count packets can be
+        sent now, at least one.
+        """
+        while True:
+            now = _time.time()
+            self.tokens = min(self.burst,
+                              self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens >= 1:
+                count = min(count, int(self.tokens))
+                self.tokens -= count
+                return count
+            sleep((1 - self.tokens) / self.rate)
+
+
+class PacketEngine(object):
+
+    """Sends precomputed packets over one raw IP socket.
+
+    The packet is serialized by scapy only once. The packets of a source
+    port range are derived from it by patching the source port and the L4
+    checksum in a copy of its buffer. The IP ID and header checksum are
+    filled in by the kernel(IP_HDRINCL with ID 0). Packets are sent in
+    batches of BATCH_SIZE, paced by a token bucket if pps is given.
+    """
+
+    def __init__(self, pkt, sports=None, pps=None):
+        ip = pkt[IP].copy()
+        ip.id = 0
+        self.dst = ip.dst
+        template = bytearray(str(ip))
+        if sports:
+            self.pkts = self._sport_pkts(template, ip.proto, sports)
+        else:
+            self.pkts = [str(template)]
+        self.bucket = TokenBucket(pps) if pps else None
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_RAW,
+                                  socket.IPPROTO_RAW)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_HDRINCL, 1)
+        self.sent = 0
+
+    @staticmethod
+    def _sport_pkts(template, proto, sports):
+        l4 = (template[0] & 0x0f) * 4
+        # TCP/UDP checksum offset in the L4 header
+        csum_at = l4 + (16 if proto == 6 else 6)
+        sport, csum = (struct.unpack_from('!H', template, l4)[0],
+                       struct.unpack_from('!H', template, csum_at)[0])
+        pkts = []
+        for port in sports:
+            struct.pack_into('!H', template, l4, port)
+            # checksum 0 means no checksum for UDP
+            if csum or proto == 6:
+                new_csum = _csum_update(csum, sport, port)
+                if not new_csum and proto == 17:
+                    new_csum = 0xffff
+                struct.pack_into('!H', template, csum_at, new_csum)
+            pkts.append(str(template))
+        return pkts
+
+    def send(self, count=None, stopit=None):
+        """Sends count packets, cycling through the packets, or until
+        stopit is set if count is None. Returns the packets sent.
+        """
+        sendto = self.sock.sendto
+        addr = (self.dst, 0)
+        pkts = self.pkts
+        index = 0
+        sent = 0
+        while count is None or sent < count:
+            if stopit and stopit.is_set():
+                break
+            batch = BATCH_SIZE if count is None else min(BATCH_SIZE,
+                                                         count - sent)
+            if self.bucket:
+                batch = self.bucket.take(batch)
+            for i in xrange(batch):
+                try:
+                    sendto(pkts[index], addr)
+                except socket.error, err:
+                    if err.errno != errno.ENOBUFS:
+                        raise
+                    # Tx queue is full, let it drain
+                    sleep(0.001)
+                    break
+                index = (index + 1) % len(pkts)
+                sent += 1
+                self.sent += 1
+        return sent
+
+    def close(self):
+        self.sock.close()
+
+
 class GeneratorBase(object):
 
     def __init__(self, name, profile):
@@ -141,8 +251,8 @@ class GeneratorBase(object):
         fd = open(self.resultsfile, 'w')
         fd.write(result)
         fd.flush()
+        os.fsync(fd.fileno())
         fd.close()
-        os.system('sync')
 
 
 class Generator(Process, GeneratorBase):
@@ -152,48 +262,60 @@ class Generator(Process, GeneratorBase):
         GeneratorBase.__init__(self, name, profile)
         self.stopit = Event()
         self.stopped = Event()
+        self.engine = None
 
     def send_recv(self, pkt, timeout=2):
         # Should wait for the ICMP reply when sending ICMP request.
         # So using scapy's "sr1".
         log.debug("Sending: %s", `pkt`)
+        p = sr1(pkt, timeout=timeout)
+        if p:
+            log.debug("Received: %s", `pkt`)
+            self.recv_count += 1
+        self.count += 1
+
+    def _send(self, count=None):
+        """Sends count packets of the stream, or until stopped if count is
+        None.
+        """
         if self.profile.stream.l3.proto == "icmp":
-            p = sr1(pkt, timeout=timeout)
-            if p:
-                log.debug("Received: %s", `pkt`)
-                self.recv_count += 1
+            while count is None or count > 0:
+                if self.stopit.is_set():
+                    break
+                self.send_recv(self.pkt)
+                if count:
+                    count -= 1
         else:
-            send(pkt)
-        self.count += 1
-        self.update_result("Sent=%s\nReceived=%s" %
-                           (self.count, self.recv_count))
+            self.count += self.engine.send(count, self.stopit)
+
+    def _flush_results(self):
+        # Counters are written periodically instead of on every packet.
+        while not self.flushed.wait(FLUSH_INTERVAL):
+            self.update_result("Sent=%s\nReceived=%s" %
+                               (self.sent(), self.recv_count))
+
+    def sent(self):
+        if self.engine and self.profile.stream.l3.proto != "icmp":
+            # includes the packets of a send in progress
+            return self.engine.sent
+        return self.count
 
     def _standard_traffic(self):
-        for i in range(self.profile.count):
-            self.send_recv(self.pkt)
+        self._send(self.profile.count)
         self.stopped.set()
 
     def _continuous_traffic(self):
-        while not self.stopit.is_set():
-            self.send_recv(self.pkt)
+        self._send()
         self.stopped.set()
 
     def _burst_traffic(self):
         for i in range(self.profile.count):
-            for j in range(self.profile.burst_count):
-                self.send_recv(self.pkt)
-                sleep(self.profile.burst_interval)
+            self._send(self.profile.burst_count)
+            sleep(self.profile.burst_interval)
         self.stopped.set()
 
     def _continuous_sport_range_traffic(self):
-        self.pkts = self.creater.pkts
-        while not self.stopit.is_set():
-            sendpfast(self.pkts, pps=self.profile.pps)
-            self.count += len(self.pkts)
-            self.update_result("Sent=%s\nReceived=%s" %
-                               (self.count, self.recv_count))
-            if self.stopit.is_set():
-                break
+        self._send()
         self.stopped.set()
 
     def _start(self):
@@ -209,12 +331,33 @@ class Generator(Process, GeneratorBase):
         elif isinstance(self.profile, StandardProfile):
             self._standard_traffic()
 
+    def _create_engine(self):
+        if self.profile.stream.l3.proto == "icmp":
+            return None
+        sports = None
+        if isinstance(self.profile, ContinuousSportRange):
+            sports = [self.profile.stream.l4.sport] + range(
+                self.profile.startport, self.profile.endport + 1)
+        pps = getattr(self.profile, 'pps', None)
+        if pps is None:
+            pps = DEFAULT_PPS
+        return PacketEngine(self.pkt, sports, pps)
+
     def run(self):
+        self.flushed = threading.Event()
+        flusher = threading.Thread(target=self._flush_results)
+        flusher.daemon = True
         try:
+            self.engine = self._create_engine()
+            flusher.start()
             self._start()
         except Exception, err:
             log.warn(traceback.format_exc())
         finally:
+            self.flushed.set()
+            if self.engine:
+                self.count = self.engine.sent
+                self.engine.close()
             log.info("Total packets sent: %s", self.count)
             log.info("Total packets received: %s", self.recv_count)
             self.update_result("Sent=%s\nReceived=%s" %
@@ -1,33 +1,48 @@
 """Helper module to start/stop traffic.
 """
-import re
+import socket
 from time import sleep
 
 from fabric.api import run
 from fabric.operations import put
+from paramiko import SSHException
 from fabric.context_managers import settings, hide
 from util import run_fab_cmd_on_node
+from tcutils.sshpool import get_ssh_manager
 
 try:
     # Running from the source repo "test".
     from tcutils.pkgs.Traffic.traffic.core.profile import *
+    from tcutils.pkgs.Traffic.traffic.core.agent import AgentClient, \
+        parse_results, CONTROL_PORT
     from tcutils.pkgs.Traffic.traffic.utils.logger import LOGGER, get_logger
     from tcutils.pkgs.Traffic.traffic.utils.globalvars import LOG_LEVEL
 except ImportError:
     # Distributed and installed as package
     from traffic.core.profile import *
+    from traffic.core.agent import AgentClient, parse_results, CONTROL_PORT
     from traffic.utils.logger import LOGGER, get_logger
     from traffic.utils.globalvars import LOG_LEVEL
 
 
 LOGGER = "%s.core.helper" % LOGGER
 LOG = get_logger(name=LOGGER, level=LOG_LEVEL)
+# Timeout(secs) of the requests to the traffic agent
+AGENT_TIMEOUT = 30
+# Traffic agent clients keyed by (compute ip, VM ip); None if the agent
+# could not be reached, in which case the sendpkts/recvpkts scripts are run
+# over SSH instead.
+_agents = {}
 
 
 class SSHError(Exception):
     pass
 
 
+class AgentLost(Exception):
+    pass
+
+
 class Host(object):
 
     """Stores the credentials of a host.
@@ -42,6 +57,10 @@ class Host(object):
 
 class Helper(object):
 
+    # Whether agent_call falls back to SSH when the traffic agent is lost;
+    # fabric is not thread safe, so helpers called from threads turn it off
+    ssh_fallback = True
+
     def __init__(self, lhost, rhost, log=LOG):
         self.lhost = lhost
         self.rhost = rhost
@@ -87,6 +106,67 @@ class Helper(object):
         self.log.debug(output)
         return output
 
+    def _connect_agent(self):
+        # Start the agent in the VM, if not running already, and tunnel to
+        # its loopback port.
+        self.runcmd("trafficagent")
+        return self._open_agent()
+
+    def _open_agent(self):
+        # Tunnel to the loopback port of the agent over the pooled SSH
+        # connection to the VM; unlike runcmd, safe from many threads. The
+        # pool keeps the connection, and its gateway, open till the client
+        # is closed, however long it is idle between agent requests.
+        for retry in range(3):
+            try:
+                channel = get_ssh_manager().open_channel(
+                    '%s@%s' % (self.rhost.user, self.rhost.ip), 'ubuntu',
+                    ('127.0.0.1', CONTROL_PORT),
+                    gateway=('%s@%s' % (self.lhost.user, self.lhost.ip),
+                             self.lhost.password),
+                    timeout=AGENT_TIMEOUT)
+                return AgentClient(channel)
+            except Exception, err:
+                self.log.debug("Traffic agent in VM '%s' not reachable: %s",
+                               self.rhost.ip, err)
+                sleep(1)
+        self.log.info("Traffic agent not available in VM '%s', using SSH",
+                      self.rhost.ip)
+        return None
+
+    def agent(self):
+        """Returns the client of the traffic agent in the VM, None if it is
+        not available.
+        """
+        key = (self.lhost.ip, self.rhost.ip)
+        if key not in _agents:
+            _agents[key] = self._connect_agent()
+        return _agents[key]
+
+    def agent_call(self, method, *args):
+        """Calls method of the traffic agent in the VM; returns None if the
+        agent is not available, so that the caller falls back to SSH. With
+        ssh_fallback off, raises AgentLost instead.
+        """
+        key = (self.lhost.ip, self.rhost.ip)
+        for retry in range(2):
+            agent = self.agent()
+            if not agent:
+                break
+            try:
+                return getattr(agent, method)(*args)
+            except (EOFError, socket.error, SSHException), err:
+                # reopen the tunnel once, it might have been closed; the
+                # agent is already started
+                self.log.debug("Traffic agent in VM '%s' failed: %s",
+                               self.rhost.ip, err)
+                agent.close()
+                _agents[key] = self._open_agent()
+        if not self.ssh_fallback:
+            raise AgentLost("Traffic agent in VM '%s' is not available" %
+                            self.rhost.ip)
+        return None
+
 
 class Sender(Helper):
 
@@ -105,8 +185,11 @@ class Sender(Helper):
         self.log.debug("Sender: VM '%s' in Compute '%s'",
                        self.rhost.ip, self.lhost.ip)
         self.log.info("Sending traffic with '%s'", self.pktheader)
-        out = self.runcmd("sendpkts --name %s -p %s" %
-                          (self.name, self.profile))
+        # strip the quotes of the command line argument
+        out = self.agent_call('start', 'send', self.name, self.profile[1:-1])
+        if out is None:
+            out = self.runcmd("sendpkts --name %s -p %s" %
+                              (self.name, self.profile))
         if 'Daemon already running' in out:
             errmsg = "Traffic stream with name '%s' already present in VM '%s' \
                       at compute '%s'" % (self.name, self.rhost.ip, self.lhost.ip)
@@ -116,26 +199,40 @@ class Sender(Helper):
         """Polls for the number of packets sent/received.
            This api can be used when trraffic is live.
         """
-        # Polls for the packets sent; launches the "sendpkts" script in
-        # the VM with --poll option
-        result = self.runcmd("sendpkts --name %s --poll" % self.name)
-        sent = re.search("(Sent)=([0-9]+)", result)
-        if sent:
-            self.sent = int(sent.group(2))
-        recv = re.search("(Received)=([0-9]+)", result)
-        if recv:
-            self.recv = int(recv.group(2))
+        # Polls for the packets sent from the traffic agent; else launches
+        # the "sendpkts" script in the VM with --poll option
+        stats = self.agent_call('stats', [self.name])
+        if stats is None:
+            stats = {self.name: parse_results(
+                self.runcmd("sendpkts --name %s --poll" % self.name))}
+        self.update(stats[self.name])
+
+    def update(self, results):
+        """Updates the counters from the results of the stream."""
+        if results:
+            self.sent = results.get('Sent', self.sent)
+            self.recv = results.get('Received', self.recv)
+
+    def reconfigure(self, profile):
+        """Restarts the stream with profile."""
+        self.pktheader = profile.stream.all_fields
+        self.profile = create(profile)
+        results = self.agent_call('reconfigure', 'send', self.name,
+                                  self.profile[1:-1])
+        if results is None:
+            self.stop()
+            self.start()
+        else:
+            self.update(results)
 
     def stop(self):
-        # Stop send; launches the "sendpkts" script in the VM with --stop
-        # option
-        result = self.runcmd("sendpkts --name %s --stop" % self.name)
-        sent = re.search("(Sent)=([0-9]+)", result)
-        if sent:
-            self.sent = int(sent.group(2))
-        recv = re.search("(Received)=([0-9]+)", result)
-        if recv:
-            self.recv = int(recv.group(2))
+        # Stop send; through the traffic agent or launches the "sendpkts"
+        # script in the VM with --stop option
+        results = self.agent_call('stop', 'send', self.name)
+        if results is None:
+            results = parse_results(
+                self.runcmd("sendpkts --name %s --stop" % self.name))
+        self.update(results)
         self.log.info("Finished sending traffic with '%s'", self.pktheader)
 
 
@@ -149,34 +246,60 @@ class Receiver(Helper):
         # Initialize the packet recv count
         self.recv = None
         self.corrupt = None
+        self.reordered = None
 
     def start(self):
         # Start send; launches the "recvpkts" script in the VM
         self.log.debug("Receiver: VM '%s' in Compute '%s'",
                        self.rhost.ip, self.lhost.ip)
-        self.runcmd("recvpkts --name %s -p %s" % (self.name, self.profile))
+        if self.agent_call('start', 'recv', self.name,
+                           self.profile[1:-1]) is None:
+            self.runcmd("recvpkts --name %s -p %s" %
+                        (self.name, self.profile))
 
     def poll(self):
         """Polls for the number of packets received.
            This api can be used when traffic is live.
         """
-        # Polls for packets recieve; launches the "recvpkts" script in
-        # the VM with --poll option
-        result = self.runcmd("recvpkts --name %s --poll" % self.name)
-        recv = re.search("(Received)=([0-9]+)", result)
-        if recv:
-            self.recv = int(recv.group(2))
-        corrupt = re.search("(Corrupted)=([0-9]+)", result)
-        if corrupt:
-            self.corrupt = int(corrupt.group(2))
+        # Polls for packets recieve from the traffic agent; else launches
+        # the "recvpkts" script in the VM with --poll option
+        stats = self.agent_call('stats', [self.name])
+        if stats is None:
+            stats = {self.name: parse_results(
+                self.runcmd("recvpkts --name %s --poll" % self.name))}
+        self.update(stats[self.name])
+
+    def update(self, results):
+        """Updates the counters from the results of the stream."""
+        if results:
+            self.recv = results.get('Received', self.recv)
+            self.corrupt = results.get('Corrupted', self.corrupt)
+            self.reordered = results.get('Reordered', self.reordered)
 
     def stop(self):
-        # Stop send; launches the "recvpkts" script in the VM with --stop
-        # option
-        result = self.runcmd("recvpkts --name %s --stop" % self.name)
-        recv = re.search("(Received)=([0-9]+)", result)
-        if recv:
-            self.recv = int(recv.group(2))
-        corrupt = re.search("(Corrupted)=([0-9]+)", result)
-        if corrupt:
-            self.corrupt = int(corrupt.group(2))
+        # Stop receive; through the traffic agent or launches the
+        # "recvpkts" script in the VM with --stop option
+        results = self.agent_call('stop', 'recv', self.name)
+        if results is None:
+            results = parse_results(
+                self.runcmd("recvpkts --name %s --stop" % self.name))
+        self.update(results)
+
+
+def poll_all(helpers):
+    """Polls the counters of many Sender/Receiver helpers, with one request
+    to the traffic agent of each VM; helpers whose VM has no agent are
+    polled over SSH.
+    """
+    by_agent = {}
+    for helper in helpers:
+        by_agent.setdefault((helper.lhost.ip, helper.rhost.ip),
+                            []).append(helper)
+    for vm_helpers in by_agent.values():
+        stats = vm_helpers[0].agent_call(
+            'stats', [helper.name for helper in vm_helpers])
+        for helper in vm_helpers:
+            if stats is None:
+                helper.poll()
+            else:
+                helper.update(stats[helper.name])
@@ -3,15 +3,19 @@
 import errno
 import socket
 import signal
+import struct
+import threading
 import traceback
+from collections import deque
 from select import select
 from multiprocessing import Process, Queue
 from optparse import OptionParser
 
 from scapy.data import *
 from scapy.config import conf
-from scapy.utils import PcapReader
+from scapy.utils import PcapReader, wrpcap
 from scapy.all import plist
+from scapy.layers.l2 import Ether
 from scapy.layers.inet import IP, TCP, UDP, ICMP
 
 try:
@@ -30,6 +34,15 @@ LOGGER = "%s.core.listener" % LOGGER
 log = get_logger(name=LOGGER, level=LOG_LEVEL)
 
 MTU = 65565
+# CountingCapture: checksum of one in CHKSUM_SAMPLE counted packets is
+# verified, the last SAMPLE_SIZE counted packets are kept and the counters
+# are written to the results file every FLUSH_INTERVAL secs.
+CHKSUM_SAMPLE = 10
+SAMPLE_SIZE = 100
+FLUSH_INTERVAL = 1
+PACKET_OUTGOING = 4
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_VLAN = (0x8100, 0x88a8)
 
 
 class CaptureBase(Process):
@@ -218,6 +231,193 @@ class CaptureBase(Process):
         self.sock.close()
 
 
+def _csum(data):
+    """Returns the ones complement checksum of data; zero when data
+    includes its valid checksum.
+    """
+    if len(data) % 2:
+        data += '\0'
+    csum = sum(struct.unpack('!%dH' % (len(data) / 2), data))
+    csum = (csum & 0xffff) + (csum >> 16)
+    csum = (csum & 0xffff) + (csum >> 16)
+    return ~csum & 0xffff
+
+
+def classify(data):
+    """Classifies an ethernet frame from its raw bytes, without dissecting
+    it. Returns the (IP protocol, IP header offset) of the frames counted by
+    CaptureBase: TCP PUSH ACK, UDP and ICMP echo request, not ssh; None for
+    the other frames. A fragmented packet is counted once, on its last
+    fragment, whose L4 header is not looked at.
+    """
+    if len(data) < 34:
+        return None
+    off = 12
+    eth_type = struct.unpack('!H', data[off:off + 2])[0]
+    while eth_type in ETH_TYPE_VLAN and len(data) >= off + 6:
+        off += 4
+        eth_type = struct.unpack('!H', data[off:off + 2])[0]
+    if eth_type != ETH_TYPE_IP:
+        return None
+    ip = off + 2
+    ihl = (ord(data[ip]) & 0x0f) * 4
+    proto = ord(data[ip + 9])
+    l4 = ip + ihl
+    if struct.unpack('!H', data[ip + 6:ip + 8])[0] & 0x2000:
+        # more fragments follow; count the packet on its last fragment
+        return None
+    if is_fragment(data, ip):
+        if proto in (1, 6, 17):
+            return proto, ip
+        return None
+    if proto == 6 and len(data) >= l4 + 14:
+        sport, dport = struct.unpack('!HH', data[l4:l4 + 4])
+        if sport == 22 or dport == 22:
+            return None
+        # count only TCP PUSH ACK packet.
+        if ord(data[l4 + 13]) == 24:
+            return proto, ip
+    elif proto == 17:
+        return proto, ip
+    elif proto == 1 and len(data) > l4:
+        # count only ICMP Echo Request
+        if ord(data[l4]) == 8:
+            return proto, ip
+    return None
+
+
+def is_fragment(data, ip):
+    """Returns True if the packet at offset ip of the raw frame data is a
+    fragment other than the first, i.e. has no L4 header.
+    """
+    return bool(struct.unpack('!H', data[ip + 6:ip + 8])[0] & 0x1fff)
+
+
+def verify_checksum(data, proto, ip):
+    """Verifies the IP and TCP/UDP/ICMP checksums of the unfragmented
+    packet at offset ip of the raw frame data.
+    """
+    ihl = (ord(data[ip]) & 0x0f) * 4
+    if _csum(data[ip:ip + ihl]):
+        return False
+    length = struct.unpack('!H', data[ip + 2:ip + 4])[0]
+    segment = data[ip + ihl:ip + length]
+    if proto == 1:
+        return not _csum(segment)
+    if proto == 17 and segment[6:8] == '\0\0':
+        # UDP checksum not computed by the sender
+        return True
+    pseudo = data[ip + 12:ip + 20] + struct.pack('!BBH', 0, proto,
+                                                 len(segment))
+    return not _csum(pseudo + segment)
+
+
+class CountingCapture(CaptureBase):
+
+    """Captures with counters only, for high packet rates.
+
+    Frames are classified from their raw bytes instead of being dissected
+    and stored; only the last SAMPLE_SIZE counted frames are kept, and
+    checksums are verified on one in CHKSUM_SAMPLE of them. Packets whose
+    IP id is behind the last one are counted as reordered; the ids of a
+    sender's raw socket increase per packet. The counters are written to
+    the results file periodically.
+    """
+
+    def __init__(self, name, **kwargs):
+        super(CountingCapture, self).__init__(name, **kwargs)
+        self.received = 0
+        self.corrupted = 0
+        self.checked = 0
+        self.reordered = 0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+        self.samplefile = "/tmp/%s.pcap" % name
+        self.flushed = threading.Event()
+
+    def sniff(self, count=0, timeout=None, chksum=False, *arg, **karg):
+        """Sniff packets and count them
+        sniff([count=0,] [timeout=None,] [chksum=False] + args)
+
+          count: number of packets to capture. 0 means infinity
+        timeout: stop sniffing after a given time (default: None)
+         chksum: verify the checksum of the sampled packets
+        """
+        # The BPF filter is attached by the scapy socket; frames are read
+        # from its raw socket, so that scapy does not dissect them.
+        self.sock = conf.L2listen(type=ETH_P_ALL, *arg, **karg)
+        sock = self.sock.ins
+
+        if timeout is not None:
+            stoptime = time.time() + timeout
+        last_pkt = None
+        last_id = None
+        while self.capture:
+            if timeout is not None:
+                remain = stoptime - time.time()
+                if remain <= 0:
+                    break
+                if sock not in select([sock], [], [], remain)[0]:
+                    continue
+            data, sa_ll = sock.recvfrom(MTU)
+            if sa_ll[2] == PACKET_OUTGOING:
+                continue
+            if data == last_pkt:
+                last_pkt = None
+                # Sniff sniffs packet twice; workarund for it
+                continue
+            last_pkt = data
+            match = classify(data)
+            if not match:
+                continue
+            self.received += 1
+            ip_id = struct.unpack('!H', data[match[1] + 4:match[1] + 6])[0]
+            if last_id is not None and (ip_id - last_id) & 0x8000:
+                self.reordered += 1
+            else:
+                last_id = ip_id
+            if SAMPLE_SIZE:
+                self.samples.append(data)
+            if (chksum and not self.received % CHKSUM_SAMPLE and
+                    not is_fragment(data, match[1])):
+                self.checked += 1
+                if not verify_checksum(data, *match):
+                    self.corrupted += 1
+            if count > 0 and self.received >= count:
+                break
+
+    def _flush_results(self):
+        while not self.flushed.wait(FLUSH_INTERVAL):
+            self.update_result(self.received, self.corrupted)
+
+    def run(self):
+        flusher = threading.Thread(target=self._flush_results)
+        flusher.daemon = True
+        flusher.start()
+        try:
+            self.sniff(**self.kwargs)
+        except socket.error as (code, msg):
+            if code != errno.EINTR:
+                raise
+        except Exception, err:
+            log.warn(traceback.format_exc())
+        finally:
+            self.flushed.set()
+            self.sock.close()
+            log.debug("Total packets received: %s, checksum verified: %s",
+                      self.received, self.checked)
+            self.update_result(self.received, self.corrupted)
+            if self.samples:
+                wrpcap(self.samplefile, [Ether(s) for s in self.samples])
+
+    def update_result(self, recv, corrupt):
+        result = "Received=%s\nCorrupted=%s\nChecked=%s\nReordered=%s" % (
+            recv, corrupt, self.checked, self.reordered)
+        fd = open(self.resultsfile, 'w')
+        fd.write(result)
+        fd.flush()
+        fd.close()
+
+
 class ListenerBase(Process):
 
     def __init__(self, sock):
@@ -339,7 +539,11 @@ class PktListener(object):
         if self.profile.chksum:
             kwargs.update({'chksum': self.profile.chksum})
 
-        self.sniffer = CaptureBase(self.profile_name, **kwargs)
+        if self.profile.stopper:
+            # the stopper function needs the dissected packets
+            self.sniffer = CaptureBase(self.profile_name, **kwargs)
+        else:
+            self.sniffer = CountingCapture(self.profile_name, **kwargs)
         self.sniffer.daemon = 1
 
     def start(self):
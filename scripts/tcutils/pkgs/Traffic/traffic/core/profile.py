@@ -47,7 +47,8 @@ class StandardProfile(object):
 
     def __init__(
         self, stream, size=100, count=10, payload=None, capfilter=None,
-            stopper=None, timeout=None, iface=None, listener=None, chksum=False):
+            stopper=None, timeout=None, iface=None, listener=None, chksum=False,
+            pps=None):
         self.stream = stream
         # payload size in bytes
         self.size = size
@@ -73,6 +74,9 @@ class StandardProfile(object):
         self.listener = listener
         # to verify checksum of the received packet.
         self.chksum = chksum
+        # Packets per second to send; None sends at the generator's default
+        # rate and 0 as fast as possible.
+        self.pps = pps
 
         # Number of bursts
         self.burst_count = None
@@ -85,10 +89,10 @@ class ContinuousProfile(StandardProfile):
     def __init__(
         self, stream, size=100, count=10, payload=None, capfilter=None,
         stopper=None, timeout=None, iface=None, listener=None,
-            chksum=False):
+            chksum=False, pps=None):
         # count = 0; means send packets continuously
         super(ContinuousProfile, self).__init__(stream, size, count, payload,
-                                                capfilter, stopper, timeout, iface, listener, chksum)
+                                                capfilter, stopper, timeout, iface, listener, chksum, pps)
 
 
 class BurstProfile(StandardProfile):
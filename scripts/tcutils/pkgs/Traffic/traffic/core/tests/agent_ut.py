@@ -0,0 +1,71 @@
+"""Unittest for agent module."""
+
+import os
+import socket
+import threading
+import unittest
+
+import paramiko
+
+import tcutils.pkgs.Traffic.traffic.core.agent as agent
+from tcutils import sshpool
+
+
+class TestTrafficAgent(unittest.TestCase):
+
+    def setUp(self):
+        self.server = agent.TrafficAgent(port=0)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.client = agent.AgentClient.connect(port=self.server.port)
+        self.names = ['agent_ut%s' % i for i in range(100)]
+        for i, name in enumerate(self.names):
+            fd = open(agent.RESULTS_FILE % name, 'w')
+            fd.write("Sent=%s\nReceived=%s" % (i, i / 2))
+            fd.close()
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+        for name in self.names:
+            os.remove(agent.RESULTS_FILE % name)
+
+    def test_stats(self):
+        stats = self.client.stats(self.names + ['agent_ut_none'])
+        self.assertEqual(stats['agent_ut99'], {'Sent': 99, 'Received': 49})
+        self.assertEqual(stats['agent_ut_none'], None)
+        self.assertRaises(agent.AgentError, self.client.stop, 'foo', 'bar')
+        # the connection is still usable after an error
+        self.assertEqual(len(self.client.stats(self.names)), 100)
+
+    def test_watch(self):
+        watch = self.client.watch(['agent_ut1'], interval=0.1)
+        for i in range(3):
+            self.assertEqual(watch.next(), {'agent_ut1': {'Sent': 1,
+                                                          'Received': 0}})
+        watch.close()
+
+    def test_pooled_channel(self):
+        # the pooled SSH connection tunneling to the agent is not closed as
+        # idle while the agent client is open
+        manager = sshpool.SSHConnectionManager(idle_timeout=1)
+        key = ('root', '1.1.1.1', None, 22)
+        conn = manager._connections[key] = sshpool._Connection(
+            paramiko.SSHClient())
+        manager._acquire(conn)
+        sock = socket.create_connection(('127.0.0.1', self.server.port))
+        client = agent.AgentClient(sshpool._PooledChannel(manager, conn,
+                                                          sock))
+        conn.last_used -= 10
+        manager.close_idle()
+        self.assertEqual(len(client.stats(self.names)), 100)
+        self.assertTrue(key in manager._connections)
+        client.close()
+        conn.last_used -= 10
+        manager.close_idle()
+        self.assertFalse(key in manager._connections)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,39 @@
+"""Unittest for generator module."""
+
+import time
+import unittest
+
+from scapy.layers.inet import IP, UDP, TCP
+
+import tcutils.pkgs.Traffic.traffic.core.generator as generator
+
+
+class TestPacketEngine(unittest.TestCase):
+
+    def test_csum_update(self):
+        # checksum of the words 0x1234, 0x0050 updated for 0x0050 -> 0x1f90
+        csum = ~(0x1234 + 0x0050) & 0xffff
+        self.assertEqual(generator._csum_update(csum, 0x0050, 0x1f90),
+                         ~(0x1234 + 0x1f90) & 0xffff)
+
+    def test_sport_pkts(self):
+        for l4 in (UDP, TCP):
+            pkt = IP(src='1.1.1.1', dst='2.2.2.2', id=0) / \
+                l4(sport=8000, dport=80) / ('x' * 20)
+            pkts = generator.PacketEngine._sport_pkts(
+                bytearray(str(pkt)), pkt.proto, [8000, 8001, 9000])
+            for sport, data in zip([8000, 8001, 9000], pkts):
+                pkt[l4].sport = sport
+                pkt[l4].chksum = None
+                self.assertEqual(data, str(pkt))
+
+    def test_token_bucket(self):
+        bucket = generator.TokenBucket(200, burst=10)
+        start = time.time()
+        sent = 0
+        while sent < 100:
+            sent += bucket.take(10)
+        self.assertTrue(0.3 < time.time() - start < 0.7)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+"""Unittest for listener module."""
+
+import unittest
+
+from scapy.layers.l2 import Ether, Dot1Q
+from scapy.layers.inet import IP, UDP, TCP, ICMP, fragment
+
+import tcutils.pkgs.Traffic.traffic.core.listener as listener
+
+
+class TestCountingCapture(unittest.TestCase):
+
+    def test_classify(self):
+        ip = IP(src='1.1.1.1', dst='2.2.2.2')
+        self.assertEqual(listener.classify(str(
+            Ether() / ip / UDP(dport=8000) / 'x')), (17, 14))
+        self.assertEqual(listener.classify(str(
+            Ether() / Dot1Q(vlan=10) / ip / UDP() / 'x')), (17, 18))
+        self.assertEqual(listener.classify(str(
+            Ether() / ip / TCP(dport=80, flags='PA') / 'x')), (6, 14))
+        self.assertEqual(listener.classify(str(
+            Ether() / ip / ICMP(type=8))), (1, 14))
+        for pkt in (Ether() / ip / TCP(dport=80, flags='A'),
+                    Ether() / ip / TCP(dport=22, flags='PA'),
+                    Ether() / ip / ICMP(type=0),
+                    Ether() / IP(dst='2.2.2.2', flags='MF') / UDP()):
+            self.assertEqual(listener.classify(str(pkt)), None)
+
+    def test_classify_fragments(self):
+        for l4 in (UDP(dport=8000), TCP(dport=80, flags='PA'), ICMP()):
+            pkt = IP(str(IP(src='1.1.1.1', dst='2.2.2.2') / l4 /
+                         ('x' * 3000)))
+            frags = [str(Ether() / frag) for frag in fragment(pkt, 1400)]
+            matches = [listener.classify(frag) for frag in frags]
+            # counted once, on the last fragment
+            self.assertEqual(matches[:-1], [None] * (len(frags) - 1))
+            self.assertEqual(matches[-1], (pkt.proto, 14))
+            self.assertTrue(listener.is_fragment(frags[-1], 14))
+            self.assertFalse(listener.is_fragment(frags[0], 14))
+
+    def test_verify_checksum(self):
+        for l4 in (UDP(dport=8000), TCP(dport=80, flags='PA'), ICMP()):
+            data = str(Ether() / IP(src='1.1.1.1', dst='2.2.2.2') / l4 /
+                       ('x' * 33))
+            proto, ip = listener.classify(data)
+            self.assertTrue(listener.verify_checksum(data, proto, ip))
+            # corrupt the last payload byte
+            self.assertFalse(listener.verify_checksum(
+                data[:-1] + 'y', proto, ip))
+
+if __name__ == '__main__':
+    unittest.main()
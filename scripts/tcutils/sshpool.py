@@ -0,0 +1,324 @@
+"""Module to run remote commands over persistent SSH connections.
+
+Opening a fabric/paramiko connection per command spends most of the time in
+the TCP and SSH handshakes. The SSHConnectionManager keeps the authenticated
+transports open, keyed by (user, host, gateway), and opens a new channel on
+the existing transport for every command. Connections reaching a host
+through a gateway (e.g. a VM through its compute node) tunnel over the
+gateway's transport, so the hop is set up only once as well.
+"""
+
+import time
+import atexit
+import socket
+import threading
+import logging as LOG
+
+import paramiko
+
+LOG.basicConfig(format='%(levelname)s: %(message)s', level=LOG.DEBUG)
+
+SSH_PORT = 22
+CONNECT_TIMEOUT = 10
+IDLE_TIMEOUT = 300
+SHELL = '/bin/bash -l -c'
+
+
+class SSHResult(str):
+
+    """Command output; carries the same attributes as fabric's run output."""
+
+    def __new__(cls, stdout, stderr='', return_code=0):
+        obj = super(SSHResult, cls).__new__(cls, stdout)
+        obj.stderr = stderr
+        obj.return_code = return_code
+        obj.succeeded = return_code == 0
+        obj.failed = not obj.succeeded
+        return obj
+
+
+def _split_host_string(host_string):
+    """Split user@host[:port] into (user, host, port)."""
+    user, _, host = host_string.rpartition('@')
+    host, _, port = host.partition(':')
+    return (user or None, host, int(port or SSH_PORT))
+
+
+def _clean_output(output):
+    # Mimic fabric: normalize line endings and strip the trailing newline.
+    return output.replace('\r\n', '\n').replace('\r', '\n').rstrip('\n')
+
+
+def _quote(cmd):
+    return "'%s'" % cmd.replace("'", "'\\''")
+
+
+class _Connection(object):
+
+    def __init__(self, client, gateway_key=None):
+        self.client = client
+        self.gateway_key = gateway_key
+        self.last_used = time.time()
+        self.commands = 0
+        # commands running and forwarded channels open on the connection
+        self.in_use = 0
+
+    def is_active(self):
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+class _PooledChannel(object):
+
+    """Forwarded channel of a pooled connection; keeps the connection in
+    use till it is closed."""
+
+    def __init__(self, manager, conn, channel):
+        self._manager = manager
+        self._conn = conn
+        self._channel = channel
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    def close(self):
+        conn, self._conn = self._conn, None
+        try:
+            self._channel.close()
+        finally:
+            if conn:
+                self._manager._release(conn)
+
+
+class SSHConnectionManager(object):
+
+    """Process wide pool of authenticated SSH transports.
+
+    Connections are keyed by (user, host, gateway); gateway is None for
+    direct connections or the key of the connection used as the hop.
+    Dead transports are reconnected transparently and connections that were
+    not used for idle_timeout seconds are closed, unless a command or a
+    forwarded channel is still using them.
+    """
+
+    def __init__(self, connect_timeout=CONNECT_TIMEOUT,
+                 idle_timeout=IDLE_TIMEOUT, logger=LOG):
+        self.connect_timeout = connect_timeout
+        self.idle_timeout = idle_timeout
+        self.logger = logger
+        self._connections = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.stats = {'connects': 0, 'commands': 0, 'reconnects': 0}
+
+    def _connect(self, key, password, gateway):
+        user, host, port = key[0], key[1], key[3]
+        self.logger.debug('Opening SSH connection to %s@%s:%s%s' % (
+            user, host, port, gateway and ' via %s' % gateway[0] or ''))
+        sock = None
+        if gateway:
+            gw_conn = self._get_connection(*gateway)
+            sock = gw_conn.client.get_transport().open_channel(
+                'direct-tcpip', (host, port), ('127.0.0.1', 0))
+        client = paramiko.SSHClient()
+        client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        # the SSH agent and the user's keys are tried too, as fabric does
+        client.connect(host, port=port, username=user, password=password,
+                       sock=sock, timeout=self.connect_timeout)
+        client.get_transport().set_keepalive(30)
+        with self._lock:
+            self.stats['connects'] += 1
+        return _Connection(client, key[2])
+
+    def _get_connection(self, host_string, password, gateway=None):
+        """Returns an active connection for host_string, connecting if
+        needed.
+
+        gateway is an optional (host_string, password[, gateway]) tuple of
+        the host to hop through.
+        """
+        user, host, port = _split_host_string(host_string)
+        gateway_key = None
+        if gateway:
+            gateway_key = _split_host_string(gateway[0])
+        key = (user, host, gateway_key, port)
+        self.close_idle()
+        with self._lock:
+            conn = self._connections.get(key)
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        if conn and conn.is_active():
+            conn.last_used = time.time()
+            return conn
+        # connect outside the pool lock so hosts can be reached in parallel
+        with key_lock:
+            with self._lock:
+                conn = self._connections.get(key)
+            if conn and not conn.is_active():
+                self.logger.debug('SSH connection to %s lost, reconnecting'
+                                  % host_string)
+                with self._lock:
+                    self.stats['reconnects'] += 1
+                conn.close()
+                conn = None
+            if not conn:
+                conn = self._connect(key, password, gateway)
+                with self._lock:
+                    self._connections[key] = conn
+            conn.last_used = time.time()
+        return conn
+
+    def _acquire(self, conn):
+        with self._lock:
+            conn.in_use += 1
+            conn.last_used = time.time()
+
+    def _release(self, conn):
+        with self._lock:
+            conn.in_use -= 1
+            conn.last_used = time.time()
+
+    def _exec(self, conn, cmd, timeout, pty, stdin_data):
+        self._acquire(conn)
+        channel = None
+        try:
+            channel = conn.client.get_transport().open_session()
+            if timeout:
+                channel.settimeout(timeout)
+            if pty:
+                channel.get_pty()
+            # like fabric's default combine_stderr
+            channel.set_combine_stderr(True)
+            channel.exec_command(cmd)
+            if stdin_data:
+                channel.sendall(stdin_data)
+            stdout = channel.makefile('rb', -1).read()
+            return_code = channel.recv_exit_status()
+        finally:
+            if channel is not None:
+                channel.close()
+            self._release(conn)
+        with self._lock:
+            conn.commands += 1
+            self.stats['commands'] += 1
+        return SSHResult(_clean_output(stdout), return_code=return_code)
+
+    def execute(self, host_string, password, cmd, gateway=None,
+                timeout=None, pty=False, as_sudo=False, shell=SHELL):
+        """Run cmd on host_string (user@host[:port]) and return its output.
+
+        Like fabric, cmd is wrapped in shell (None to run it as is) and
+        prefixed with sudo if as_sudo is set for a non root user.
+
+        The output is an SSHResult string with return_code, succeeded,
+        failed and stderr attributes like fabric's run; stderr is combined
+        into the output as fabric does by default.
+        """
+        stdin_data = None
+        user = _split_host_string(host_string)[0]
+        if shell:
+            cmd = '%s %s' % (shell, _quote(cmd))
+        if as_sudo and user != 'root':
+            cmd = "sudo -S -p '' %s" % cmd
+            stdin_data = password + '\n'
+        for attempt in range(2):
+            conn = self._get_connection(host_string, password, gateway)
+            try:
+                return self._exec(conn, cmd, timeout, pty, stdin_data)
+            except socket.timeout:
+                raise
+            except (paramiko.SSHException, socket.error, EOFError), e:
+                if attempt:
+                    raise
+                self.logger.debug('SSH command on %s failed (%s), retrying '
+                                  'on a new connection' % (host_string, e))
+                self.close(host_string, gateway)
+
+    def open_channel(self, host_string, password, dest, gateway=None,
+                     timeout=None):
+        """Opens a channel forwarded by host_string to dest (host, port),
+        e.g. a service listening at the loopback of a VM, over the pooled
+        connection. The channel is a socket like object; the connection is
+        kept open till the channel is closed.
+        """
+        for attempt in range(2):
+            conn = self._get_connection(host_string, password, gateway)
+            self._acquire(conn)
+            try:
+                channel = conn.client.get_transport().open_channel(
+                    'direct-tcpip', dest, ('127.0.0.1', 0))
+                break
+            except (paramiko.SSHException, socket.error, EOFError), e:
+                self._release(conn)
+                if attempt:
+                    raise
+                self.close(host_string, gateway)
+        if timeout:
+            channel.settimeout(timeout)
+        return _PooledChannel(self, conn, channel)
+
+    def close(self, host_string, gateway=None):
+        user, host, port = _split_host_string(host_string)
+        gateway_key = gateway and _split_host_string(gateway[0])
+        with self._lock:
+            conn = self._connections.pop((user, host, gateway_key, port),
+                                         None)
+        if conn:
+            conn.close()
+
+    def close_idle(self):
+        """Close connections that were not used for idle_timeout seconds
+        and have no command running or channel open."""
+        now = time.time()
+        with self._lock:
+            idle = [key for key, conn in self._connections.items()
+                    if not conn.in_use and
+                    now - conn.last_used > self.idle_timeout]
+            # keep gateways that still carry active tunnels
+            in_use = set(conn.gateway_key for key, conn in
+                         self._connections.items() if key not in idle)
+            idle = [key for key in idle
+                    if (key[0], key[1], key[3]) not in in_use]
+            # tunneled connections have to go before their gateway
+            idle.sort(key=lambda key: key[2] is None)
+            conns = [self._connections.pop(key) for key in idle]
+        for conn in conns:
+            conn.close()
+
+    def close_all(self):
+        with self._lock:
+            conns = sorted(self._connections.values(),
+                           key=lambda conn: conn.gateway_key is None)
+            self._connections.clear()
+        for conn in conns:
+            conn.close()
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats['open'] = len(self._connections)
+        return stats
+# end SSHConnectionManager
+
+_manager = None
+_manager_lock = threading.Lock()
+
+
+def get_ssh_manager():
+    """Returns the process wide SSHConnectionManager."""
+    global _manager
+    with _manager_lock:
+        if _manager is None:
+            _manager = SSHConnectionManager()
+            atexit.register(_manager.close_all)
+        return _manager
+
+
+def ssh_run(host_string, password, cmd, **kwargs):
+    """Run cmd on host_string over a pooled SSH connection."""
+    return get_ssh_manager().execute(host_string, password, cmd, **kwargs)
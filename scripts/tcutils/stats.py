@@ -0,0 +1,12 @@
+"""Module for the statistics of the benchmark samples."""
+
+import math
+
+
+def percentile(values, pct):
+    """Nearest rank percentile of values; None if there are none."""
+    values = sorted(values)
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
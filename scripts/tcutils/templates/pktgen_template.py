@@ -23,7 +23,7 @@ PGDEV=/proc/net/pktgen/eth0
 pgset "clone_skb 0"
 pgset "pkt_size $__pkt_size__"
 pgset "count $__count__"
-pgset "delay 0"
+pgset "delay $__delay__"
 pgset "dst $__dst_ip__"
 pgset "src_min $__src_ip__"
 pgset "src_max 10.100.12.252"
@@ -36,4 +36,4 @@ pgset "udp_src_max $__src_port_max__"
 PGDEV=/proc/net/pktgen/pgctrl
 echo "Starting...ctrl^C to stop"
 pgset "start"
-echo "Done
+echo "Done"
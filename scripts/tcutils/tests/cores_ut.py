@@ -1,2 +1,43 @@
 """Unittests for cores module.
 """
+
+import unittest
+
+import tcutils.cores as cores
+
+
+class TestCores(unittest.TestCase):
+
+    def setUp(self):
+        self._run_on_nodes = cores._run_on_nodes
+
+    def tearDown(self):
+        cores._run_on_nodes = self._run_on_nodes
+
+    def test_get_cores_and_crashes(self):
+        status = "\n".join(["contrail-vrouter-agent:   active",
+                            "contrail-control:         failed",
+                            "contrail-dns:             inactive",
+                            "",
+                            "Failed service list: contrail-control"])
+        outputs = {
+            'node1': "core.vrouter.1 core.vrouter.2\n%s\n%s" % (
+                cores._STATUS_MARKER, status),
+            'node2': "%s\ncontrail-control:  active" % cores._STATUS_MARKER,
+        }
+        cores._run_on_nodes = lambda *args, **kwargs: outputs
+        core_list, crashes = cores.get_cores_and_crashes(
+            ['node1', 'node2', 'node3'], 'root', 'c0ntrail123')
+        self.assertEqual(core_list,
+                         {'node1': ['core.vrouter.1', 'core.vrouter.2']})
+        self.assertEqual(crashes,
+                         {'node1': ['contrail-control', 'contrail-dns']})
+
+    def test_find_new(self):
+        new = cores.find_new({'node1': ['core.1']},
+                             {'node1': ['core.1', 'core.2'],
+                              'node2': ['core.3']})
+        self.assertEqual(new, {'node1': ['core.2'], 'node2': ['core.3']})
+
+if __name__ == '__main__':
+    unittest.main()
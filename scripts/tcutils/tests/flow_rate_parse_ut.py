@@ -0,0 +1,33 @@
+"""Unittests for flow_rate_parse module.
+"""
+
+import unittest
+
+from tcutils.stats import percentile
+from tcutils.parsers.flow_rate_parse import FlowRateParser, steady_state
+
+
+class TestFlowRateParser(unittest.TestCase):
+
+    def test_parse(self):
+        lines = ['Flow setup rate =    50 flows/sec\n',
+                 'flow: 2000 active flows\n',
+                 'Flow setup rate =  -200 flows/sec\n'] + \
+            ['Flow setup rate =  %s flows/sec\n' % rate for rate in
+             (4000, 9000, 9100, 8900, 9050, 2000)]
+        parser = FlowRateParser(lines=lines)
+        self.assertEqual(parser.rates(), [4000, 9000, 9100, 8900, 9050, 2000])
+        self.assertEqual(parser.flowrate(), 8950)
+        self.assertEqual(parser.percentile(90), 9100)
+        self.assertEqual(parser.steady_state(), 9012)
+        self.assertEqual(FlowRateParser(lines=['garbage']).flowrate(), None)
+
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile([], 50), None)
+        self.assertEqual(steady_state([]), None)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,146 @@
+"""Unittests for introspect_stub module.
+"""
+
+import shutil
+import tempfile
+import unittest
+
+import tcutils.introspect_stub as stub
+from verification_util import IntrospectSession
+from cn_introspect_utils import ControlNodeInspect
+from vna_introspect_utils import AgentInspect
+from opserver_introspect_utils import VerificationOpsSrv
+
+
+class TestIntrospectStub(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub.StubIntrospectServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_synth_routes(self):
+        self.server.add_response('Snh_ShowRouteReq?x=vn1.inet.0',
+                                 stub.synth_routes('vn1', 1000))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        paths = cn.get_cn_route_table_entry('10.0.3.231/32', 'vn1')
+        self.assertEqual(paths[0]['protocol'], 'XMPP')
+        self.assertEqual(paths[0]['label'], str(16 + 999))
+
+    def test_cached_copies(self):
+        self.server.add_response('Snh_ShowRouteReq?x=vn1.inet.0',
+                                 stub.synth_routes('vn1', 10))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        p = cn.dict_get('Snh_ShowRouteReq?x=vn1.inet.0')
+        p.clear()
+        p = cn.dict_get('Snh_ShowRouteReq?x=vn1.inet.0')
+        self.assertEqual(len(p.xpath('//ShowRoute')), 10)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_synth_ifmap_table(self):
+        self.server.add_response('Snh_IFMapTableShowReq',
+                                 stub.synth_ifmap_table(10))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        entry = cn._get_if_map_table_entry(
+            'virtual-network:default-domain:admin:vn7')
+        self.assertEqual(entry['obj_info']['data']['id-perms']['enable'],
+                         'true')
+
+    def test_ifmap_index(self):
+        self.server.add_ifmap_nodes(stub.synth_ifmap_nodes(100))
+        self.server.add_ifmap_nodes(stub.synth_ifmap_nodes(
+            10, 'network-ipam', 'default-domain:admin:ipam%d'))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        self.assertEqual(cn.load_if_map_table('virtual-network'), 100)
+        for vn in ('vn1', 'vn1', 'vn2'):
+            self.assertTrue(cn.get_cn_config_vn(vn_name=vn))
+        self.assertEqual(self.server.requests, 1)
+        # searched for, then the whole table is read again
+        cn.invalidate_cache()
+        self.assertEqual(cn.get_cn_config_vn(vn_name='vn100'), None)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_ifmap_search(self):
+        self.server.add_ifmap_nodes(stub.synth_ifmap_nodes(100))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        # vn1 is searched for with the control node's filters, which also
+        # match vn10..vn19; all of them are indexed
+        self.assertTrue(cn.get_cn_config_vn(vn_name='vn1'))
+        self.assertTrue(cn.get_cn_config_vn(vn_name='vn15'))
+        self.assertEqual(self.server.requests, 1)
+        self.assertTrue(cn.get_cn_config_vn(vn_name='vn2'))
+        self.assertEqual(self.server.requests, 2)
+
+    def test_ifmap_search_miss(self):
+        # a control node whose search does not find the node
+        self.server.add_ifmap_nodes(stub.synth_ifmap_nodes(
+            10, name='default-domain:admin:vn.%d'))
+        self.server.add_response(
+            'Snh_IFMapTableShowReq?table_name=virtual-network'
+            '&search_string=virtual-network%3Adefault-domain%3Aadmin%3Avn.5',
+            stub.ifmap_table_xml([]))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        self.assertTrue(cn.get_cn_config_vn(vn_name='vn.5'))
+        self.assertEqual(self.server.requests, 2)
+        self.assertTrue(cn.get_cn_config_vn(vn_name='vn.6'))
+        self.assertEqual(self.server.requests, 2)
+
+    def test_ifmap_search_absent(self):
+        self.server.add_ifmap_nodes(stub.synth_ifmap_nodes(100))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        # polled till deleted; the search returns nodes, so it is trusted
+        cn.set_force_refresh(True)
+        for i in range(3):
+            self.assertEqual(cn.get_cn_config_vn(vn_name='vn'), None)
+        self.assertEqual(self.server.requests, 3)
+        # nothing returned, the whole table is loaded only once
+        for i in range(3):
+            self.assertEqual(cn.get_cn_config_vn(vn_name='vn200'), None)
+        self.assertEqual(self.server.requests, 3 + 2 + 1 + 1)
+
+    def test_stream_errors(self):
+        agent = self.server.attach(AgentInspect('127.0.0.1'))
+        # not served, 404
+        self.assertEqual(agent.get_vna_fetchallflowrecords(), None)
+        self.server.add_response('Snh_FetchAllFlowRecords',
+                                 (stub.XML, '<FlowRecordsResp><flow_list>'))
+        self.assertEqual(agent.get_vna_fetchallflowrecords(), None)
+
+    def test_uves(self):
+        self.server.add_uves('virtual-network', stub.synth_vn_uves(100))
+        ops = self.server.attach(VerificationOpsSrv('127.0.0.1'))
+        uves = ops.get_ops_uves('virtual-network', [
+            'default-domain:admin:vn1', 'default-domain:admin:vn99',
+            'default-domain:admin:vn100'])
+        self.assertEqual(sorted(uves), ['default-domain:admin:vn1',
+                                        'default-domain:admin:vn99'])
+
+    def test_record_replay(self):
+        directory = tempfile.mkdtemp()
+        try:
+            store = stub.ResponseStore(directory)
+            self.server.add_response('Snh_ShowRouteReq?x=vn1.inet.0',
+                                     stub.synth_routes('vn1', 10))
+            IntrospectSession.recorder = store
+            try:
+                cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+                recorded = cn.get_cn_route_table_entry('10.0.0.5/32', 'vn1')
+            finally:
+                IntrospectSession.recorder = None
+            store.save()
+            host = '127.0.0.1:%s' % self.server.port
+            self.assertEqual(stub.ResponseStore(directory).hosts(), [host])
+            replay = stub.StubIntrospectServer().start()
+            try:
+                replay.load(stub.ResponseStore(directory), host)
+                cn = replay.attach(ControlNodeInspect('127.0.0.1'))
+                self.assertEqual(cn.get_cn_route_table_entry(
+                    '10.0.0.5/32', 'vn1'), recorded)
+            finally:
+                replay.stop()
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
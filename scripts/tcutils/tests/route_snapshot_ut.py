@@ -0,0 +1,116 @@
+"""Unittests for route_snapshot module.
+"""
+
+import unittest
+
+import tcutils.introspect_stub as stub
+from route_snapshot import RouteSnapshot, diff_snapshots
+from cn_introspect_utils import ControlNodeInspect
+from vna_introspect_utils import AgentInspect
+
+
+class TestRouteSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub.StubIntrospectServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def test_control_node_snapshot(self):
+        self.server.add_response('Snh_ShowRouteReq?x=vn1.inet.0',
+                                 stub.synth_routes('vn1', 300, paths=2))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        snapshot = cn.get_cn_route_snapshot('vn1')
+        self.assertEqual(len(snapshot), 300)
+        self.assertEqual(snapshot.get_paths('10.0.1.4/32'),
+                         cn.get_cn_route_table_entry('10.0.1.4/32', 'vn1'))
+        self.assertEqual(snapshot.next_hops('10.0.1.4/32'),
+                         ['192.0.0.0', '192.0.0.1'])
+
+    def test_agent_snapshot(self):
+        self.server.add_response('Snh_Inet4UcRouteReq?x=3',
+                                 stub.synth_vna_routes('d:p:vn1:vn1', 100))
+        agent = self.server.attach(AgentInspect('127.0.0.1'))
+        snapshot = agent.get_vna_route_snapshot(3)
+        self.assertEqual(snapshot.get_route('10.0.0.7/32'),
+                         agent.get_vna_active_route(3, '10.0.0.7', 32))
+        self.assertEqual(snapshot.next_hops('10.0.0.7/32'), ['192.0.0.1'])
+
+    def test_control_node_paging(self):
+        self.server.add_response(
+            'Snh_ShowRouteReq?x=vn1.inet.0',
+            stub.synth_routes('vn1', 100, next_batch='vn1.inet.0||10.0.0.99'))
+        self.server.add_response(
+            'Snh_ShowRouteReqIterate?x=vn1.inet.0%7C%7C10.0.0.99',
+            stub.synth_routes('vn1', 50, start=100))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        snapshot = cn.get_cn_route_snapshot('vn1')
+        self.assertEqual(len(snapshot), 150)
+        self.assertTrue('10.0.0.149/32' in snapshot)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_control_node_paging_loop(self):
+        # a control node returning the same next_batch again
+        self.server.add_response(
+            'Snh_ShowRouteReq?x=vn1.inet.0',
+            stub.synth_routes('vn1', 10, next_batch='vn1.inet.0||10.0.0.9'))
+        self.server.add_response(
+            'Snh_ShowRouteReqIterate?x=vn1.inet.0%7C%7C10.0.0.9',
+            stub.synth_routes('vn1', 10, start=10,
+                              next_batch='vn1.inet.0||10.0.0.9'))
+        cn = self.server.attach(ControlNodeInspect('127.0.0.1'))
+        snapshot = cn.get_cn_route_snapshot('vn1')
+        self.assertEqual(len(snapshot), 20)
+        self.assertEqual(self.server.requests, 2)
+
+    def test_agent_paging(self):
+        self.server.add_response(
+            'Snh_Inet4UcRouteReq?x=3',
+            stub.synth_vna_routes('d:p:vn1:vn1', 100,
+                                  next_page='begin:100,end:199,vrf:3,'))
+        self.server.add_response(
+            'Snh_PageReq?x=begin%3A100%2Cend%3A199%2Cvrf%3A3%2C',
+            stub.synth_vna_routes('d:p:vn1:vn1', 100, start=100,
+                                  next_page='begin:200,end:299,vrf:3,'))
+        self.server.add_response(
+            'Snh_PageReq?x=begin%3A200%2Cend%3A299%2Cvrf%3A3%2C',
+            stub.synth_vna_routes('d:p:vn1:vn1', 20, start=200,
+                                  next_page=''))
+        agent = self.server.attach(AgentInspect('127.0.0.1'))
+        snapshot = agent.get_vna_route_snapshot(3)
+        self.assertEqual(len(snapshot), 220)
+        self.assertEqual(snapshot.next_hops('10.0.0.219/32'), ['192.0.0.1'])
+        self.assertEqual(self.server.requests, 3)
+
+    def test_lpm(self):
+        routes = dict((prefix, {'prefix': prefix, 'paths': []}) for prefix
+                      in ('0.0.0.0/0', '10.0.0.0/8', '10.1.0.0/16',
+                          '10.1.1.1/32', '2001:db8::/32'))
+        snapshot = RouteSnapshot('cn1', 'vn1.inet.0', routes)
+        self.assertEqual(snapshot.lpm('10.1.1.1'), '10.1.1.1/32')
+        self.assertEqual(snapshot.lpm('10.1.2.1'), '10.1.0.0/16')
+        self.assertEqual(snapshot.lpm('10.2.0.1'), '10.0.0.0/8')
+        self.assertEqual(snapshot.lpm('11.0.0.1'), '0.0.0.0/0')
+        self.assertEqual(snapshot.lpm('2001:db8::1'), '2001:db8::/32')
+        self.assertEqual(snapshot.lpm('2001:db9::1'), None)
+
+    def test_diff(self):
+        def snapshot(node, routes):
+            return RouteSnapshot(node, 'vn1.inet.0', dict(
+                (prefix, {'prefix': prefix, 'paths': [{'next_hop': nh}]})
+                for prefix, nh in routes.items()))
+        cn1 = snapshot('cn1', {'1.1.1.1/32': 'a', '1.1.1.2/32': 'b'})
+        cn2 = snapshot('cn2', {'1.1.1.1/32': 'a', '1.1.1.2/32': 'c',
+                               '1.1.1.3/32': 'a'})
+        cn3 = snapshot('cn3', {'1.1.1.1/32': 'a', '1.1.1.2/32': 'b'})
+        diff = cn1.diff(cn2)
+        self.assertEqual(diff.added, set(['1.1.1.3/32']))
+        self.assertEqual(diff.removed, set())
+        self.assertEqual(diff.changed, {'1.1.1.2/32': (['b'], ['c'])})
+        self.assertFalse(cn1.diff(cn3))
+        self.assertEqual(diff_snapshots({'cn1': cn1, 'cn2': cn2,
+                                         'cn3': cn3}).keys(), ['cn2'])
+
+if __name__ == '__main__':
+    unittest.main()
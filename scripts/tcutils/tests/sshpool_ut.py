@@ -0,0 +1,82 @@
+"""Unittests for sshpool module.
+"""
+
+import unittest
+
+from tcutils import sshpool
+
+
+class FakeChannel(object):
+
+    def __init__(self):
+        self.closed = False
+        self.timeout = None
+
+    def settimeout(self, timeout):
+        self.timeout = timeout
+
+    def close(self):
+        self.closed = True
+
+
+class FakeClient(object):
+
+    '''paramiko.SSHClient with an always active transport.'''
+
+    def __init__(self):
+        self.closed = False
+
+    def get_transport(self):
+        return self
+
+    def is_active(self):
+        return not self.closed
+
+    def open_channel(self, kind, dest, src):
+        return FakeChannel()
+
+    def close(self):
+        self.closed = True
+
+
+class TestSSHConnectionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.manager = sshpool.SSHConnectionManager(idle_timeout=10)
+        self.manager._connect = self.connect
+
+    def connect(self, key, password, gateway):
+        if gateway:
+            self.manager._get_connection(*gateway)
+        return sshpool._Connection(FakeClient(), key[2])
+
+    def age(self, seconds):
+        for conn in self.manager._connections.values():
+            conn.last_used -= seconds
+
+    def test_close_idle(self):
+        conn = self.manager._get_connection('root@1.1.1.1', 'pw')
+        self.manager.close_idle()
+        self.assertEqual(self.manager.get_stats()['open'], 1)
+        self.age(20)
+        self.manager.close_idle()
+        self.assertEqual(self.manager.get_stats()['open'], 0)
+        self.assertTrue(conn.client.closed)
+
+    def test_open_channel_keeps_connection(self):
+        channel = self.manager.open_channel(
+            'ubuntu@169.254.0.3', 'ubuntu', ('127.0.0.1', 7788),
+            gateway=('root@1.1.1.1', 'pw'), timeout=5)
+        self.assertEqual(channel.timeout, 5)
+        self.age(20)
+        # neither the tunneled connection nor its gateway are idle
+        self.manager.close_idle()
+        self.assertEqual(self.manager.get_stats()['open'], 2)
+        channel.close()
+        self.assertTrue(channel._channel.closed)
+        self.age(20)
+        self.manager.close_idle()
+        self.assertEqual(self.manager.get_stats()['open'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+"""Unittests for traffic_matrix module.
+"""
+
+import logging
+import threading
+import unittest
+
+from traffic_matrix import TrafficMatrix
+from traffic.core import helpers
+from traffic.core.helpers import Helper, Host, AgentLost
+
+LOG = logging.getLogger(__name__)
+LOG.addHandler(logging.NullHandler())
+
+
+class FakeVM(object):
+
+    def __init__(self, name, ip):
+        self.vm_name = name
+        self.vm_ip = ip
+        self.local_ip = '169.254.0.%s' % ip.rsplit('.', 1)[1]
+        self.vm_username = 'ubuntu'
+        self.vm_password = 'ubuntu'
+        self.vm_obj = name
+
+
+class FakeConnections(object):
+
+    def __init__(self):
+        self.inputs = self
+        self.nova_fixture = self
+        self.username = 'root'
+        self.password = 'c0ntrail123'
+        self.host_data = {'compute1': {'host_ip': '10.1.1.1'}}
+
+    def get_nova_host_of_vm(self, vm_obj):
+        return 'compute1'
+
+
+class FakeHelper(object):
+
+    '''Counters of a Sender/Receiver.'''
+
+    def __init__(self, sent=None, recv=None, reordered=None):
+        self.sent = sent
+        self.recv = recv
+        self.reordered = reordered
+
+
+class FakeAgentHelper(object):
+
+    '''Helper of a VM with a traffic agent, which is lost if lost is set;
+    records the thread and ssh_fallback of its calls.'''
+
+    ssh_fallback = True
+
+    def __init__(self, ip, lost=False):
+        self.rhost = Host(ip)
+        self.lost = lost
+        self.calls = []
+
+    def agent(self):
+        return True
+
+    def start(self):
+        self.calls.append((threading.current_thread(), self.ssh_fallback))
+        if self.lost and not self.ssh_fallback:
+            raise AgentLost(self.rhost.ip)
+
+
+class TestTrafficMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.vm1 = FakeVM('vm1', '1.1.1.3')
+        self.vm2 = FakeVM('vm2', '1.1.1.4')
+        self.matrix = TrafficMatrix(FakeConnections(), [
+            (self.vm1, self.vm2, 'udp', [8000, 8001], 100),
+            (self.vm2, self.vm1, 'icmp', None, 10)], logger=LOG)
+
+    def set_counters(self, flow, timestamp, sent, recv, reordered=0):
+        flow.sender = FakeHelper(sent, recv if flow.proto == 'icmp' else 0)
+        flow.receiver = FakeHelper(recv=recv, reordered=reordered)
+        flow.tick(timestamp)
+
+    def test_flows(self):
+        self.assertEqual([(flow.proto, flow.dport)
+                          for flow in self.matrix.flows],
+                         [('udp', 8000), ('udp', 8001), ('icmp', None)])
+        compute, vm = self.matrix._hosts(self.vm1)
+        self.assertEqual((compute.ip, vm.ip), ('10.1.1.1', '169.254.0.3'))
+
+    def test_stats(self):
+        udp, icmp = self.matrix.flows[0], self.matrix.flows[2]
+        self.set_counters(udp, 100, 0, 0)
+        self.set_counters(udp, 110, 1000, 900, reordered=3)
+        stats = udp.stats()
+        self.assertEqual((stats['sent'], stats['recv'], stats['lost']),
+                         (1000, 900, 100))
+        self.assertEqual(stats['loss_pct'], 10.0)
+        self.assertEqual(stats['reordered'], 3)
+        self.assertEqual((stats['tx_rate'], stats['rx_rate']),
+                         (100.0, 90.0))
+        # icmp is received when the sender gets the replies
+        self.set_counters(icmp, 100, 50, 50)
+        self.assertEqual(icmp.stats()['lost'], 0)
+        self.assertEqual(icmp.stats()['tx_rate'], 0.0)
+
+    def test_stats_receiver_late(self):
+        # the receiver has no results yet on the first tick
+        udp = self.matrix.flows[0]
+        self.set_counters(udp, 100, 100, None)
+        self.set_counters(udp, 110, 1100, 500)
+        self.set_counters(udp, 120, 2100, 1500)
+        stats = udp.stats()
+        self.assertEqual((stats['tx_rate'], stats['rx_rate']),
+                         (100.0, 100.0))
+
+    def test_stats_without_counters(self):
+        flow = self.matrix.flows[0]
+        self.set_counters(flow, 100, None, None, None)
+        stats = flow.stats()
+        self.assertEqual((stats['sent'], stats['recv'], stats['loss_pct']),
+                         (0, 0, 0.0))
+
+    def test_verify(self):
+        flows = self.matrix.flows
+        self.set_counters(flows[0], 100, 1000, 1000)
+        self.set_counters(flows[1], 100, 1000, 990)
+        self.set_counters(flows[2], 100, 0, 0)
+        errors = self.matrix.verify()
+        self.assertEqual([error.split()[1] for error in errors],
+                         sorted([flows[1].name, flows[2].name]))
+        # an idle flow fails whatever the loss allowed
+        self.assertEqual(len(self.matrix.verify(loss_allow=10)), 1)
+
+    def test_run_all_agent_lost(self):
+        vm1 = [FakeAgentHelper('1.1.1.3'), FakeAgentHelper('1.1.1.3', True),
+               FakeAgentHelper('1.1.1.3')]
+        vm2 = [FakeAgentHelper('1.1.1.4')]
+        self.matrix._run_all(vm1 + vm2, 'start')
+        main = threading.current_thread()
+        for helper in (vm1[0], vm2[0]):
+            self.assertEqual(len(helper.calls), 1)
+            self.assertNotEqual(helper.calls[0][0], main)
+            self.assertEqual(helper.calls[0][1], False)
+        # the helper whose agent is lost and the ones after it are run
+        # again in the calling thread, with the SSH fallback
+        self.assertEqual(vm1[1].calls[1:], [(main, True)])
+        self.assertEqual(vm1[2].calls, [(main, True)])
+        self.assertTrue(all(helper.ssh_fallback for helper in vm1 + vm2))
+
+
+class FakeAgent(object):
+
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.closed = False
+
+    def stats(self, names):
+        if self.fail:
+            raise EOFError('closed')
+        return dict((name, {'Sent': 1}) for name in names)
+
+    def close(self):
+        self.closed = True
+
+
+class TestAgentCall(unittest.TestCase):
+
+    def setUp(self):
+        self.helper = Helper(Host('10.1.1.1'), Host('1.1.1.3'))
+        self.key = ('10.1.1.1', '1.1.1.3')
+        self.opened = []
+
+        def runcmd(cmd):
+            self.fail('fabric command %s run on reconnect' % cmd)
+        self.helper.runcmd = runcmd
+        self.helper._open_agent = lambda: self.opened.pop(0)
+
+    def tearDown(self):
+        helpers._agents.pop(self.key, None)
+
+    def test_reopen(self):
+        lost = FakeAgent(fail=True)
+        helpers._agents[self.key] = lost
+        self.opened = [FakeAgent()]
+        self.assertEqual(self.helper.agent_call('stats', ['s1']),
+                         {'s1': {'Sent': 1}})
+        self.assertTrue(lost.closed)
+
+    def test_lost(self):
+        helpers._agents[self.key] = FakeAgent(fail=True)
+        self.opened = [None]
+        self.assertEqual(self.helper.agent_call('stats', ['s1']), None)
+        helpers._agents[self.key] = FakeAgent(fail=True)
+        self.opened = [None]
+        self.helper.ssh_fallback = False
+        self.assertRaises(AgentLost, self.helper.agent_call, 'stats',
+                          ['s1'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+"""Unittests for VnaFlowTableSnapshot of vna_results module.
+"""
+
+import unittest
+
+from vna_results import VnaFlowTableSnapshot
+
+
+def flow(sport, action='pass', source_vn='vn1', dest_vn='vn2', **fields):
+    record = {'vrf': '1', 'sip': '10.0.0.1', 'dip': '10.0.0.2',
+              'src_port': str(sport), 'dst_port': '80', 'protocol': '6',
+              'action': action, 'source_vn': source_vn, 'dest_vn': dest_vn,
+              'stats_packets': '10', 'stats_bytes': '1000'}
+    record.update(fields)
+    return record
+
+
+class TestVnaFlowTableSnapshot(unittest.TestCase):
+
+    def test_lookups(self):
+        snapshot = VnaFlowTableSnapshot([flow(1), flow(2, action='drop'),
+                                         flow(3, dest_vn='vn3')])
+        self.assertEqual(len(snapshot), 3)
+        self.assertEqual(snapshot.get('1', '10.0.0.1', '10.0.0.2', 2, 80, 6),
+                         flow(2, action='drop'))
+        self.assertEqual(snapshot.get('1', '10.0.0.1', '10.0.0.2', 4, 80, 6),
+                         None)
+        self.assertEqual(snapshot.count(vn='vn2'), 2)
+        self.assertEqual(snapshot.count(vn='vn1', action='drop'), 1)
+        self.assertEqual(snapshot.count(action='pass'), 2)
+        self.assertEqual([r['src_port'] for r in snapshot.by_vn('vn3')],
+                         ['3'])
+
+    def test_replace_reindexes(self):
+        snapshot = VnaFlowTableSnapshot([flow(1), flow(2)])
+        snapshot.add(flow(1, action='drop', dest_vn='vn3'))
+        self.assertEqual(len(snapshot), 2)
+        self.assertEqual(snapshot.count(action='pass'), 1)
+        self.assertEqual(snapshot.count(action='drop'), 1)
+        self.assertEqual(snapshot.count(vn='vn2'), 1)
+        self.assertEqual(snapshot.count(vn='vn3', action='drop'), 1)
+        self.assertEqual(snapshot.count(vn='vn1'), 2)
+        self.assertEqual([r['src_port'] for r in snapshot.by_action('drop')],
+                         ['1'])
+
+    def test_records_keep_their_fields(self):
+        # records need not have the fields of the first one
+        snapshot = VnaFlowTableSnapshot([flow(1), flow(2, nh='5')])
+        self.assertEqual(snapshot.get('1', '10.0.0.1', '10.0.0.2', 2, 80,
+                                      6)['nh'], '5')
+        self.assertFalse('nh' in snapshot.get('1', '10.0.0.1', '10.0.0.2',
+                                              1, 80, 6))
+        self.assertEqual(sorted(r['src_port'] for r in snapshot),
+                         ['1', '2'])
+
+    def test_diff(self):
+        old = VnaFlowTableSnapshot([flow(1), flow(2)])
+        new = VnaFlowTableSnapshot([flow(2, stats_packets='15'), flow(3)])
+        diff = old.diff(new)
+        key = ('1', '10.0.0.1', '10.0.0.2', '2', '80', '6')
+        self.assertEqual(diff['added'],
+                         set([('1', '10.0.0.1', '10.0.0.2', '3', '80', '6')]))
+        self.assertEqual(diff['removed'],
+                         set([('1', '10.0.0.1', '10.0.0.2', '1', '80', '6')]))
+        self.assertEqual(diff['deltas'][key],
+                         {'stats_packets': 5, 'stats_bytes': 0})
+
+if __name__ == '__main__':
+    unittest.main()
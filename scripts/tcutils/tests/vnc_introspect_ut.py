@@ -0,0 +1,110 @@
+"""Unittests for the bulk reads of vnc_introspect_utils.
+"""
+
+import json
+import unittest
+
+import tcutils.introspect_stub as stub
+from vnc_introspect_utils import VNCApiInspect
+
+
+class FakeApiServer(object):
+
+    '''Serves GETs and detail lists of objects like the API server; detail
+    lists have only the properties and refs, plus the back refs asked for
+    with fields if honor_fields is set.'''
+
+    def __init__(self, server, honor_fields=True):
+        self.server = server
+        self.honor_fields = honor_fields
+        self.objs = {}
+
+    def href(self, otype, uuid):
+        return 'http://%s:%s/%s/%s' % (self.server.ip, self.server.port,
+                                       otype, uuid)
+
+    def add(self, otype, uuid, **props):
+        obj = dict(props, uuid=uuid, fq_name=['default-domain', uuid],
+                   href=self.href(otype, uuid))
+        self.objs.setdefault(otype, {})[uuid] = obj
+        self.server.add_response('%s/%s' % (otype, uuid),
+                                 (stub.JSON, json.dumps({otype: obj})))
+        if len(self.objs[otype]) == 1:
+            self.server.add_handler(
+                otype + 's', lambda base, query: self.detail(otype, query))
+
+    def ref(self, otype, uuid):
+        return {'uuid': uuid, 'href': self.href(otype, uuid),
+                'to': ['default-domain', uuid], 'attr': None}
+
+    def detail(self, otype, query):
+        fields = query.get('fields', '').split(',') if \
+            self.honor_fields else []
+        uuids = query.get('obj_uuids')
+        objs = []
+        for uuid, obj in sorted(self.objs[otype].items()):
+            if uuids and uuid not in uuids.split(','):
+                continue
+            objs.append({otype: dict(
+                (key, value) for key, value in obj.items()
+                if not key.endswith('_back_refs') or key in fields)})
+        return (200, stub.JSON, json.dumps({otype + 's': objs}))
+# end FakeApiServer
+
+
+class TestBulkRead(unittest.TestCase):
+
+    def setUp(self):
+        self.server = stub.StubIntrospectServer().start()
+
+    def tearDown(self):
+        self.server.stop()
+
+    def populate(self, api):
+        api.add('virtual-router', 'vr1', name='vr1')
+        for i in range(3):
+            api.add('instance-ip', 'iip%d' % i,
+                    instance_ip_address='10.0.0.%d' % i)
+            api.add('virtual-machine-interface', 'vmi%d' % i,
+                    virtual_machine_refs=[api.ref('virtual-machine',
+                                                  'vm%d' % i)],
+                    instance_ip_back_refs=[api.ref('instance-ip',
+                                                   'iip%d' % i)])
+            api.add('virtual-machine', 'vm%d' % i,
+                    virtual_machine_interface_back_refs=[
+                        api.ref('virtual-machine-interface', 'vmi%d' % i)],
+                    virtual_router_back_refs=[api.ref('virtual-router',
+                                                      'vr1')])
+
+    def check_vms(self, inspect):
+        for i in range(3):
+            vm_id = 'vm%d' % i
+            self.assertEqual(inspect.get_cs_vm(vm_id).vmi_links(),
+                             [self.api.href('virtual-machine-interface',
+                                            'vmi%d' % i)])
+            self.assertTrue(inspect.get_cs_vm(vm_id).vr_link())
+            self.assertEqual(
+                [iip.ip() for iip in
+                 inspect.get_cs_instance_ips_of_vm(vm_id)], ['10.0.0.%d' % i])
+
+    def test_prefetch_with_fields(self):
+        self.api = FakeApiServer(self.server)
+        self.populate(self.api)
+        inspect = self.server.attach(VNCApiInspect('127.0.0.1'))
+        self.assertTrue(inspect.prefetch_vms(['vm0', 'vm1', 'vm2']))
+        requests = self.server.requests
+        self.check_vms(inspect)
+        # all served from the prefetched objects
+        self.assertEqual(self.server.requests, requests)
+
+    def test_prefetch_without_fields(self):
+        # an API server ignoring fields returns objects without back refs,
+        # which are read with GETs instead of being cached
+        self.api = FakeApiServer(self.server, honor_fields=False)
+        self.populate(self.api)
+        inspect = self.server.attach(VNCApiInspect('127.0.0.1'))
+        self.assertTrue(inspect.prefetch_vms(['vm0', 'vm1', 'vm2']))
+        self.check_vms(inspect)
+
+if __name__ == '__main__':
+    unittest.main()
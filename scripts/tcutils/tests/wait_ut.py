@@ -0,0 +1,57 @@
+"""Unittests for wait module.
+"""
+
+import time
+import unittest
+
+import tcutils.wait as wait
+
+
+class TestWait(unittest.TestCase):
+
+    def setUp(self):
+        wait.convergence_stats.reset()
+
+    def test_backoff_delays(self):
+        delays = wait.backoff_delays(0.5, max_delay=3, jitter=0)
+        self.assertEqual([delays.next() for i in range(5)],
+                         [0.5, 1, 2, 3, 3])
+
+    def test_wait_until(self):
+        values = iter([False, False, True])
+        result = wait.wait_until(lambda: values.next(), timeout=5,
+                                 first_delay=0.01, name='cond')
+        self.assertTrue(result)
+        stats = wait.get_convergence_stats('cond')
+        self.assertEqual((stats['converged'], stats['attempts']), (1, 3))
+
+    def test_wait_until_deadline(self):
+        start = time.time()
+        result = wait.wait_until(lambda: 0, timeout=0.2, first_delay=0.05,
+                                 name='cond')
+        self.assertEqual(result, 0)
+        self.assertTrue(time.time() - start < 0.5)
+        self.assertEqual(wait.get_convergence_stats('cond')['failed'], 1)
+
+    def test_wait_until_min_attempts(self):
+        def slow():
+            time.sleep(0.1)
+            return False
+        start = time.time()
+        wait.wait_until(slow, timeout=0.1, min_attempts=4, first_delay=0.01,
+                        name='slow')
+        self.assertEqual(wait.get_convergence_stats('slow')['attempts'], 4)
+        self.assertTrue(time.time() - start < 1)
+
+    def test_wait_until_all(self):
+        values = iter([False, True])
+        results = wait.wait_until_all({'a': lambda: True,
+                                       'b': lambda: values.next(),
+                                       'c': lambda: False},
+                                      max_attempts=3, first_delay=0.01)
+        self.assertEqual(results, {'a': True, 'b': True, 'c': False})
+        self.assertEqual(wait.get_convergence_stats('b')['attempts'], 2)
+        self.assertEqual(wait.get_convergence_stats('c')['failed'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,212 @@
+"""Module to wait for conditions to converge.
+
+Polls a condition with exponentially growing, jittered delays until it
+succeeds or an overall deadline expires. The first attempt is made right
+away and the first re-attempts follow quickly, so conditions which are
+already true or converge fast do not pay a full fixed delay, while slow
+ones back off instead of hammering the servers.
+The time each verifier took to converge is recorded in convergence
+histograms, see get_convergence_stats.
+"""
+
+import os
+import json
+import time
+import atexit
+import random
+import threading
+import logging as LOG
+
+FIRST_DELAY = 0.5
+BACKOFF_FACTOR = 2
+JITTER = 0.2
+# Upper bounds(secs) of the convergence time histogram buckets
+BUCKETS = (0.5, 1, 2, 5, 10, 30, 60, 120, 300, float('inf'))
+
+
+def backoff_delays(first_delay=FIRST_DELAY, max_delay=None,
+                   factor=BACKOFF_FACTOR, jitter=JITTER):
+    """Generates the delays between attempts.
+
+    Delays start at first_delay and are multiplied by factor up to
+    max_delay; each one is randomly spread by +/- jitter (a fraction).
+    """
+    delay = first_delay
+    while True:
+        if jitter:
+            yield delay * random.uniform(1 - jitter, 1 + jitter)
+        else:
+            yield delay
+        delay = delay * factor
+        if max_delay is not None:
+            delay = min(delay, max_delay)
+
+
+class ConvergenceStats(object):
+
+    """Per verifier histogram of the time taken to converge."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, elapsed, attempts, converged=True):
+        with self._lock:
+            stats = self._stats.setdefault(name, {
+                'converged': 0, 'failed': 0, 'attempts': 0,
+                'total_time': 0.0, 'max_time': 0.0,
+                'histogram': [0] * len(self.buckets)})
+            stats['attempts'] += attempts
+            if not converged:
+                stats['failed'] += 1
+                return
+            stats['converged'] += 1
+            stats['total_time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            for i, bound in enumerate(self.buckets):
+                if elapsed <= bound:
+                    stats['histogram'][i] += 1
+                    break
+
+    def get_stats(self, name=None):
+        '''Returns a copy of the stats of name, or of all the verifiers.'''
+        with self._lock:
+            if name is not None:
+                stats = self._stats.get(name)
+                return stats and dict(stats, histogram=list(
+                    stats['histogram']))
+            return dict((name, dict(stats, histogram=list(
+                stats['histogram']))) for name, stats in self._stats.items())
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def summary(self):
+        '''Returns a printable table of the stats, slowest verifiers first.'''
+        stats = self.get_stats()
+        labels = ['<=%s' % bound for bound in self.buckets[:-1]] + ['>%s' %
+                                                                self.buckets[-2]]
+        lines = ['%-50s %6s %6s %8s %8s  %s' % (
+            'verifier', 'ok', 'fail', 'avg(s)', 'max(s)', ' '.join(labels))]
+        for name in sorted(stats, key=lambda n: -stats[n]['max_time']):
+            s = stats[name]
+            avg = s['converged'] and s['total_time'] / s['converged']
+            lines.append('%-50s %6d %6d %8.2f %8.2f  %s' % (
+                name, s['converged'], s['failed'], avg, s['max_time'],
+                ' '.join(str(count) for count in s['histogram'])))
+        return '\n'.join(lines)
+
+    def dump(self, filename):
+        with open(filename, 'w') as fd:
+            json.dump({'buckets': [str(bound) for bound in self.buckets],
+                       'verifiers': self.get_stats()}, fd, indent=4)
+# end ConvergenceStats
+
+convergence_stats = ConvergenceStats()
+
+
+def get_convergence_stats(name=None):
+    return convergence_stats.get_stats(name)
+
+
+def _dump_convergence_stats():
+    filename = os.environ.get('TEST_CONVERGENCE_STATS_FILE')
+    if filename and convergence_stats.get_stats():
+        try:
+            convergence_stats.dump(filename)
+        except IOError, e:
+            LOG.warn('Unable to write convergence stats to %s: %s' % (
+                filename, e))
+
+atexit.register(_dump_convergence_stats)
+
+
+def wait_until(condition, timeout=None, max_attempts=None, is_done=bool,
+               first_delay=FIRST_DELAY, max_delay=None,
+               factor=BACKOFF_FACTOR, jitter=JITTER, on_retry=None,
+               name=None, min_attempts=None):
+    """Calls condition until is_done(result) is true and returns the last
+    result.
+
+    Gives up once timeout seconds have passed since the first attempt, or
+    after max_attempts attempts; one of them has to be set. A last attempt
+    is always made at the deadline, and the timeout does not end the wait
+    before min_attempts attempts, however long the condition takes to run.
+    on_retry is called before every re-attempt. If name is set, the
+    convergence time is recorded under it.
+    """
+    if timeout is None and max_attempts is None:
+        raise ValueError("timeout or max_attempts has to be set")
+    start = time.time()
+    delays = backoff_delays(first_delay, max_delay, factor, jitter)
+    attempts = 0
+    while True:
+        result = condition()
+        attempts += 1
+        if is_done(result):
+            if name:
+                convergence_stats.record(name, time.time() - start, attempts)
+            return result
+        if max_attempts is not None and attempts >= max_attempts:
+            break
+        delay = delays.next()
+        if timeout is not None:
+            remaining = start + timeout - time.time()
+            if remaining > 0:
+                delay = min(delay, remaining)
+            elif min_attempts is None or attempts >= min_attempts:
+                break
+        time.sleep(delay)
+        if on_retry:
+            on_retry()
+    if name:
+        convergence_stats.record(name, time.time() - start, attempts,
+                                 converged=False)
+    return result
+# end wait_until
+
+
+def wait_until_all(conditions, timeout=None, max_attempts=None, is_done=bool,
+                   first_delay=FIRST_DELAY, max_delay=None,
+                   factor=BACKOFF_FACTOR, jitter=JITTER, on_retry=None):
+    """Polls a group of conditions together in one loop.
+
+    conditions is a dictionary of name to callable. Every round calls the
+    conditions which are not done yet, then all of them wait for the same
+    backoff delay; the convergence time of each one is recorded under its
+    name. Returns a dictionary of name to the last result of the condition.
+    """
+    if timeout is None and max_attempts is None:
+        raise ValueError("timeout or max_attempts has to be set")
+    start = time.time()
+    delays = backoff_delays(first_delay, max_delay, factor, jitter)
+    pending = dict(conditions)
+    results = {}
+    attempts = 0
+    while True:
+        attempts += 1
+        for name, condition in pending.items():
+            results[name] = condition()
+            if is_done(results[name]):
+                convergence_stats.record(name, time.time() - start, attempts)
+                del pending[name]
+        if not pending:
+            return results
+        if max_attempts is not None and attempts >= max_attempts:
+            break
+        delay = delays.next()
+        if timeout is not None:
+            remaining = start + timeout - time.time()
+            if remaining <= 0:
+                break
+            delay = min(delay, remaining)
+        time.sleep(delay)
+        if on_retry:
+            on_retry()
+    for name in pending:
+        convergence_stats.record(name, time.time() - start, attempts,
+                                 converged=False)
+    return results
+# end wait_until_all
@@ -1,6 +1,7 @@
 ''' This module provides utils for setting up sdn topology given the topo inputs'''
 import os
 import copy
+from multiprocessing.pool import ThreadPool
 from novaclient import client as mynovaclient
 from novaclient import exceptions as novaException
 import fixtures
@@ -385,15 +386,23 @@ def createVN_Policy_Contrail(self):
 # end createVN_Policy_Contrail
 
 
-def createVMNova(self, option='openstack', vms_on_single_compute=False, VmToNodeMapping=None):
+def createVMNova(self, option='openstack', vms_on_single_compute=False, VmToNodeMapping=None, max_in_flight=None):
+    '''Create the VMs of the topology.
+    With max_in_flight > 1 (or TOPO_VM_IN_FLIGHT set in the environment) the
+    VMs are booted concurrently, at most max_in_flight at a time, and each VM
+    is verified and gets the traffic package as soon as it is up.
+    '''
     self.logger.info("Setup step: Creating VM's")
     sec_gp = []
     self.vm_fixture = {}
     host_list = []
     vm_image_name = os.environ['ci_image'] if os.environ.has_key('ci_image') else 'ubuntu-traffic'
+    if max_in_flight is None:
+        max_in_flight = int(os.environ.get('TOPO_VM_IN_FLIGHT', 1))
     for host in self.inputs.compute_ips:
         host_list.append(self.inputs.host_data[host]['name'])
 
+    new_vm_fixtures = []
     for vm in self.topo.vmc_list:
         if option == 'contrail':
             vn_read = self.vnc_lib.virtual_network_read(
@@ -408,26 +417,20 @@ def createVMNova(self, option='openstack', vms_on_single_compute=False, VmToNode
                 sec_gp = [self.sg_uuid[sg]]
         else:
             pass
+        node_name = None
         if vms_on_single_compute:
-            self.vm_fixture[vm] = self.useFixture(
-                VMFixture(project_name=self.topo.project,
-                          connections=self.project_connections, vn_obj=vn_obj, flavor=self.flavor,
-                          image_name=vm_image_name, vm_name=vm, sg_ids=sec_gp, node_name=host_list[0]))
-        else:
+            node_name = host_list[0]
+        elif VmToNodeMapping is not None:
             # If vm is pinned to a node get the node name from node IP and pass
             # it on to VM creation method.
-            if VmToNodeMapping is not None:
-                IpToNodeName = self.inputs.host_data[
-                    VmToNodeMapping[vm]]['name']
-                self.vm_fixture[vm] = self.useFixture(
-                    VMFixture(project_name=self.topo.project,
-                              connections=self.project_connections, vn_obj=vn_obj, flavor=self.flavor,
-                              image_name=vm_image_name, vm_name=vm, sg_ids=sec_gp, node_name=IpToNodeName))
-            else:
-                self.vm_fixture[vm] = self.useFixture(
-                    VMFixture(project_name=self.topo.project,
-                              connections=self.project_connections, vn_obj=vn_obj, flavor=self.flavor,
-                              image_name=vm_image_name, sg_ids=sec_gp, vm_name=vm))
+            node_name = self.inputs.host_data[VmToNodeMapping[vm]]['name']
+        vm_fixture = VMFixture(project_name=self.topo.project,
+                               connections=self.project_connections, vn_obj=vn_obj, flavor=self.flavor,
+                               image_name=vm_image_name, vm_name=vm, sg_ids=sec_gp, node_name=node_name)
+        if max_in_flight > 1:
+            new_vm_fixtures.append((vm, vm_fixture))
+        else:
+            self.vm_fixture[vm] = self.useFixture(vm_fixture)
 
     # We need to retry following section and scale it up if required (for slower VM environment)
     # TODO: Use @retry annotation instead
@@ -437,54 +440,25 @@ def createVMNova(self, option='openstack', vms_on_single_compute=False, VmToNode
         retry_factor = "1.0"
     retry_count = math.floor(5 * float(retry_factor))
 
+    if max_in_flight > 1:
+        _createVMNovaPipelined(self, new_vm_fixtures, vm_image_name,
+                               retry_count, max_in_flight)
+        # Add compute's VN list to topology object based on VM creation
+        self.topo.__dict__['vn_of_cn'] = self.vn_of_cn
+        return self
+
     # added here 30 seconds sleep
     #import time; time.sleep(30)
     self.logger.info(
         "Setup step: Verify VM status and install Traffic package... ")
     for vm in self.topo.vmc_list:
-        if self.skip_verify == 'no':
-            # Include retry to handle time taken by less powerful computes or
-            # if launching more VMs...
-            retry = 0
-            while True:
-                #vm_verify_out = self.vm_fixture[vm].verify_on_setup()
-                vm_verify_out = self.vm_fixture[vm].wait_till_vm_is_up()
-                retry += 1
-                if vm_verify_out == True or retry > retry_count:
-                    break
-            if vm_verify_out == False:
-                m = "on compute %s - vm %s verify failed after setup" % (self.vm_fixture[vm].vm_node_ip,
-                                                                         self.vm_fixture[vm].vm_name)
-                self.err_msg.append(m)
-                assert vm_verify_out, self.err_msg
-        else:
-            # Even if vm verify is set to skip, run minimum needed
-            # verifications..
-            vm_verify_out = self.vm_fixture[vm].mini_verify_on_setup()
-            if vm_verify_out == False:
-                m = "%s - mini_vm_verify in agent after setup failed" % self.vm_fixture[
-                    vm].vm_node_ip
-                self.err_msg.append(m)
-                assert vm_verify_out, self.err_msg
-
-        vm_node_ip = self.inputs.host_data[
-            self.nova_fixture.get_nova_host_of_vm(self.vm_fixture[vm].vm_obj)]['host_ip']
-        self.vn_of_cn[vm_node_ip].append(self.topo.vn_of_vm[vm])
-
-        # In some less powerful computes, VM takes more time to come up.. including retry...
-        # each call to wait_till_vm_is_up inturn includes 20 retries with 5s
-        # sleep.
-        retry = 0
-        while True:
-            out = self.nova_fixture.wait_till_vm_is_up(
-                self.vm_fixture[vm].vm_obj)
-            retry += 1
-            if out == True or retry > retry_count:
-                break
-        if out == False:
-            assert out, "VM %s failed to come up in node %s" % (vm, vm_node_ip)
-        if vm_image_name == 'ubuntu-traffic':
-            self.vm_fixture[vm].install_pkg("Traffic")
+        vm_node_ip, err = _bringUpVM(self, self.vm_fixture[vm], vm,
+                                     vm_image_name, retry_count)
+        if vm_node_ip:
+            self.vn_of_cn[vm_node_ip].append(self.topo.vn_of_vm[vm])
+        if err:
+            self.err_msg.append(err)
+            assert False, self.err_msg
 
     # Add compute's VN list to topology object based on VM creation
     self.topo.__dict__['vn_of_cn'] = self.vn_of_cn
@@ -492,6 +466,122 @@ def createVMNova(self, option='openstack', vms_on_single_compute=False, VmToNode
 # end createVMNova
 
 
+def _bringUpVM(self, vm_fixture, vm, vm_image_name, retry_count):
+    '''Verify a VM created by createVMNova and install the Traffic package.
+    Returns (compute ip of the VM, error message or None).
+    '''
+    if self.skip_verify == 'no':
+        # Include retry to handle time taken by less powerful computes or
+        # if launching more VMs...
+        retry = 0
+        while True:
+            #vm_verify_out = vm_fixture.verify_on_setup()
+            vm_verify_out = vm_fixture.wait_till_vm_is_up()
+            retry += 1
+            if vm_verify_out == True or retry > retry_count:
+                break
+        if vm_verify_out == False:
+            m = "on compute %s - vm %s verify failed after setup" % (vm_fixture.vm_node_ip,
+                                                                     vm_fixture.vm_name)
+            return (None, m)
+    else:
+        # Even if vm verify is set to skip, run minimum needed
+        # verifications..
+        vm_verify_out = vm_fixture.mini_verify_on_setup()
+        if vm_verify_out == False:
+            m = "%s - mini_vm_verify in agent after setup failed" % vm_fixture.vm_node_ip
+            return (None, m)
+
+    vm_node_ip = self.inputs.host_data[
+        self.nova_fixture.get_nova_host_of_vm(vm_fixture.vm_obj)]['host_ip']
+
+    # In some less powerful computes, VM takes more time to come up.. including retry...
+    # each call to wait_till_vm_is_up inturn includes 20 retries with 5s
+    # sleep.
+    retry = 0
+    while True:
+        out = self.nova_fixture.wait_till_vm_is_up(vm_fixture.vm_obj)
+        retry += 1
+        if out == True or retry > retry_count:
+            break
+    if out == False:
+        return (vm_node_ip, "VM %s failed to come up in node %s" % (vm, vm_node_ip))
+    if vm_image_name == 'ubuntu-traffic':
+        vm_fixture.install_pkg("Traffic")
+    return (vm_node_ip, None)
+# end _bringUpVM
+
+
+def _createVMNovaPipelined(self, vm_fixtures, vm_image_name, retry_count, max_in_flight):
+    '''Boot the VMs concurrently, wait for them to be ACTIVE with one
+    nova list per poll and bring each one up concurrently as soon as it is
+    ACTIVE. Failures are collected per VM and reported together.
+    '''
+    self.logger.info("Setup step: Booting %s VM's, %s at a time, and "
+                     "installing Traffic package... " % (
+                         len(vm_fixtures), max_in_flight))
+    booted = {}
+    results = {}
+
+    def _boot(vm, vm_fixture):
+        try:
+            vm_fixture.setUp()
+        except Exception, e:
+            results[vm] = (None, "VM %s creation failed: %s" % (vm, e))
+            try:
+                vm_fixture.cleanUp()
+            except Exception:
+                pass
+            return
+        booted[vm] = vm_fixture
+
+    def _bring_up(vm, vm_fixture):
+        try:
+            results[vm] = _bringUpVM(self, vm_fixture, vm, vm_image_name,
+                                     retry_count)
+        except Exception, e:
+            results[vm] = (None, "VM %s failed to come up: %s" % (vm, e))
+
+    pool = ThreadPool(max_in_flight)
+    try:
+        pool.map(lambda args: _boot(*args), vm_fixtures)
+        vms = dict((vm_fixture.vm_obj.id, (vm, vm_fixture))
+                   for vm, vm_fixture in booted.items())
+        bringing_up = []
+
+        def _on_active(vm_obj):
+            bringing_up.append(pool.apply_async(_bring_up, vms[vm_obj.id]))
+
+        outcome = self.nova_fixture.wait_till_vms_are_active(
+            [vm_fixture.vm_obj for vm_fixture in booted.values()],
+            on_active=_on_active)
+        for vm_id, (vm, vm_fixture) in vms.items():
+            status = outcome.get(vm_id)
+            if status != 'ACTIVE':
+                results[vm] = (None, "VM %s is in %s state" % (vm, status))
+        for result in bringing_up:
+            result.wait()
+    finally:
+        pool.close()
+        # Register the cleanups in topology order, as useFixture would
+        for vm, vm_fixture in vm_fixtures:
+            if vm in booted:
+                self.addCleanup(vm_fixture.cleanUp)
+                self.vm_fixture[vm] = vm_fixture
+
+    errors = []
+    for vm, vm_fixture in vm_fixtures:
+        vm_node_ip, err = results.get(
+            vm, (None, "VM %s was not brought up" % vm))
+        if vm_node_ip:
+            self.vn_of_cn[vm_node_ip].append(self.topo.vn_of_vm[vm])
+        if err:
+            errors.append(err)
+    self.err_msg.extend(errors)
+    assert not errors, self.err_msg
+# end _createVMNovaPipelined
+
+
 def createPublicVN(self):
     if 'public_vn' in dir(self.topo):
         fip_pool_name = self.inputs.fip_pool_name
@@ -0,0 +1,214 @@
+import os
+import sys
+import time
+import logging as LOG
+from multiprocessing.pool import ThreadPool
+
+sys.path.append(os.path.realpath('tcutils/pkgs/Traffic'))
+from traffic.core.stream import Stream
+from traffic.core.profile import ContinuousProfile
+from traffic.core.helpers import Host, Sender, Receiver, AgentLost, \
+    poll_all
+
+
+class TrafficFlow(object):
+
+    '''One stream of a TrafficMatrix, from src_vm to dport of dst_vm at
+    rate pps; dport is None for icmp. Keeps the counters of every tick.'''
+
+    def __init__(self, name, src_vm, dst_vm, proto, dport, rate,
+                 size=100, chksum=False):
+        self.name = name
+        self.src_vm = src_vm
+        self.dst_vm = dst_vm
+        self.proto = proto
+        self.dport = dport
+        self.rate = rate
+        self.size = size
+        self.chksum = chksum
+        self.sender = None
+        self.receiver = None
+        self.ticks = []
+
+    def profile(self):
+        fields = {'protocol': 'ip', 'proto': self.proto,
+                  'src': self.src_vm.vm_ip, 'dst': self.dst_vm.vm_ip}
+        if self.dport is not None:
+            fields['dport'] = self.dport
+        return ContinuousProfile(stream=Stream(**fields),
+                                 listener=self.dst_vm.vm_ip, size=self.size,
+                                 chksum=self.chksum, pps=self.rate)
+
+    def counters(self):
+        '''Returns the current (sent, received, reordered) of the flow; an
+        icmp flow is received when the sender gets the echo reply.'''
+        if self.proto == 'icmp':
+            return (self.sender.sent, self.sender.recv,
+                    self.receiver.reordered)
+        return (self.sender.sent, self.receiver.recv,
+                self.receiver.reordered)
+
+    def tick(self, timestamp):
+        self.ticks.append((timestamp,) + self.counters())
+
+    def stats(self):
+        '''Returns the loss, rates(pps) and reordering of the flow, from the
+        last tick and the ticks since traffic started.'''
+        sent, recv, reordered = [value or 0 for value in self.counters()]
+        stats = {'src': self.src_vm.vm_ip, 'dst': self.dst_vm.vm_ip,
+                 'proto': self.proto, 'dport': self.dport,
+                 'sent': sent, 'recv': recv, 'lost': max(sent - recv, 0),
+                 'loss_pct': 0.0, 'reordered': reordered,
+                 'tx_rate': 0.0, 'rx_rate': 0.0}
+        if sent:
+            stats['loss_pct'] = round(100.0 * stats['lost'] / sent, 2)
+        # sent and received are counted since each side has results
+        for key, index in (('tx_rate', 1), ('rx_rate', 2)):
+            ticks = [tick for tick in self.ticks if tick[index] is not None]
+            if len(ticks) > 1 and ticks[-1][0] > ticks[0][0]:
+                stats[key] = round(float(ticks[-1][index] - ticks[0][index]) /
+                                   (ticks[-1][0] - ticks[0][0]), 1)
+        return stats
+# end TrafficFlow
+
+
+class TrafficMatrix(object):
+
+    '''Runs many flows between many VM pairs at once.
+
+    entries is a list of (src_vm, dst_vm, proto, ports, rate) of VM
+    fixtures, 'udp'/'tcp'/'icmp', a destination port or list of ports (None
+    for icmp) and the rate in pps; every port is a flow. All the receivers
+    are started, then all the senders, in parallel across the VMs over
+    their traffic agents. tick() takes one snapshot of the counters of all
+    the flows, with one request per VM.
+    '''
+
+    POOL_SIZE = int(os.environ.get('TRAFFIC_MATRIX_POOL_SIZE', 16))
+    # secs to let the packets in transit reach the receivers on stop
+    DRAIN_TIME = 2
+
+    def __init__(self, connections, entries, name='matrix', size=100,
+                 chksum=False, logger=LOG):
+        self.connections = connections
+        self.inputs = connections.inputs
+        self.nova_fixture = connections.nova_fixture
+        self.logger = logger
+        self.hosts = {}
+        self.flows = []
+        for src_vm, dst_vm, proto, ports, rate in entries:
+            if not isinstance(ports, (list, tuple)):
+                ports = [ports]
+            for dport in ports:
+                self.flows.append(TrafficFlow(
+                    '%s%s%s' % (name, proto, len(self.flows)), src_vm,
+                    dst_vm, proto, dport, rate, size, chksum))
+    # end __init__
+
+    def _hosts(self, vm):
+        '''Returns the (compute, VM) Hosts to reach vm through.'''
+        if vm.vm_name not in self.hosts:
+            node_ip = self.inputs.host_data[
+                self.nova_fixture.get_nova_host_of_vm(vm.vm_obj)]['host_ip']
+            self.hosts[vm.vm_name] = (
+                Host(node_ip, self.inputs.username, self.inputs.password),
+                Host(vm.local_ip, vm.vm_username, vm.vm_password))
+        return self.hosts[vm.vm_name]
+
+    def _run_all(self, helpers, method):
+        '''Calls method of all the helpers; helpers of VMs with a traffic
+        agent run in parallel, one thread per VM, the others one by one as
+        they run fabric commands, as do the helpers of a VM whose agent is
+        lost on the way.'''
+        by_vm = {}
+        serial = []
+        for helper in helpers:
+            # connects to the agents one at a time
+            if helper.agent():
+                by_vm.setdefault(helper.rhost.ip, []).append(helper)
+            else:
+                serial.append(helper)
+
+        def run(vm_helpers):
+            for index, helper in enumerate(vm_helpers):
+                try:
+                    getattr(helper, method)()
+                except AgentLost:
+                    return vm_helpers[index:]
+            return []
+        if by_vm:
+            pool = ThreadPool(min(self.POOL_SIZE, len(by_vm)))
+            for vm_helpers in by_vm.values():
+                for helper in vm_helpers:
+                    helper.ssh_fallback = False
+            try:
+                for left in pool.map(run, by_vm.values()):
+                    serial.extend(left)
+            finally:
+                pool.close()
+                for vm_helpers in by_vm.values():
+                    for helper in vm_helpers:
+                        helper.ssh_fallback = True
+        for helper in serial:
+            getattr(helper, method)()
+
+    def start(self):
+        for flow in self.flows:
+            profile = flow.profile()
+            lhost, rhost = self._hosts(flow.src_vm)
+            flow.sender = Sender(flow.name, profile, lhost, rhost,
+                                 self.logger)
+            lhost, rhost = self._hosts(flow.dst_vm)
+            flow.receiver = Receiver(flow.name, profile, lhost, rhost,
+                                     self.logger)
+        self.logger.info('Starting %s traffic flows' % len(self.flows))
+        self._run_all([flow.receiver for flow in self.flows], 'start')
+        self._run_all([flow.sender for flow in self.flows], 'start')
+    # end start
+
+    def tick(self):
+        '''Polls the counters of all the flows at once and records them.'''
+        poll_all([flow.sender for flow in self.flows] +
+                 [flow.receiver for flow in self.flows])
+        now = time.time()
+        for flow in self.flows:
+            flow.tick(now)
+
+    def run(self, duration, interval=5):
+        '''Ticks every interval secs for duration secs.'''
+        end = time.time() + duration
+        while True:
+            self.tick()
+            if time.time() + interval > end:
+                break
+            time.sleep(interval)
+
+    def stop(self):
+        self._run_all([flow.sender for flow in self.flows], 'stop')
+        time.sleep(self.DRAIN_TIME)
+        self._run_all([flow.receiver for flow in self.flows], 'stop')
+        now = time.time()
+        for flow in self.flows:
+            flow.tick(now)
+    # end stop
+
+    def report(self):
+        '''Returns a dictionary of flow name to its stats.'''
+        return dict((flow.name, flow.stats()) for flow in self.flows)
+
+    def verify(self, loss_allow=0):
+        '''Returns the error messages of the flows which lost more than
+        loss_allow packets or did not send any; empty if all are good.'''
+        errors = []
+        for name, stats in sorted(self.report().items()):
+            msg = 'flow %s %s %s->%s:%s sent %s recv %s reordered %s' % (
+                name, stats['proto'], stats['src'], stats['dst'],
+                stats['dport'], stats['sent'], stats['recv'],
+                stats['reordered'])
+            if not stats['sent'] or stats['lost'] > loss_allow:
+                errors.append(msg)
+                self.logger.error(msg)
+            else:
+                self.logger.info(msg)
+        return errors
+# end TrafficMatrix
@@ -8,7 +8,7 @@ sys.path.append(os.path.realpath('tcutils/pkgs/Traffic'))
 from traffic.core.stream import Stream
 from traffic.core.profile import create, ContinuousProfile, ContinuousSportRange
 from traffic.core.helpers import Host
-from traffic.core.helpers import Sender, Receiver
+from traffic.core.helpers import Sender, Receiver, poll_all
 
 
 class trafficTestFixture(fixtures.Fixture):
@@ -127,14 +127,15 @@ class trafficTestFixture(fixtures.Fixture):
                 self.logger.info("Starting %s traffic from %s to %s" %
                                  (self.stream_proto, self.tx_vm_fixture.vm_ip, self.fip))
             self.sender[i].start()
-            retries = 10
+            retries = 50
             j = 0
             self.sender[i].sent = None
             while j < retries and self.sender[i].sent == None:
                 # wait before checking for stats as it takes time for file
-                # update with stats
-                time.sleep(5)
+                # update with stats; polls are cheap over the traffic agent
+                time.sleep(1)
                 self.sender[i].poll()
+                j += 1
             # end while
             if self.sender[i].sent == None:
                 msg = "send %s traffic failure from %s " % (
@@ -165,11 +166,11 @@ class trafficTestFixture(fixtures.Fixture):
         for j in range(poll_cnt):
             stats['poll' + str(j)] = {}
             st = stats['poll' + str(j)]
+            # one request per VM for the counters of all the streams
+            poll_all(self.receiver.values() + self.sender.values())
             for i in range(self.num_streams):
                 st[i] = {}
                 status[i] = {}
-                self.receiver[i].poll()
-                self.sender[i].poll()
                 if self.stream_proto == 'tcp' or self.stream_proto == 'udp':
                     st[i]['sent'] = self.sender[i].sent
                     st[
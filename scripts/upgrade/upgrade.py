@@ -479,11 +479,13 @@ class Upgrade(ResourcedTestCase, testtools.TestCase, ConfigSecGroup):
             time.sleep(90)
             connections.clear()
             self.logger.info('Will REBOOT the SHUTOFF VMs')
+            started_vms = []
             for vm in self.nova_fixture.get_vm_list():
                 if vm.status != 'ACTIVE':
                     self.logger.info('Will Power-On %s' % vm.name)
                     vm.start()
-                    self.nova_fixture.wait_till_vm_is_active(vm)
+                    started_vms.append(vm)
+            self.nova_fixture.wait_till_vms_are_active(started_vms)
 
             run("rm -rf /tmp/temp")
             run("rm -rf /opt/contrail/utils/fabfile/testbeds/testbed.py")
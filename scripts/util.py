@@ -6,21 +6,75 @@ from collections import defaultdict
 from netaddr import *
 import pprint
 from fabric.operations import get, put
-from fabric.api import run
+from fabric.api import run, env
 import logging as log
 import threading
 from functools import wraps
 import errno
 import signal
+import socket
 import uuid
+from paramiko import SSHException
+from tcutils.sshpool import ssh_run, SSHResult, SHELL
+from tcutils.wait import wait_until, FIRST_DELAY
 log.basicConfig(format='%(levelname)s: %(message)s', level=log.DEBUG)
 
+# Callables run by retry/retry_for_value before every re-attempt, e.g. to
+# drop cached introspect responses so the next attempt sees fresh state.
+_retry_hooks = []
+
+
+def add_retry_hook(hook):
+    if hook not in _retry_hooks:
+        _retry_hooks.append(hook)
+# end add_retry_hook
+
+
+def _run_retry_hooks():
+    for hook in _retry_hooks:
+        try:
+            hook()
+        except Exception, e:
+            log.debug('Retry hook %s failed: %s' % (hook, e))
+# end _run_retry_hooks
+
 # Code borrowed from http://wiki.python.org/moin/PythonDecoratorLibrary#Retry
 
 
+def _retry_value(result):
+    if type(result) is tuple:
+        return result[0]
+    if type(result) is dict:
+        return result['result']
+    return result
+
+
+def _wait_args(tries, delay):
+    '''Maps the legacy tries/delay of the retry decorators to wait_until
+    arguments.
+
+    With backoff, the time budget is kept at tries * delay but attempts
+    start after FIRST_DELAY and the delay grows up to twice the given one;
+    the legacy tries + 1 attempts are still made if the function itself
+    is slow. Setting TEST_RETRY_BACKOFF to 0 restores the fixed delay
+    polling.
+    '''
+    backoff = (get_os_env("TEST_RETRY_BACKOFF") or "1") not in ('0', 'false')
+    if not backoff or not delay:
+        return {'max_attempts': tries + 1, 'first_delay': delay,
+                'factor': 1, 'jitter': 0}
+    return {'timeout': tries * delay, 'min_attempts': tries + 1,
+            'first_delay': min(FIRST_DELAY, delay), 'max_delay': 2 * delay}
+# end _wait_args
+
+
 def retry(tries=5, delay=3):
     '''Retries a function or method until it returns True.
     delay sets the initial delay in seconds. 
+
+    The function may also return a (result, msg) tuple or a
+    {'result': result, 'msg': msg} dict; the return value keeps that form.
+    Attempts are paced by tcutils.wait.wait_until, see _wait_args.
     '''
 
     # Update test retry count.
@@ -36,45 +90,22 @@ def retry(tries=5, delay=3):
         raise ValueError("delay must be 0 or greater")
 
     def deco_retry(f):
-        def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay  # make mutable
+        name = '%s.%s' % (f.__module__, f.__name__)
 
-            result = f(*args, **kwargs)  # first attempt
-            rv = result
+        @wraps(f)
+        def f_retry(*args, **kwargs):
+            # nothing read before the poll is trusted
+            _run_retry_hooks()
+            result = wait_until(lambda: f(*args, **kwargs),
+                                is_done=lambda r: _retry_value(r) is True,
+                                on_retry=_run_retry_hooks, name=name,
+                                **_wait_args(tries, delay))
+            rv = bool(_retry_value(result))
             if type(result) is tuple:
-                rv = result[0]
+                return (rv, result[1])
             if type(result) is dict:
-                rv = result['result']
-            while mtries > 0:
-                if rv is True:  # Done on success
-                    if type(result) is tuple:
-                        return (True, result[1])
-                    if type(result) is dict:
-                        return {'result': True, 'msg': result['msg']}
-                    else:
-                        return True
-                mtries -= 1      # consume an attempt
-                time.sleep(mdelay)  # wait...
-
-                result = f(*args, **kwargs)  # Try again
-                rv = result
-                if type(result) is tuple:
-                    rv = result[0]
-                if type(result) is dict:
-                    rv = result['result']
-            if not rv:
-                if type(result) is tuple:
-                    return (False, result[1])
-                if type(result) is dict:
-                    return {'result': False, 'msg': result['msg']}
-                return False  # Ran out of tries :-(
-            else:
-                if type(result) is tuple:
-                    return (True, result[1])
-                if type(result) is dict:
-                    return {'result': True, 'msg': result['msg']}
-                else:
-                    return True
+                return {'result': rv, 'msg': result['msg']}
+            return rv
 
         return f_retry  # true decorator -> decorated function
     return deco_retry  # @retry(arg[, ...]) -> true decorator
@@ -156,7 +187,38 @@ def remove_unwanted_output(text):
 def run_fab_cmd_on_node(host_string, password, cmd, as_sudo=False):
     '''
     Run fab command on a node. Usecase : as part of script running on cfgm node, can run a cmd on VM from compute node
+    The node is reached over a pooled SSH connection tunneled through the
+    current fabric host, falling back to running fab on that host if the
+    tunnel cannot be set up.
     '''
+    (username, host_ip) = host_string.split('@')
+    gateway = None
+    if env.host_string:
+        gateway_string = env.host_string
+        if '@' not in gateway_string:
+            gateway_string = '%s@%s' % (env.user, gateway_string)
+        gateway = (gateway_string, env.password)
+    shell = SHELL
+    if username == 'cirros':
+        shell = '/bin/sh -l -c'
+    try:
+        return ssh_run(host_string, password, cmd, gateway=gateway,
+                       as_sudo=as_sudo, shell=shell,
+                       timeout=env.command_timeout or 120)
+    except socket.timeout:
+        msg = 'Timed out running %s on %s' % (cmd, host_string)
+        log.warn(msg)
+        # like the exit code of timeout(1)
+        return SSHResult('', stderr=msg, return_code=124)
+    except (SSHException, socket.error, EOFError), e:
+        log.debug('Unable to reach %s over pooled SSH (%s), using fab' % (
+            host_string, e))
+    return _run_fab_cmd_via_host(host_string, password, cmd, as_sudo)
+# end run_fab_cmd_on_node
+
+
+def _run_fab_cmd_via_host(host_string, password, cmd, as_sudo=False):
+    '''Run cmd on host_string by running fab on the current fabric host.'''
     cmd = _escape_some_chars(cmd)
     # Fetch fabfile
     put('tcutils/fabfile.py', '~/')
@@ -174,7 +236,7 @@ def run_fab_cmd_on_node(host_string, password, cmd, as_sudo=False):
     output = run(cmd_str)
     real_output = remove_unwanted_output(output)
     return real_output
-# end run_fab_cmd_on_node
+# end _run_fab_cmd_via_host
 
 
 def fab_put_file_to_vm(host_string, password, src, dest):
@@ -191,6 +253,7 @@ def fab_put_file_to_vm(host_string, password, src, dest):
 def retry_for_value(tries=5, delay=3):
     '''Retries a function or method until it returns True.
         delay sets the initial delay in seconds. 
+    Returns the first true value, or the last value if none was.
     '''
     tries = tries * 1.0
     tries = math.floor(tries)
@@ -201,17 +264,16 @@ def retry_for_value(tries=5, delay=3):
         raise ValueError("delay must be greater than 0")
 
     def deco_retry(f):
+        name = '%s.%s' % (f.__module__, f.__name__)
+
+        @wraps(f)
         def f_retry(*args, **kwargs):
-            mtries, mdelay = tries, delay  # make mutable
-            result = None
-            while (mtries > 0):
-                result = f(*args, **kwargs)  # first attempt
-                if result:
-                    return result
-                else:
-                    mtries -= 1      # consume an attempt
-                    time.sleep(mdelay)
-            return result
+            if not tries:
+                return None
+            _run_retry_hooks()
+            return wait_until(lambda: f(*args, **kwargs),
+                              on_retry=_run_retry_hooks, name=name,
+                              **_wait_args(tries - 1, delay))
         return f_retry  # true decorator -> decorated function
     return deco_retry  # @retry(arg[, ...]) -> true decorator
 
@@ -1,12 +1,199 @@
+import os
+import copy
 import json
 import urllib2
+import time
+import threading
+import multiprocessing
 import requests
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from requests.adapters import HTTPAdapter
 import logging as LOG
 from lxml import etree
+from tcutils.introspect_stub import get_recorder
 
 LOG.basicConfig(format='%(levelname)s: %(message)s', level=LOG.INFO)
 
 
+class IntrospectSession (object):
+
+    """Pooled, keep-alive HTTP session for one introspect host:port.
+
+    Sessions are shared process-wide, so every inspect object created for
+    the same host:port (by ContrailConnections or by a fixture) reuses the
+    same TCP connections.
+    Defaults can be overridden with the INTROSPECT_POOL_SIZE,
+    INTROSPECT_KEEP_ALIVE and INTROSPECT_TIMEOUT environment variables.
+    If INTROSPECT_RECORD_DIR is set, the responses which are not streamed
+    are recorded there for tcutils.introspect_stub to replay.
+    """
+    _sessions = {}
+    _lock = threading.Lock()
+    recorder = get_recorder()
+
+    pool_size = int(os.environ.get('INTROSPECT_POOL_SIZE', 10))
+    keep_alive = os.environ.get('INTROSPECT_KEEP_ALIVE',
+                                'true').lower() not in ('0', 'false', 'no')
+    timeout = float(os.environ.get('INTROSPECT_TIMEOUT', 60))
+
+    def __init__(self, ip, port, pool_size=None, keep_alive=None,
+                 timeout=None):
+        self.ip = ip
+        self.port = port
+        if pool_size is not None:
+            self.pool_size = pool_size
+        if keep_alive is not None:
+            self.keep_alive = keep_alive
+        if timeout is not None:
+            self.timeout = timeout
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        if not self.keep_alive:
+            self._session.headers['Connection'] = 'close'
+        self._requests = 0
+        self._count_lock = threading.Lock()
+
+    @classmethod
+    def get_session(cls, ip, port, **kwargs):
+        '''Returns the shared session for ip:port, creating it if needed.'''
+        key = (ip, int(port))
+        with cls._lock:
+            if key not in cls._sessions:
+                cls._sessions[key] = cls(ip, port, **kwargs)
+            return cls._sessions[key]
+
+    @classmethod
+    def close_all(cls):
+        with cls._lock:
+            for session in cls._sessions.values():
+                session.close()
+            cls._sessions.clear()
+
+    @classmethod
+    def get_all_stats(cls):
+        with cls._lock:
+            sessions = cls._sessions.items()
+        return dict(('%s:%s' % key, session.get_stats())
+                    for key, session in sessions)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        with self._count_lock:
+            self._requests += 1
+        if timeout is None:
+            timeout = self.timeout
+        resp = self._session.request(method, url, timeout=timeout, **kwargs)
+        if self.recorder and method == 'GET' and not kwargs.get('stream'):
+            self.recorder.record(self.ip, self.port, url, resp.status_code,
+                                 resp.headers.get('content-type', ''),
+                                 resp.content)
+        return resp
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def _connections(self):
+        count = 0
+        for adapter in set(self._session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                count += pools[key].num_connections
+        return count
+
+    def get_stats(self):
+        '''Returns the request/connection counters of this session.'''
+        connections = self._connections()
+        return {'requests': self._requests,
+                'connections': connections,
+                'reused': max(self._requests - connections, 0)}
+
+    def close(self):
+        self._session.close()
+
+
+class ResponseCache (object):
+
+    """Per-URL cache of introspect responses with TTL and LRU eviction.
+
+    All caches share a generation number; invalidate_all() bumps it so that
+    every cached entry in the process becomes stale at once. util.retry
+    does this before and between attempts so a polling verifier always sees
+    fresh data. Values are copied in and out, so callers may modify what
+    they get without affecting each other.
+    Defaults can be overridden with the INTROSPECT_CACHE_TTL and
+    INTROSPECT_CACHE_SIZE environment variables; a TTL of 0 disables caching.
+    """
+    _generation = 0
+
+    ttl = float(os.environ.get('INTROSPECT_CACHE_TTL', 2))
+    max_entries = int(os.environ.get('INTROSPECT_CACHE_SIZE', 256))
+
+    def __init__(self, ttl=None, max_entries=None):
+        if ttl is not None:
+            self.ttl = ttl
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def invalidate_all(cls):
+        cls._generation += 1
+
+    def get(self, url):
+        '''Returns (True, value) on a hit and (False, None) on a miss.'''
+        if self.ttl <= 0:
+            return (False, None)
+        with self._lock:
+            entry = self._entries.pop(url, None)
+            if entry is not None:
+                value, expires, generation = entry
+                if (generation == ResponseCache._generation and
+                        expires > time.time()):
+                    # re-insert to mark as most recently used
+                    self._entries[url] = entry
+                    self.hits += 1
+                    return (True, copy.deepcopy(value))
+            self.misses += 1
+        return (False, None)
+
+    def put(self, url, value):
+        if self.ttl <= 0 or value is None:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._entries.pop(url, None)
+            self._entries[url] = (value, time.time() + self.ttl,
+                                  ResponseCache._generation)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, url=None):
+        with self._lock:
+            if url is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(url, None)
+
+    def get_stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries)}
+
+
+try:
+    from util import add_retry_hook
+    add_retry_hook(ResponseCache.invalidate_all)
+except ImportError:
+    pass
+
+
 class JsonDrv (object):
     _DEFAULT_HEADERS = {
         'Content-type': 'application/json; charset="UTF-8"',
@@ -28,8 +215,10 @@ class JsonDrv (object):
                 '{"auth":{"passwordCredentials":{"username": "%s", "password": "%s"}, "tenantName":"%s"}}' % (
                     self._args.stack_user, self._args.stack_password,
                     self._args.stack_tenant)
-            response = requests.post(url, data=self._authn_body,
-                                     headers=self._DEFAULT_HEADERS)
+            session = IntrospectSession.get_session(self._args.openstack_ip,
+                                                    self._authn_port)
+            response = session.post(url, data=self._authn_body,
+                                    headers=self._DEFAULT_HEADERS)
             if response.status_code == 200:
                 # plan is to re-issue original request with new token
                 authn_content = json.loads(response.text)
@@ -40,7 +229,7 @@ class JsonDrv (object):
 
     def load(self, url, retry=True):
         self.log.debug("Requesting: %s", url)
-        resp = requests.get(url, headers=self._headers)
+        resp = self._vub.session.get(url, headers=self._headers)
         if resp.status_code == 401:
             if retry:
                 self._auth()
@@ -63,11 +252,40 @@ class XmlDrv (object):
     def load(self, url):
         try:
             self.log.debug("Requesting: %s", url)
-            resp = requests.get(url)
+            resp = self._vub.session.get(url)
             return etree.fromstring(resp.text)
         except requests.ConnectionError, e:
             self.log.error("Socket Connection error: %s", str(e))
             return None
+        except requests.Timeout, e:
+            self.log.error("Request timed out: %s", str(e))
+            return None
+
+    def iterload(self, url, tag):
+        """Streams the elements with tag out of the response of url.
+
+        The response is parsed while it is being received and yields the
+        entries as dictionaries, see EtreeToDict.iter_entries. Stops, after
+        logging it, on an HTTP error or a response that is not valid XML.
+        """
+        self.log.debug("Streaming: %s", url)
+        try:
+            resp = self._vub.session.get(url, stream=True)
+        except (requests.ConnectionError, requests.Timeout), e:
+            self.log.error("Request failed: %s", str(e))
+            return
+        try:
+            if resp.status_code != 200:
+                self.log.error("HTTP error code %d: %s", resp.status_code,
+                               url)
+                return
+            resp.raw.decode_content = True
+            for entry in EtreeToDict(None).iter_entries(resp.raw, tag):
+                yield entry
+        except etree.XMLSyntaxError, e:
+            self.log.error("Unable to parse %s: %s", url, str(e))
+        finally:
+            resp.close()
 
 
 class VerificationUtilBase (object):
@@ -78,11 +296,23 @@ class VerificationUtilBase (object):
         self._port = port
         self._drv = drv(self, logger=logger, args=args)
         self._force_refresh = False
+        self.session = IntrospectSession.get_session(ip, port)
+        self._response_cache = ResponseCache()
+
+    def get_session_stats(self):
+        return self.session.get_stats()
+
+    def get_cache_stats(self):
+        return self._response_cache.get_stats()
+
+    def invalidate_cache(self, path=None):
+        self._response_cache.invalidate(path and self._mk_url_str(path))
 
     def get_force_refresh(self):
         return self._force_refresh
 
     def set_force_refresh(self, force=False):
+        '''While force refresh is set, dict_get bypasses the response cache.'''
         self._force_refresh = force
         return self.get_force_refresh()
 
@@ -94,11 +324,123 @@ class VerificationUtilBase (object):
     def dict_get(self, path=''):
         try:
             if path:
-                return self._drv.load(self._mk_url_str(path))
+                url = self._mk_url_str(path)
+                if not self.get_force_refresh():
+                    hit, value = self._response_cache.get(url)
+                    if hit:
+                        return value
+                value = self._drv.load(url)
+                self._response_cache.put(url, value)
+                return value
         except urllib2.HTTPError:
             return None
     # end dict_get
 
+    def dict_iter(self, path, tag):
+        '''Streams the entries with tag out of an introspect page.
+
+        Unlike dict_get the page is never fully loaded in memory, nor cached;
+        works only with drivers supporting streaming (XmlDrv).
+        '''
+        return self._drv.iterload(self._mk_url_str(path), tag)
+    # end dict_iter
+
+
+class GatherResult (dict):
+
+    """Per node results of IntrospectGather.gather.
+
+    Nodes which raised or did not answer in time are left out and their
+    error is reported in errors instead.
+    """
+
+    def __init__(self):
+        super(GatherResult, self).__init__()
+        self.errors = {}
+        self.elapsed = 0
+
+    def ok(self):
+        return not self.errors
+
+    def failed_nodes(self):
+        return sorted(self.errors.keys())
+
+    def log_errors(self, logger=LOG):
+        for node in self.failed_nodes():
+            logger.warn('Introspect of %s failed: %s' % (node,
+                                                         self.errors[node]))
+
+
+class IntrospectGather (object):
+
+    """Queries a set of inspect objects concurrently.
+
+    inspects is a dictionary of node to inspect object, like the
+    agent_inspect and cn_inspect dictionaries of ContrailConnections.
+    gather() calls the same method on all of them in parallel, so a cluster
+    wide check costs one introspect round trip instead of one per node.
+    Defaults can be overridden with the INTROSPECT_GATHER_POOL_SIZE and
+    INTROSPECT_GATHER_TIMEOUT environment variables.
+    """
+    pool_size = int(os.environ.get('INTROSPECT_GATHER_POOL_SIZE', 32))
+    timeout = float(os.environ.get('INTROSPECT_GATHER_TIMEOUT', 30))
+
+    def __init__(self, inspects, logger=LOG, timeout=None, pool_size=None):
+        self.inspects = inspects
+        self.log = logger
+        self.timeout = timeout or self.timeout
+        self.pool_size = pool_size or self.pool_size
+
+    def gather(self, func, *args, **kwargs):
+        '''Calls func on all the inspect objects concurrently.
+
+        func is either the name of an inspect method, called with args and
+        kwargs, or a callable called as func(node, inspect, *args, **kwargs).
+        Every node gets timeout seconds to answer; returns a GatherResult.
+        '''
+        if isinstance(func, basestring):
+            method = func
+            func = lambda node, inspect, *args, **kwargs: getattr(
+                inspect, method)(*args, **kwargs)
+        result = GatherResult()
+        if not self.inspects:
+            return result
+        start = time.time()
+        nodes = self.inspects.keys()
+        pool_size = min(self.pool_size, len(nodes))
+        pool = ThreadPool(pool_size)
+        try:
+            pending = dict(
+                (node, pool.apply_async(func, (node, self.inspects[node]) +
+                                        args, kwargs))
+                for node in nodes)
+            # nodes queued behind a full pool get their own timeout slot
+            rounds = (len(nodes) + pool_size - 1) / pool_size
+            deadline = start + self.timeout * rounds
+            for node in nodes:
+                try:
+                    result[node] = pending[node].get(
+                        max(deadline - time.time(), 0))
+                except multiprocessing.TimeoutError:
+                    result.errors[node] = 'timed out after %ss' % (
+                        self.timeout)
+                except Exception, e:
+                    result.errors[node] = '%s: %s' % (type(e).__name__, e)
+        finally:
+            # timed out calls are left to finish in the background
+            pool.close()
+        result.elapsed = time.time() - start
+        if result.errors:
+            self.log.debug('Introspect gather: %d of %d nodes failed' % (
+                len(result.errors), len(nodes)))
+        return result
+    # end gather
+
+    def gather_path(self, path):
+        '''Fetches the same introspect page from all the nodes.'''
+        return self.gather('dict_get', path)
+# end IntrospectGather
+
 
 class Result (dict):
 
@@ -126,14 +468,14 @@ class EtreeToDict(object):
         self.xpath = xpath
         self.xml_list = ['policy-rule']
 
-    def _handle_list(self, elems):
-        """Handles the list object in etree."""
+    @staticmethod
+    def _list_value(rvals):
+        """Builds the list object from the dictionaries of its elements."""
         a_list = []
-        for elem in elems.getchildren():
-            rval = self._get_one(elem, a_list)
-            if 'element' in rval.keys():
+        for rval in rvals:
+            if 'element' in rval:
                 a_list.append(rval['element'])
-            elif 'list' in rval.keys():
+            elif 'list' in rval:
                 a_list.append(rval['list'])
             else:
                 a_list.append(rval)
@@ -142,39 +484,69 @@ class EtreeToDict(object):
             return None
         return a_list
 
+    def _handle_list(self, elems):
+        """Handles the list object in etree."""
+        return self._list_value([self._get_one(elem) for elem in elems])
+
     def _get_one(self, xp, a_list=None):
         """Recrusively looks for the entry in etree and converts to dictionary.
 
         Returns a dictionary.
         """
-        val = {}
+        return self._convert(xp)[0]
 
-        child = xp.getchildren()
+    def _convert(self, xp):
+        """Converts xp to dictionary.
+
+        Returns the dictionary and the list of dictionaries of xp's children
+        as _handle_list sees them, so a list is converted only once.
+        """
+        child = list(xp)
         if not child:
-            val.update({xp.tag: xp.text})
-            return val
+            return ({xp.tag: xp.text}, [])
 
+        val = {}
+        list_rvals = []
         for elem in child:
-            if elem.tag == 'list':
-                val.update({xp.tag: self._handle_list(elem)})
-
             if elem.tag == 'data':
                 # Remove CDATA; if present
                 text = elem.text.replace("<![CDATA[<", "<").strip("]]>")
                 nxml = etree.fromstring(text)
-                rval = self._get_one(nxml, a_list)
+                rval = self._get_one(nxml)
+                list_rvals.append(self._get_one(elem))
             else:
-                rval = self._get_one(elem, a_list)
+                rval, elem_rvals = self._convert(elem)
+                list_rvals.append(rval)
+                if elem.tag == 'list':
+                    val[xp.tag] = self._list_value(elem_rvals)
 
             if elem.tag in self.xml_list:
-                val.update({xp.tag: self._handle_list(xp)})
-            if elem.tag in rval.keys():
-                val.update({elem.tag: rval[elem.tag]})
+                val[xp.tag] = self._handle_list(xp)
+            if elem.tag in rval:
+                val[elem.tag] = rval[elem.tag]
             elif 'SandeshData' in elem.tag:
-                val.update({xp.tag: rval})
+                val[xp.tag] = rval
             else:
-                val.update({elem.tag: rval})
-        return val
+                val[elem.tag] = rval
+        return (val, list_rvals)
+
+    def iter_entries(self, source, tag):
+        """Streams the entries with the given tag out of an xml source.
+
+        source is a file like object, e.g. a streamed HTTP response. The xml
+        is parsed incrementally and every element with tag is converted,
+        as _get_one does, as soon as it is complete. Converted elements are
+        freed right away so memory stays flat for large tables.
+
+        Yields a dictionary per element.
+        """
+        for event, elem in etree.iterparse(source, events=('end',), tag=tag):
+            yield self._get_one(elem)
+            elem.clear()
+            parent = elem.getparent()
+            if parent is not None:
+                while elem.getprevious() is not None:
+                    del parent[0]
 
     def get_all_entry(self, path):
         """All entries in the etree is converted to the dictionary
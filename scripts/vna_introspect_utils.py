@@ -2,7 +2,9 @@ import logging as LOG
 
 from verification_util import *
 from vna_results import *
+from route_snapshot import RouteSnapshot
 import re
+import time
 from netaddr import *
 
 LOG.basicConfig(format='%(levelname)s: %(message)s', level=LOG.DEBUG)
@@ -203,11 +205,46 @@ class AgentInspect (VerificationUtilBase):
 
 l[0]={'protocol': '1', 'stats_bytes': '222180', 'stats_packets': '2645', 'setup_time_utc': '1371254131073195', 'sip': '1.1.1.253', 'src_port': '0', 'uuid': '3a95eaa5-87e5-4b37-a49a-15a406db8356', 'nat': 'disabled', 'mirror_port': '0', 'direction': 'ingress', 'implicit_deny': 'no', 'refcount': '4', 'setup_time': '2013-Jun-14 23:55:31.073195', 'vrf': '1', 'dest_vrf': '0', 'interface_idx': '3', 'flow_handle': '54518', 'dst_port': '0', 'action': '32', 'short_flow': 'no', 'dip': '2.1.1.253', 'mirror_ip': '0.0.0.0'}'''
 
-        r = self.dict_get('Snh_FetchAllFlowRecords?')
-        l = []
-        xpath = './flow_list'
-        records = EtreeToDict(xpath).get_all_entry(r)
-        return records['flow_list']
+        records = list(self.dict_iter('Snh_FetchAllFlowRecords?',
+                                      'SandeshFlowData'))
+        return records or None
+
+    def _get_flow_records_page(self, path):
+        '''Returns (list of flow record dicts, next flow_key) of one page of
+        the agent flow table.'''
+        records = []
+        flow_key = None
+        for entry in self.dict_iter(path, ('SandeshFlowData', 'flow_key')):
+            if 'flow_key' in entry:
+                flow_key = entry['flow_key']
+            else:
+                records.append(entry)
+        return (records, flow_key)
+
+    def get_vna_flow_table_snapshot(self, max_pages=1000):
+        '''Pulls the whole flow table of the agent once, following the
+        Snh_NextFlowRecordsSet pages of Snh_FetchAllFlowRecords, and returns
+        it as an indexed VnaFlowTableSnapshot.
+
+        usage: s1 = inspect_h.get_vna_flow_table_snapshot()
+               s1.get(vrf='1', sip='1.1.1.253', dip='2.1.1.253', sport='0',
+                      dport='0', protocol='1')
+               s1.count(vn='default-domain:admin:vn1', action='32')
+               s1.diff(inspect_h.get_vna_flow_table_snapshot())
+        '''
+        snapshot = VnaFlowTableSnapshot(taken_at=time.time())
+        seen_keys = set()
+        records, flow_key = self._get_flow_records_page(
+            'Snh_FetchAllFlowRecords?')
+        for page in range(max_pages):
+            for record in records:
+                snapshot.add(record)
+            if not records or not flow_key or flow_key in seen_keys:
+                break
+            seen_keys.add(flow_key)
+            records, flow_key = self._get_flow_records_page(
+                'Snh_NextFlowRecordsSet?flow_key=' + flow_key)
+        return snapshot
 
     def get_vna_fetchflowrecord(self, vrf=None, sip=None, dip=None, sport=None, dport=None, protocol=None):
         '''http://10.204.216.15:8085/Snh_FetchFlowRecord?vrf=1&sip=1.1.1.253&dip=2.1.1.253&src_port=0&dst_port=0&protocol=1
@@ -358,6 +395,13 @@ l[0]={'protocol': '1', 'stats_bytes': '222180', 'stats_packets': '2645', 'setup_
             return None
     # end get_vna_active_route
 
+    def get_vna_route_snapshot(self, vrf_id):
+        '''Returns a RouteSnapshot of the unicast routes of vrf_id, to
+        look many prefixes up with one request.
+        '''
+        return RouteSnapshot.from_agent(self, vrf_id)
+    # end get_vna_route_snapshot
+
     def _itf_fltr(self, x, _type, value):
         if _type == 'vmi':
             path = './uuid'
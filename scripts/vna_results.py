@@ -126,3 +126,118 @@ class VnaFlowResult (Result):
     '''
         VnaFlowResult to provide access to vna_introspect_utils.get_vna_flow_by_vn
     '''
+
+
+class VnaFlowTableSnapshot (object):
+
+    '''
+        Snapshot of the flow table of an agent, built by
+        vna_introspect_utils.get_vna_flow_table_snapshot.
+
+        Records are stored as dicts of the flow fields, indexed by the
+        5-tuple + vrf key, by VN (source_vn and dest_vn) and by action, so
+        lookups and counts are dictionary hits and diffs are set operations.
+    '''
+    KEY_FIELDS = ('vrf', 'sip', 'dip', 'src_port', 'dst_port', 'protocol')
+
+    def __init__(self, records=[], taken_at=None):
+        self.taken_at = taken_at
+        self._rows = []
+        self._by_key = {}
+        self._by_vn = {}
+        self._by_action = {}
+        for record in records:
+            self.add(record)
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        for i in range(len(self._rows)):
+            yield self._record(i)
+
+    def _record(self, i):
+        return dict(self._rows[i])
+
+    def _key(self, record):
+        return tuple(str(record.get(f)) for f in self.KEY_FIELDS)
+
+    def _index(self, i, record, remove=False):
+        for vn in set([record.get('source_vn'), record.get('dest_vn')]):
+            if vn:
+                self._update(self._by_vn, vn, i, remove)
+        self._update(self._by_action, record.get('action'), i, remove)
+
+    def _update(self, index, value, i, remove):
+        if not remove:
+            index.setdefault(value, []).append(i)
+            return
+        index[value].remove(i)
+        if not index[value]:
+            del index[value]
+
+    def add(self, record):
+        '''Add a flow record dict; a record with the key of an existing one
+        replaces it.'''
+        key = self._key(record)
+        i = self._by_key.get(key)
+        if i is None:
+            i = len(self._rows)
+            self._rows.append(None)
+            self._by_key[key] = i
+        else:
+            self._index(i, self._rows[i], remove=True)
+        self._rows[i] = dict(record)
+        self._index(i, record)
+
+    def get(self, vrf, sip, dip, sport, dport, protocol):
+        '''Returns the flow record for the key, None if not present.'''
+        i = self._by_key.get(tuple(map(str, (vrf, sip, dip, sport, dport,
+                                             protocol))))
+        if i is None:
+            return None
+        return self._record(i)
+
+    def match(self, key, item, expected):
+        '''Like match_item_in_flowrecord, key is the 5-tuple + vrf.'''
+        record = self.get(*key)
+        return bool(record) and record.get(item) == expected
+
+    def keys(self):
+        return set(self._by_key.keys())
+
+    def by_vn(self, vn):
+        return [self._record(i) for i in self._by_vn.get(vn, [])]
+
+    def by_action(self, action):
+        return [self._record(i) for i in self._by_action.get(str(action), [])]
+
+    def count(self, vn=None, action=None):
+        if vn is None and action is None:
+            return len(self._rows)
+        if action is None:
+            return len(self._by_vn.get(vn, []))
+        action_rows = self._by_action.get(str(action), [])
+        if vn is None:
+            return len(action_rows)
+        return len(set(action_rows) & set(self._by_vn.get(vn, [])))
+
+    def diff(self, other, counters=('stats_packets', 'stats_bytes')):
+        '''Compares this (older) snapshot with other (newer) one.
+
+        Returns a dict with the keys of the flows 'added' in and 'removed'
+        from other and, for flows in both, the increase of the counters.
+        '''
+        keys, other_keys = self.keys(), other.keys()
+        deltas = {}
+        for key in keys & other_keys:
+            old, new = self.get(*key), other.get(*key)
+            delta = {}
+            for c in counters:
+                try:
+                    delta[c] = int(new.get(c) or 0) - int(old.get(c) or 0)
+                except ValueError:
+                    continue
+            deltas[key] = delta
+        return {'added': other_keys - keys, 'removed': keys - other_keys,
+                'deltas': deltas}
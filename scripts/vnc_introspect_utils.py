@@ -1,4 +1,9 @@
+import os
+import time
+import weakref
+import threading
 import logging as LOG
+from collections import OrderedDict, defaultdict
 
 from verification_util import *
 from vnc_api_results import *
@@ -6,51 +11,302 @@ from vnc_api_results import *
 LOG.basicConfig(format='%(levelname)s: %(message)s', level=LOG.DEBUG)
 
 
+class ObjectCache (object):
+
+    """LRU bounded cache of API server objects, per object type.
+
+    Objects are keyed by their fq_name path (or id) with a secondary uuid
+    index, expire after the TTL of their type (TYPE_TTL, else ttl) and at
+    most max_entries are kept per type.
+    invalidate() applies to every cache in the process, so a fixture
+    creating or deleting an object drops it from all the VNCApiInspect
+    instances; invalidating a whole type just bumps its generation.
+    Defaults can be overridden with the VNC_CACHE_TTL and VNC_CACHE_SIZE
+    environment variables.
+    """
+    _instances = weakref.WeakSet()
+    _generations = defaultdict(int)
+
+    ttl = float(os.environ.get('VNC_CACHE_TTL', 300))
+    max_entries = int(os.environ.get('VNC_CACHE_SIZE', 1000))
+    # objects of a VM follow the VM lifecycle, keep them shorter
+    TYPE_TTL = {'vm': 60, 'vr': 60, 'vmi': 60, 'iip': 60, 'fip': 60,
+                'ri': 60, 'rt': 60}
+
+    def __init__(self, ttl=None, max_entries=None):
+        if ttl is not None:
+            self.ttl = ttl
+        if max_entries is not None:
+            self.max_entries = max_entries
+        self._entries = defaultdict(OrderedDict)
+        self._uuids = defaultdict(dict)
+        self._lock = threading.Lock()
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        ObjectCache._instances.add(self)
+
+    @staticmethod
+    def _key(fq_path):
+        if isinstance(fq_path, basestring):
+            return fq_path
+        return '::'.join(fq_path)
+
+    @staticmethod
+    def _uuid(obj):
+        try:
+            return obj.uuid()
+        except (AttributeError, KeyError, TypeError):
+            return None
+
+    def _lookup(self, otype, key):
+        # lock held
+        entry = self._entries[otype].pop(key, None)
+        if entry is None:
+            return None
+        obj, expires, generation = entry
+        if (generation != ObjectCache._generations[otype] or
+                expires <= time.time()):
+            self._uuids[otype].pop(self._uuid(obj), None)
+            return None
+        # re-insert to mark as most recently used
+        self._entries[otype][key] = entry
+        return obj
+
+    def _count(self, otype, obj):
+        if obj is None:
+            self.misses[otype] += 1
+        else:
+            self.hits[otype] += 1
+        return obj
+
+    def get(self, otype, fq_path):
+        with self._lock:
+            return self._count(otype, self._lookup(otype, self._key(fq_path)))
+
+    def get_by_uuid(self, otype, uuid):
+        '''Looks up by the object uuid, or objects cached under their id.'''
+        with self._lock:
+            key = self._uuids[otype].get(uuid, uuid)
+            return self._count(otype, self._lookup(otype, key))
+
+    def put(self, otype, fq_path, obj):
+        key = self._key(fq_path)
+        uuid = self._uuid(obj)
+        with self._lock:
+            self._remove(otype, key)
+            self._entries[otype][key] = (
+                obj, time.time() + self.TYPE_TTL.get(otype, self.ttl),
+                ObjectCache._generations[otype])
+            if uuid:
+                self._uuids[otype][uuid] = key
+            while len(self._entries[otype]) > self.max_entries:
+                key, entry = self._entries[otype].popitem(last=False)
+                self._uuids[otype].pop(self._uuid(entry[0]), None)
+
+    def _remove(self, otype, key):
+        # lock held
+        entry = self._entries[otype].pop(key, None)
+        if entry is not None:
+            self._uuids[otype].pop(self._uuid(entry[0]), None)
+
+    def remove(self, otype, fq_path=None, uuid=None):
+        with self._lock:
+            if uuid is not None:
+                self._remove(otype, self._uuids[otype].get(uuid, uuid))
+            if fq_path is not None:
+                self._remove(otype, self._key(fq_path))
+
+    @classmethod
+    def invalidate(cls, otype, fq_path=None, uuid=None):
+        '''Drops an object, by fq_name path and/or uuid, from every cache;
+        drops all the objects of otype if neither is given.'''
+        if fq_path is None and uuid is None:
+            cls._generations[otype] += 1
+            return
+        for cache in list(cls._instances):
+            cache.remove(otype, fq_path, uuid)
+
+    def get_stats(self):
+        with self._lock:
+            otypes = set(self.hits) | set(self.misses) | set(self._entries)
+            by_type = dict((otype, {'hits': self.hits[otype],
+                                    'misses': self.misses[otype],
+                                    'entries': len(self._entries[otype])})
+                           for otype in otypes)
+        return {'hits': sum(s['hits'] for s in by_type.values()),
+                'misses': sum(s['misses'] for s in by_type.values()),
+                'entries': sum(s['entries'] for s in by_type.values()),
+                'types': by_type}
+# end ObjectCache
+
+
 class VNCApiInspect (VerificationUtilBase):
 
+    # max number of uuids per bulk read request
+    BULK_BATCH = 100
+    # Detail lists return only the properties and refs of the objects; the
+    # children and back refs used from the objects read in bulk are asked
+    # for with fields. An object missing one of BULK_REQUIRED is not
+    # complete, e.g. the API server does not support fields, and is read
+    # with a GET instead.
+    BULK_FIELDS = {
+        'domain': ['projects'],
+        'virtual-machine': ['virtual_machine_interface_back_refs',
+                            'virtual_router_back_refs'],
+        'virtual-machine-interface': ['instance_ip_back_refs',
+                                      'floating_ip_back_refs'],
+    }
+    BULK_REQUIRED = {
+        'domain': ['projects'],
+        'virtual-machine': ['virtual_machine_interface_back_refs'],
+        'virtual-machine-interface': ['instance_ip_back_refs'],
+    }
+
     def __init__(self, ip, logger=LOG, args=None):
         super(VNCApiInspect, self).__init__(
             ip, 8082, logger=logger, args=args)
-        self._cache = {
-            'domain': {},
-            'project': {},
-            'ipam': {},
-            'policy': {},
-            'vn': {},
-            'fip_alloc_pool': {},
-            'fip_use_pool': {},
-            'vm': {},
-            'vr': {},
-            'vmi': {},
-            'iip': {},
-            'fip': {},
-            'ri': {},
-            'rt': {},
-            'secgrp': {},
-            'si': {},
-            'st': {},
-            'dns': {},
-            'dns_rec': {},
-        }
+        # objects are cached below and honour the per-call refresh flag,
+        # so responses from the API server are not cached in dict_get
+        self._response_cache = ResponseCache(ttl=0)
+        self._cache = ObjectCache()
 
     def update_cache(self, otype, fq_path, d):
-        self._cache[otype]['::'.join(fq_path)] = d
+        self._cache.put(otype, fq_path, d)
 
     def try_cache(self, otype, fq_path, refresh):
-        p = None
-        try:
-            if not (refresh or self.get_force_refresh()):
-                p = self._cache[otype]['::'.join(fq_path)]
-        except KeyError:
-            pass
-        return p
+        if refresh or self.get_force_refresh():
+            return None
+        return self._cache.get(otype, fq_path)
 
     def try_cache_by_id(self, otype, uuid, refresh):
-        if not (refresh or self.get_force_refresh()):
-            for p in self._cache[otype].values():
-                if p.uuid() == uuid:
-                    return p
-        return None
+        if refresh or self.get_force_refresh():
+            return None
+        return self._cache.get_by_uuid(otype, uuid)
+
+    def invalidate_object(self, otype, fq_path=None, uuid=None):
+        '''To be called when an object is created or deleted, see
+        ObjectCache.invalidate.'''
+        ObjectCache.invalidate(otype, fq_path, uuid)
+
+    def get_cache_stats(self):
+        return self._cache.get_stats()
+
+    def bulk_read(self, otype, uuids=None, field='obj_uuids'):
+        '''
+            Reads objects of otype (e.g. 'virtual-network') with a single
+            detail list query instead of one GET per object.
+            uuids optionally filters on field, which is one of the list
+            filters of the API server: obj_uuids, parent_id or back_ref_id;
+            they are sent BULK_BATCH per request.
+            The children and back refs of BULK_FIELDS are requested too.
+            Returns the objects as a GET of each would, or None if the API
+            server does not support detail list queries; see is_complete.
+        '''
+        resource = otype + 's'
+        if uuids is None:
+            batches = [None]
+        else:
+            uuids = list(uuids)
+            batches = [uuids[i:i + self.BULK_BATCH]
+                       for i in range(0, len(uuids), self.BULK_BATCH)]
+        objs = []
+        for batch in batches:
+            path = '%s?detail=True' % resource
+            if otype in self.BULK_FIELDS:
+                path += '&fields=%s' % ','.join(self.BULK_FIELDS[otype])
+            if batch:
+                path += '&%s=%s' % (field, ','.join(batch))
+            d = self.dict_get(path)
+            try:
+                # without detail support only the refs are listed
+                if not all(otype in obj for obj in d[resource]):
+                    raise KeyError(otype)
+                objs.extend(d[resource])
+            except (KeyError, TypeError):
+                self.log.debug('Detail list of %s not supported by API '
+                               'server %s' % (resource, self._ip))
+                return None
+        return objs
+    # end bulk_read
+
+    def is_complete(self, otype, obj):
+        '''Returns True if obj, read with bulk_read, has the fields of
+        BULK_REQUIRED, i.e. it can be used as the GET of the object.'''
+        return all(field in obj[otype]
+                   for field in self.BULK_REQUIRED.get(otype, []))
+
+    def _read_links(self, otype, links):
+        '''Reads the objects of the links, in their order, with bulk_read;
+        falls back to reading them one by one.'''
+        if len(links) < 2 or None in links:
+            return [self.dict_get(link) for link in links]
+        uuids = [link.rstrip('/').rsplit('/', 1)[-1] for link in links]
+        objs = self.bulk_read(otype, uuids)
+        if not objs or not all(self.is_complete(otype, obj) for obj in objs):
+            return [self.dict_get(link) for link in links]
+        objs = dict((obj[otype]['uuid'], obj) for obj in objs)
+        return [objs[uuid] for uuid in uuids if uuid in objs]
+    # end _read_links
+
+    def prefetch_vms(self, vm_ids):
+        '''
+            Reads the virtual-machines of vm_ids along with their virtual
+            router, interfaces and instance IPs with a few bulk reads, and
+            caches them for get_cs_vm, get_cs_vr_of_vm, get_cs_vmi_of_vm and
+            get_cs_instance_ips_of_vm.
+            Returns False if the API server does not support bulk reads.
+        '''
+        vms = self.bulk_read('virtual-machine', vm_ids)
+        if vms is None:
+            return False
+        vmi_ids = {}
+        vr_ids = {}
+        for vm in vms:
+            if not self.is_complete('virtual-machine', vm):
+                # read on demand
+                continue
+            vm_id = vm['virtual-machine']['uuid']
+            self.update_cache('vm', vm_id, CsVMResult(vm))
+            links = (vm['virtual-machine'].get('virtual_machine_interfaces') or
+                     vm['virtual-machine'].get(
+                         'virtual_machine_interface_back_refs') or [])
+            vmi_ids[vm_id] = [link['uuid'] for link in links]
+            vr_refs = vm['virtual-machine'].get('virtual_router_back_refs')
+            if vr_refs:
+                vr_ids[vm_id] = vr_refs[0]['uuid']
+
+        vrs = dict((vr['virtual-router']['uuid'], vr) for vr in
+                   self.bulk_read('virtual-router', set(vr_ids.values())) or [])
+        for vm_id, vr_id in vr_ids.items():
+            if vr_id in vrs:
+                self.update_cache('vr', vm_id, CsVrOfVmResult(vrs[vr_id]))
+
+        vmis = dict((vmi['virtual-machine-interface']['uuid'], vmi) for vmi in
+                    self.bulk_read('virtual-machine-interface',
+                                   sum(vmi_ids.values(), [])) or []
+                    if self.is_complete('virtual-machine-interface', vmi))
+        iip_ids = {}
+        for vmi_id, vmi in vmis.items():
+            iip_refs = vmi['virtual-machine-interface'].get(
+                'instance_ip_back_refs')
+            if iip_refs:
+                iip_ids[vmi_id] = iip_refs[0]['uuid']
+        iips = dict((iip['instance-ip']['uuid'], iip) for iip in
+                    self.bulk_read('instance-ip', iip_ids.values()) or [])
+
+        for vm_id, vm_vmi_ids in vmi_ids.items():
+            # cache only complete sets, anything else is read on demand
+            if not vm_vmi_ids or not all(vmi_id in vmis
+                                         for vmi_id in vm_vmi_ids):
+                continue
+            self.update_cache('vmi', vm_id, [CsVmiOfVmResult(vmis[vmi_id])
+                                             for vmi_id in vm_vmi_ids])
+            if all(iip_ids.get(vmi_id) in iips for vmi_id in vm_vmi_ids):
+                self.update_cache('iip', vm_id, [
+                    CsIipOfVmResult(iips[iip_ids[vmi_id]])
+                    for vmi_id in vm_vmi_ids])
+        return True
+    # end prefetch_vms
 
     def get_cs_domain(self, domain='default-domain', refresh=False):
         '''
@@ -60,7 +316,16 @@ class VNCApiInspect (VerificationUtilBase):
         '''
         d = self.try_cache('domain', [domain], refresh)
         if not d:
-            # cache miss
+            # cache miss, read all the domains in one go if possible
+            doms = self.bulk_read('domain')
+            if doms is not None and all(self.is_complete('domain', dd)
+                                        for dd in doms):
+                for dd in doms:
+                    dom = CsDomainResult(dd)
+                    self.update_cache('domain', [dom.name()], dom)
+                    if dom.name() == domain:
+                        d = dom
+                return d
             doms = self.dict_get('domains')
             mydom = filter(lambda x: x['fq_name'][-1] == domain,
                            doms['domains'])
@@ -73,7 +338,7 @@ class VNCApiInspect (VerificationUtilBase):
         return d
 
     def get_cs_project(self, domain='default-domain', project='admin',
-                       refresh=True):
+                       refresh=False):
         '''
             method: get_cs_project find a project by domin & project name
             returns None if not found, a dict w/ project attrib. eg:
@@ -376,9 +641,8 @@ class VNCApiInspect (VerificationUtilBase):
             # cache miss
             vm = self.get_cs_vm(vm_id, refresh)
             if vm:
-                links = vm.vmi_links()
-                for link in links:
-                    pp.append(self.dict_get(link))
+                pp = self._read_links('virtual-machine-interface',
+                                      vm.vmi_links())
             if pp:
                 p = []
                 for vmi in pp:
@@ -398,8 +662,8 @@ class VNCApiInspect (VerificationUtilBase):
             # cache miss
             vmi_objs = self.get_cs_vmi_of_vm(vm_id, refresh)
             if vmi_objs:
-                for vmi_obj in vmi_objs:
-                    pp.append(self.dict_get(vmi_obj.ip_link()))
+                pp = self._read_links('instance-ip',
+                                      [vmi_obj.ip_link() for vmi_obj in vmi_objs])
             if pp:
                 p = []
                 for ip_obj in pp:
@@ -438,9 +702,9 @@ class VNCApiInspect (VerificationUtilBase):
         '''
         p = self.try_cache_by_id('ri', vn_id, refresh)
         if not p:
-            pp = CsRiResult({'routing_instances': []})
-            for rl in self.get_cs_vn_by_id(vn_id, refresh).ri_links():
-                pp['routing_instances'].append(self.dict_get(rl))
+            pp = CsRiResult({'routing_instances': self._read_links(
+                'routing-instance',
+                list(self.get_cs_vn_by_id(vn_id, refresh).ri_links()))})
             if pp['routing_instances']:
                 p = pp
                 self.update_cache('ri', vn_id, p)